@@ -0,0 +1,823 @@
+import csv
+import os
+import sqlite3
+import threading
+import uuid
+from collections import deque
+
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.feather as feather
+    import pyarrow.parquet as pq
+except ImportError:
+    # Sólo hace falta para importar/exportar Parquet o Feather
+    pa = None
+
+from indice_espacial import IndiceEspacial
+from metricas import METRICAS
+
+# Almacenes de ubicaciones. AlmacenCSV conserva el formato original de un
+# solo archivo; AlmacenSQLite usa una base embebida en modo WAL con clave
+# primaria, índice por tipo e índice espacial (R*Tree) sobre lat/lon.
+
+COLUMNAS = [
+    "id",
+    "lat",
+    "lon",
+    "tipo",
+    "comentario",
+    "puntuacion",
+    "razon_validacion",
+]
+# Lecturas masivas por bloques con tipos compactos: coordenadas en float32
+# (~1 m de precisión) y el tipo como categoría en lugar de cadenas repetidas
+BLOQUE_FILAS = 50000
+DTYPES_COMPACTOS = {
+    "id": "int64",
+    "lat": "float32",
+    "lon": "float32",
+    "tipo": "category",
+    "puntuacion": "float32",
+}
+# Los mismos tipos sin perder precisión, para exportar
+DTYPES_EXACTOS = dict(
+    DTYPES_COMPACTOS, lat="float64", lon="float64", puntuacion="float64"
+)
+# Celda del índice espacial en memoria de todas las ubicaciones (consultas por
+# radio y separación mínima de las predicciones)
+INDICE_CELDA_M = 250.0
+
+METRICAS.describir(
+    "nestguesser_almacen_segundos", "Duración de las operaciones del almacén"
+)
+
+
+def _puntuacion(valor):
+    if valor is None or valor == "N/A" or valor == "":
+        return None
+    try:
+        return float(valor)
+    except (TypeError, ValueError):
+        return None
+
+
+class RegistroCambios:
+    # Historial acotado de altas y bajas para que el mapa se actualice por
+    # deltas. La sesión cambia en cada arranque: un cliente con otra sesión o
+    # con una versión ya descartada debe recargar todo.
+    def __init__(self, max_eventos=10000):
+        self.sesion = uuid.uuid4().hex[:12]
+        self.version = 0
+        self.eventos = deque(maxlen=max_eventos)
+        self.lock = threading.Lock()
+
+    def registrar_altas(self, filas):
+        with self.lock:
+            for fila in filas:
+                self.version += 1
+                self.eventos.append((self.version, ["+"] + list(fila)))
+
+    def registrar_bajas(self, ids):
+        with self.lock:
+            for uid in ids:
+                self.version += 1
+                self.eventos.append((self.version, ["-", int(uid)]))
+
+    def actual(self):
+        with self.lock:
+            return self.sesion, self.version
+
+    def desde(self, sesion, version):
+        # Devuelve (version_actual, eventos) o None si hace falta recarga completa
+        with self.lock:
+            if sesion != self.sesion or version > self.version:
+                return None
+            if self.eventos and version < self.eventos[0][0] - 1:
+                return None
+            if not self.eventos and version != self.version:
+                return None
+            return self.version, [e for v, e in self.eventos if v > version]
+
+
+def compactar(df, dtypes=DTYPES_COMPACTOS):
+    df = df.copy()
+    for col, dtype in dtypes.items():
+        if col in df:
+            if col == "puntuacion":
+                df[col] = pd.to_numeric(df[col], errors="coerce")
+            df[col] = df[col].astype(dtype)
+    return df
+
+
+def preparar_importacion(df, tipo=None):
+    # Completa las columnas que falten y descarta coordenadas inválidas;
+    # devuelve (filas válidas, número de descartadas)
+    faltan = {"lat", "lon"} - set(df.columns)
+    if faltan:
+        raise ValueError(f"Faltan columnas: {', '.join(sorted(faltan))}")
+    df = df.copy()
+    df["lat"] = pd.to_numeric(df["lat"], errors="coerce")
+    df["lon"] = pd.to_numeric(df["lon"], errors="coerce")
+    ok = df["lat"].between(-90, 90) & df["lon"].between(-180, 180)
+    defectos = {
+        "tipo": "Avistamiento",
+        "comentario": "",
+        "puntuacion": "N/A",
+        "razon_validacion": "Importado",
+    }
+    for col, defecto in defectos.items():
+        df[col] = df[col].astype(object).fillna(defecto) if col in df else defecto
+    if tipo:
+        df["tipo"] = tipo
+    return df.loc[ok, COLUMNAS[1:]], int((~ok).sum())
+
+
+def _requiere_pyarrow():
+    if pa is None:
+        raise RuntimeError("Parquet y Feather requieren pyarrow (pip install pyarrow)")
+
+
+def leer_columnar(path, columnas=None):
+    # Parquet o Feather abiertos como memory map; devuelve una tabla de Arrow
+    _requiere_pyarrow()
+    if path.lower().endswith(".feather"):
+        return feather.read_table(path, columns=columnas, memory_map=True)
+    return pq.read_table(path, columns=columnas, memory_map=True)
+
+
+def leer_fuente(path, columnas=None, tamano=BLOQUE_FILAS):
+    # Recorre un archivo de ubicaciones por bloques de `tamano` filas
+    if path.lower().endswith((".parquet", ".feather")):
+        tabla = leer_columnar(path, columnas)
+        for i in range(0, tabla.num_rows, tamano):
+            yield tabla.slice(i, tamano).to_pandas()
+        return
+    usecols = (lambda c: c in columnas) if columnas else None
+    with pd.read_csv(path, usecols=usecols, chunksize=tamano) as lector:
+        yield from lector
+
+
+def _a_arrow(df):
+    # Categorías como texto: el esquema no depende de las de cada bloque
+    tipos = {c: str for c in df.columns if isinstance(df[c].dtype, pd.CategoricalDtype)}
+    return pa.Table.from_pandas(df.astype(tipos), preserve_index=False)
+
+
+def exportar_bloques(bloques, path):
+    # Escribe según la extensión (.csv, .jsonl, .json, .parquet, .feather) sin
+    # reunir los bloques en memoria; Feather se escribe de una vez y sin
+    # comprimir para poder abrirlo luego como memory map. Devuelve las filas.
+    ext = os.path.splitext(path)[1].lower()
+    filas = 0
+    if ext == ".parquet":
+        _requiere_pyarrow()
+        escritor = None
+        try:
+            for df in bloques:
+                tabla = _a_arrow(df)
+                if escritor is None:
+                    escritor = pq.ParquetWriter(path, tabla.schema)
+                escritor.write_table(tabla.cast(escritor.schema))
+                filas += len(df)
+        finally:
+            if escritor is not None:
+                escritor.close()
+    elif ext == ".feather":
+        _requiere_pyarrow()
+        tablas = [_a_arrow(df) for df in bloques]
+        if tablas:
+            tabla = pa.concat_tables([t.cast(tablas[0].schema) for t in tablas])
+            feather.write_feather(tabla, path, compression="uncompressed")
+            filas = tabla.num_rows
+    else:
+        with open(path, "w", newline="", encoding="utf-8") as f:
+            if ext == ".json":
+                f.write("[")
+            for df in bloques:
+                if ext == ".jsonl":
+                    if len(df):
+                        # 15 cifras (el máximo de pandas): por defecto son 10 y
+                        # se pierden decimales de coordenadas y puntuaciones
+                        df.to_json(
+                            f,
+                            orient="records",
+                            lines=True,
+                            force_ascii=False,
+                            double_precision=15,
+                        )
+                elif ext == ".json":
+                    if len(df):
+                        f.write(
+                            ("," if filas else "")
+                            + df.to_json(
+                                orient="records",
+                                force_ascii=False,
+                                double_precision=15,
+                            )[1:-1]
+                        )
+                else:
+                    df.to_csv(f, index=False, header=filas == 0)
+                filas += len(df)
+            if ext == ".json":
+                f.write("]")
+    return filas
+
+
+def _fila_compacta(uid, r):
+    return [int(uid), round(float(r["lat"]), 6), round(float(r["lon"]), 6), r["tipo"]]
+
+
+class AlmacenUbicaciones:
+    backend = None
+
+    def __init__(self):
+        self.cambios = RegistroCambios()
+        self._indice = None
+        self._indice_lock = threading.Lock()
+        self._marca_indice = None
+
+    def _medir(self, op):
+        return METRICAS.medir(
+            "nestguesser_almacen_segundos", op=op, backend=self.backend
+        )
+
+    def _registrar_altas(self, filas):
+        # filas: [id, lat, lon, tipo]; van al registro de cambios y al índice
+        filas = list(filas)
+        self.cambios.registrar_altas(filas)
+        if self._indice is not None and filas:
+            ids, lats, lons = zip(*(f[:3] for f in filas))
+            self._indice.agregar(lats, lons, ids)
+
+    def _registrar_bajas(self, ids):
+        ids = [int(i) for i in ids]
+        self.cambios.registrar_bajas(ids)
+        if self._indice is not None and ids:
+            self._indice.quitar(ids)
+
+    def indice_espacial(self):
+        # Se construye la primera vez que se pide y se mantiene con cada alta
+        # y baja de este almacén
+        with self._indice_lock:
+            if self._indice is None:
+                indice = IndiceEspacial(INDICE_CELDA_M)
+                self._marca_indice = self._marca()
+                for df in self.leer_por_bloques(["id", "lat", "lon"], compactos=False):
+                    indice.agregar(df["lat"], df["lon"], df["id"])
+                self._indice = indice
+            return self._indice
+
+    def refrescar_indice(self):
+        # Añade al índice las altas de otros procesos que comparten el almacén
+        # (las de este ya están); devuelve cuántas. Sus bajas no se ven: la
+        # separación mínima sólo peca de prudente
+        with self._indice_lock:
+            if self._indice is None:
+                return 0
+            marca = self._marca()
+            if marca is not None and marca == self._marca_indice:
+                return 0
+            df = self._filas_desde(self._marca_indice)
+            self._marca_indice = marca
+            nuevas = df[~df["id"].isin(self._indice.ids)]
+            if len(nuevas):
+                self._indice.agregar(nuevas["lat"], nuevas["lon"], nuevas["id"])
+            return len(nuevas)
+
+    def _marca(self):
+        # Valor que cambia cuando otro proceso da de alta filas; None si no
+        # hay forma barata de saberlo
+        return None
+
+    def _filas_desde(self, marca):
+        # (id, lat, lon) de las filas que pueden faltar en el índice
+        return self.leer(["id", "lat", "lon"])
+
+    def leer(self, columnas=None, tipos=None):
+        raise NotImplementedError
+
+    def leer_por_bloques(
+        self, columnas=None, tipos=None, tamano=BLOQUE_FILAS, compactos=True
+    ):
+        dtypes = DTYPES_COMPACTOS if compactos else DTYPES_EXACTOS
+        df = self.leer(columnas, tipos)
+        for i in range(0, len(df), tamano):
+            yield compactar(df.iloc[i : i + tamano], dtypes)
+
+    def insertar(self, registros):
+        # registros: dicts con las columnas de COLUMNAS salvo "id"; devuelve los ids
+        raise NotImplementedError
+
+    def insertar_bloque(self, df):
+        # Alta masiva desde un DataFrame con las columnas de COLUMNAS salvo "id"
+        return len(self.insertar(df.to_dict("records")))
+
+    def eliminar(self, ids):
+        raise NotImplementedError
+
+    def siguiente_id(self):
+        raise NotImplementedError
+
+    def obtener(self, uid):
+        df = self.leer()
+        rows = df[df["id"] == uid]
+        return None if rows.empty else rows.iloc[0].to_dict()
+
+    def consultar_bbox(self, min_lat, min_lon, max_lat, max_lon, columnas=None):
+        df = self.leer(columnas)
+        return df[
+            df["lat"].between(min_lat, max_lat) & df["lon"].between(min_lon, max_lon)
+        ]
+
+    def consultar_radio(self, lat, lon, radio_m, columnas=None):
+        # Ubicaciones a menos de radio_m, de la más cercana a la más lejana
+        ids = self.indice_espacial().cerca(lat, lon, radio_m)
+        return self._por_ids(ids, columnas)
+
+    def _por_ids(self, ids, columnas=None):
+        # Filas de esos ids, en el mismo orden
+        df = self.leer(list(dict.fromkeys(["id"] + list(columnas or COLUMNAS))))
+        df = df[df["id"].isin(ids)]
+        orden = pd.Series(range(len(ids)), index=ids)
+        df = df.iloc[orden[df["id"]].to_numpy().argsort(kind="stable")]
+        return df[columnas or COLUMNAS].reset_index(drop=True)
+
+    def contar(self):
+        return len(self.leer(["id"]))
+
+    def contar_por_tipo(self):
+        return {
+            str(k): int(v)
+            for k, v in self.leer(["tipo"])["tipo"].value_counts().items()
+        }
+
+    def cerrar_conexion_hilo(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class AlmacenCSV(AlmacenUbicaciones):
+    backend = "csv"
+
+    def __init__(self, path):
+        super().__init__()
+        self.path = path
+        self.lock = threading.RLock()
+
+    def _marca(self):
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return st.st_mtime_ns, st.st_size
+
+    @staticmethod
+    def _usecols(columnas, tipos):
+        if not columnas:
+            return None
+        return list(dict.fromkeys(list(columnas) + (["tipo"] if tipos else [])))
+
+    def leer(self, columnas=None, tipos=None):
+        with self.lock, self._medir("leer"):
+            try:
+                df = pd.read_csv(self.path, usecols=self._usecols(columnas, tipos))
+            except (FileNotFoundError, pd.errors.EmptyDataError):
+                df = pd.DataFrame(columns=COLUMNAS)
+        if tipos:
+            df = df[df["tipo"].isin(tipos)]
+        return df[columnas] if columnas else df
+
+    def leer_por_bloques(
+        self, columnas=None, tipos=None, tamano=BLOQUE_FILAS, compactos=True
+    ):
+        dtypes = DTYPES_COMPACTOS if compactos else DTYPES_EXACTOS
+        try:
+            lector = pd.read_csv(
+                self.path, usecols=self._usecols(columnas, tipos), chunksize=tamano
+            )
+        except (FileNotFoundError, pd.errors.EmptyDataError):
+            return
+        with lector:
+            for df in lector:
+                if tipos:
+                    df = df[df["tipo"].isin(tipos)]
+                yield compactar(df[columnas] if columnas else df, dtypes)
+
+    def siguiente_id(self):
+        with self.lock:
+            try:
+                df = pd.read_csv(self.path, usecols=["id"])
+                return 1 if df.empty else int(df["id"].max()) + 1
+            except (FileNotFoundError, pd.errors.EmptyDataError):
+                return 1
+
+    def insertar(self, registros):
+        with self.lock, self._medir("insertar"):
+            first_id = self.siguiente_id()
+            ids = list(range(first_id, first_id + len(registros)))
+            with open(self.path, "a", newline="", encoding="utf-8") as f:
+                csv.writer(f).writerows(
+                    [uid] + [r.get(c, "") for c in COLUMNAS[1:]]
+                    for uid, r in zip(ids, registros)
+                )
+            self._registrar_altas(
+                _fila_compacta(uid, r) for uid, r in zip(ids, registros)
+            )
+            return ids
+
+    def insertar_bloque(self, df):
+        with self.lock, self._medir("insertar"):
+            first_id = self.siguiente_id()
+            df = df.reindex(columns=COLUMNAS[1:])
+            df.insert(0, "id", range(first_id, first_id + len(df)))
+            df.to_csv(self.path, mode="a", header=False, index=False)
+            self._registrar_altas(
+                _fila_compacta(r["id"], r)
+                for r in df[["id", "lat", "lon", "tipo"]].to_dict("records")
+            )
+            return len(df)
+
+    def eliminar(self, ids):
+        with self.lock, self._medir("eliminar"):
+            df = self.leer()
+            mask = df["id"].isin(ids)
+            if mask.any():
+                df[~mask].to_csv(self.path, index=False)
+                self._registrar_bajas(df.loc[mask, "id"])
+            return int(mask.sum())
+
+
+class AlmacenSQLite(AlmacenUbicaciones):
+    backend = "sqlite"
+
+    def __init__(self, path):
+        super().__init__()
+        self.path = path
+        self.write_lock = threading.Lock()
+        self._local = threading.local()
+        self._conexiones = []
+        conn = self._conn()
+        with self.write_lock:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("""CREATE TABLE IF NOT EXISTS ubicaciones (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    lat REAL NOT NULL,
+                    lon REAL NOT NULL,
+                    tipo TEXT NOT NULL,
+                    comentario TEXT,
+                    puntuacion REAL,
+                    razon_validacion TEXT
+                )""")
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_ubicaciones_tipo ON ubicaciones (tipo)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS meta (clave TEXT PRIMARY KEY, valor TEXT)"
+            )
+            self.rtree = self._crear_rtree(conn)
+            conn.execute("COMMIT")
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # Una conexión por hilo: el servidor HTTP y la GUI no se bloquean al leer
+            conn = sqlite3.connect(
+                self.path, timeout=30, isolation_level=None, check_same_thread=False
+            )
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=30000")
+            self._local.conn = conn
+            with self.write_lock:
+                self._conexiones.append(conn)
+        return conn
+
+    def cerrar_conexion_hilo(self):
+        # Los hilos de corta vida (una petición HTTP, un trabajo) cierran su
+        # conexión al terminar para no acumular conexiones abiertas
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            return
+        self._local.conn = None
+        with self.write_lock:
+            if conn in self._conexiones:
+                self._conexiones.remove(conn)
+        conn.close()
+
+    @staticmethod
+    def _crear_rtree(conn):
+        try:
+            conn.execute("""CREATE VIRTUAL TABLE IF NOT EXISTS ubicaciones_rtree
+                USING rtree(id, min_lat, max_lat, min_lon, max_lon)""")
+        except sqlite3.OperationalError:
+            # SQLite compilado sin R*Tree: índice compuesto como alternativa
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_ubicaciones_latlon ON ubicaciones (lat, lon)"
+            )
+            return False
+        conn.execute("""CREATE TRIGGER IF NOT EXISTS ubicaciones_rtree_ins
+            AFTER INSERT ON ubicaciones BEGIN
+                INSERT INTO ubicaciones_rtree VALUES (NEW.id, NEW.lat, NEW.lat, NEW.lon, NEW.lon);
+            END""")
+        conn.execute("""CREATE TRIGGER IF NOT EXISTS ubicaciones_rtree_del
+            AFTER DELETE ON ubicaciones BEGIN
+                DELETE FROM ubicaciones_rtree WHERE id = OLD.id;
+            END""")
+        return True
+
+    def _select(self, columnas):
+        cols = columnas or COLUMNAS
+        return ", ".join(f"u.{c}" for c in cols)
+
+    @staticmethod
+    def _normalizar(df):
+        # Igual que con read_csv: las puntuaciones vacías quedan como NaN
+        if "puntuacion" in df:
+            df["puntuacion"] = pd.to_numeric(df["puntuacion"], errors="coerce")
+        return df
+
+    def _consulta(self, columnas, tipos):
+        sql = f"SELECT {self._select(columnas)} FROM ubicaciones u"
+        params = []
+        if tipos:
+            sql += f" WHERE u.tipo IN ({', '.join('?' * len(tipos))})"
+            params = list(tipos)
+        return sql + " ORDER BY u.id", params
+
+    def leer(self, columnas=None, tipos=None):
+        sql, params = self._consulta(columnas, tipos)
+        with self._medir("leer"):
+            return self._normalizar(pd.read_sql_query(sql, self._conn(), params=params))
+
+    def leer_por_bloques(
+        self, columnas=None, tipos=None, tamano=BLOQUE_FILAS, compactos=True
+    ):
+        dtypes = DTYPES_COMPACTOS if compactos else DTYPES_EXACTOS
+        sql, params = self._consulta(columnas, tipos)
+        for df in pd.read_sql_query(sql, self._conn(), params=params, chunksize=tamano):
+            yield compactar(self._normalizar(df), dtypes)
+
+    def obtener(self, uid):
+        df = self._normalizar(
+            pd.read_sql_query(
+                f"SELECT {self._select(None)} FROM ubicaciones u WHERE u.id = ?",
+                self._conn(),
+                params=(int(uid),),
+            )
+        )
+        return None if df.empty else df.iloc[0].to_dict()
+
+    def consultar_bbox(self, min_lat, min_lon, max_lat, max_lon, columnas=None):
+        if self.rtree:
+            sql = (
+                f"SELECT {self._select(columnas)} FROM ubicaciones u "
+                "JOIN ubicaciones_rtree r ON r.id = u.id "
+                "WHERE r.min_lat >= ? AND r.max_lat <= ? "
+                "AND r.min_lon >= ? AND r.max_lon <= ? ORDER BY u.id"
+            )
+        else:
+            sql = (
+                f"SELECT {self._select(columnas)} FROM ubicaciones u "
+                "WHERE u.lat BETWEEN ? AND ? AND u.lon BETWEEN ? AND ? ORDER BY u.id"
+            )
+        return self._normalizar(
+            pd.read_sql_query(
+                sql, self._conn(), params=(min_lat, max_lat, min_lon, max_lon)
+            )
+        )
+
+    def _por_ids(self, ids, columnas=None):
+        ids = [int(i) for i in ids]
+        cols = list(dict.fromkeys(["id"] + list(columnas or COLUMNAS)))
+        if not ids:
+            return pd.DataFrame(columns=columnas or COLUMNAS)
+        partes = []
+        for i in range(0, len(ids), 500):
+            lote = ids[i : i + 500]
+            partes.append(
+                pd.read_sql_query(
+                    f"SELECT {self._select(cols)} FROM ubicaciones u "
+                    f"WHERE u.id IN ({', '.join('?' * len(lote))})",
+                    self._conn(),
+                    params=lote,
+                )
+            )
+        df = pd.concat(partes, ignore_index=True)
+        # En el orden pedido (por distancia en consultar_radio)
+        orden = pd.Series(range(len(ids)), index=ids)
+        df = df.iloc[orden[df["id"]].to_numpy().argsort(kind="stable")]
+        return self._normalizar(df[columnas or COLUMNAS].reset_index(drop=True))
+
+    def contar(self):
+        return self._conn().execute("SELECT COUNT(*) FROM ubicaciones").fetchone()[0]
+
+    def contar_por_tipo(self):
+        return dict(
+            self._conn()
+            .execute("SELECT tipo, COUNT(*) FROM ubicaciones GROUP BY tipo")
+            .fetchall()
+        )
+
+    def _marca(self):
+        # Los ids de AUTOINCREMENT nunca se reutilizan
+        (max_id,) = (
+            self._conn()
+            .execute("SELECT COALESCE(MAX(id), 0) FROM ubicaciones")
+            .fetchone()
+        )
+        return max_id
+
+    def _filas_desde(self, marca):
+        return pd.read_sql_query(
+            "SELECT id, lat, lon FROM ubicaciones WHERE id > ?",
+            self._conn(),
+            params=(marca or 0,),
+        )
+
+    def siguiente_id(self):
+        (max_id,) = self._conn().execute("SELECT MAX(id) FROM ubicaciones").fetchone()
+        (seq,) = (
+            self._conn()
+            .execute(
+                "SELECT COALESCE(MAX(seq), 0) FROM sqlite_sequence WHERE name = 'ubicaciones'"
+            )
+            .fetchone()
+        )
+        return max(max_id or 0, seq) + 1
+
+    def _insertar_filas(self, conn, registros, con_id):
+        # Dentro de una transacción abierta por quien llama
+        ids = []
+        for r in registros:
+            valores = [
+                r["lat"],
+                r["lon"],
+                r["tipo"],
+                r.get("comentario", ""),
+                _puntuacion(r.get("puntuacion")),
+                r.get("razon_validacion", ""),
+            ]
+            if con_id:
+                cur = conn.execute(
+                    "INSERT INTO ubicaciones (id, lat, lon, tipo, comentario, "
+                    "puntuacion, razon_validacion) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    [int(r["id"])] + valores,
+                )
+            else:
+                cur = conn.execute(
+                    "INSERT INTO ubicaciones (lat, lon, tipo, comentario, "
+                    "puntuacion, razon_validacion) VALUES (?, ?, ?, ?, ?, ?)",
+                    valores,
+                )
+            ids.append(cur.lastrowid)
+        return ids
+
+    def insertar(self, registros, con_id=False):
+        conn = self._conn()
+        with self.write_lock, self._medir("insertar"):
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                ids = self._insertar_filas(conn, registros, con_id)
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            self._registrar_altas(
+                _fila_compacta(uid, r) for uid, r in zip(ids, registros)
+            )
+        return ids
+
+    def insertar_bloque(self, df):
+        df = df.reindex(columns=COLUMNAS[1:])
+
+        def texto(col):
+            return df[col].astype(object).where(df[col].notna(), "").tolist()
+
+        filas = list(
+            zip(
+                df["lat"].astype(float).tolist(),
+                df["lon"].astype(float).tolist(),
+                df["tipo"].astype(str).tolist(),
+                texto("comentario"),
+                [_puntuacion(v) for v in df["puntuacion"].tolist()],
+                texto("razon_validacion"),
+            )
+        )
+        conn = self._conn()
+        with self.write_lock, self._medir("insertar"):
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                (ultimo,) = conn.execute(
+                    "SELECT COALESCE(MAX(id), 0) FROM ubicaciones"
+                ).fetchone()
+                conn.executemany(
+                    "INSERT INTO ubicaciones (lat, lon, tipo, comentario, "
+                    "puntuacion, razon_validacion) VALUES (?, ?, ?, ?, ?, ?)",
+                    filas,
+                )
+                # AUTOINCREMENT: las filas nuevas tienen ids mayores que cualquiera previo
+                nuevas = conn.execute(
+                    "SELECT id, lat, lon, tipo FROM ubicaciones WHERE id > ? ORDER BY id",
+                    (ultimo,),
+                ).fetchall()
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            self._registrar_altas(
+                [uid, round(lat, 6), round(lon, 6), tipo]
+                for uid, lat, lon, tipo in nuevas
+            )
+        return len(filas)
+
+    def eliminar(self, ids):
+        conn = self._conn()
+        ids = [int(i) for i in ids]
+        with self.write_lock, self._medir("eliminar"):
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                borrados = []
+                for i in range(0, len(ids), 500):
+                    lote = ids[i : i + 500]
+                    marcas = ", ".join("?" * len(lote))
+                    borrados += [
+                        row[0]
+                        for row in conn.execute(
+                            f"SELECT id FROM ubicaciones WHERE id IN ({marcas})", lote
+                        )
+                    ]
+                    conn.execute(
+                        f"DELETE FROM ubicaciones WHERE id IN ({marcas})", lote
+                    )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            self._registrar_bajas(borrados)
+        return len(borrados)
+
+    def importar_csv(self, csv_path):
+        # Importa el CSV heredado una sola vez; las bajas posteriores no lo reimportan
+        conn = self._conn()
+        if conn.execute("SELECT 1 FROM meta WHERE clave = 'csv_importado'").fetchone():
+            return 0
+        registros = []
+        if os.path.exists(csv_path):
+            with open(csv_path, "r", newline="", encoding="utf-8") as f:
+                for row in csv.DictReader(f):
+                    try:
+                        row["lat"], row["lon"] = float(row["lat"]), float(row["lon"])
+                    except (KeyError, TypeError, ValueError):
+                        continue
+                    registros.append(row)
+        ids = [str(r.get("id", "")) for r in registros]
+        con_id = all(i.isdigit() for i in ids) and len(set(ids)) == len(ids)
+        with self.write_lock, self._medir("insertar"):
+            # Marca y filas en una sola transacción: otro proceso que arranque a
+            # la vez ve la marca y no importa dos veces, y un fallo no deja
+            # el CSV a medias ni marcado sin importar
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                if conn.execute(
+                    "SELECT 1 FROM meta WHERE clave = 'csv_importado'"
+                ).fetchone():
+                    conn.execute("ROLLBACK")
+                    return 0
+                nuevos = self._insertar_filas(conn, registros, con_id)
+                conn.execute(
+                    "INSERT OR REPLACE INTO meta (clave, valor) "
+                    "VALUES ('csv_importado', ?)",
+                    (os.path.abspath(csv_path),),
+                )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            self._registrar_altas(
+                _fila_compacta(uid, r) for uid, r in zip(nuevos, registros)
+            )
+        return len(registros)
+
+    def close(self):
+        with self.write_lock:
+            conexiones, self._conexiones = self._conexiones, []
+        for conn in conexiones:
+            try:
+                conn.close()
+            except sqlite3.ProgrammingError:
+                pass
+        self._local = threading.local()
+
+
+def crear_almacen(backend, db_path, csv_path):
+    if backend == "csv":
+        return AlmacenCSV(csv_path)
+    if backend == "sqlite":
+        store = AlmacenSQLite(db_path)
+        store.importar_csv(csv_path)
+        return store
+    raise ValueError(f"Backend de almacenamiento desconocido: {backend}")
@@ -1,60 +1,402 @@
-import tkinter as tk
-from tkinter import messagebox, Frame, Label, Entry, Button, StringVar, OptionMenu
+try:
+    import tkinter as tk
+    from tkinter import messagebox, Frame, Label, Entry, Button, StringVar, OptionMenu
+except ImportError:
+    # Servidores sin Tk: la interfaz no está disponible, pero cli.py sí
+    tk = None
 import csv
 import os
 import folium
 import webbrowser
 import pandas as pd
 from folium.plugins import MarkerCluster
+from branca.element import MacroElement
+from jinja2 import Template
 import numpy as np
 import http.server
-import socketserver
+import sqlite3
 import threading
 from urllib.parse import urlparse, parse_qs
+from datetime import datetime
 import requests
 import time
 import queue
+import json
+import html
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from functools import partial
+from cache_espacial import CacheEspacial
+from raster_presas import RasterPresas
+from indice_bosque import IndiceBosque
+from muestreo import MuestreadorCandidatos
+from modelos_muestreo import (
+    ModeloMezcla,
+    seleccionar_modelo,
+    gaussiana,
+    mezcla_gaussiana,
+    kde_grupos,
+)
+from modelo_elevacion import ModeloElevacion
+from clasificador_suelo import ClasificadorSuelo, NOMBRES as CLASES_EXCLUIDAS, LIBRE
+from pipeline_validacion import (
+    PipelineValidacion,
+    Etapa,
+    ErrorEtapa,
+    ACEPTADO,
+    RECHAZADO,
+    RESULTADO_ERROR,
+)
+from historial_validacion import HistorialValidacion
+from indice_espacial import EspaciadoMinimo
+from trabajos import ColaTrabajos, COMPLETADO, FALLIDO
+from almacenamiento import crear_almacen, COLUMNAS
+from metricas import METRICAS
+from pesos_comentarios import PesosComentarios
+from clientes_http import ClienteUpstream, Circuito
 
 # --- CONFIGURACIÓN ---
 CSV_FILE = "ubicaciones_aguilas.csv"
+# Columnas que necesita la generación de predicciones (sólo se leen los nidos)
+COLUMNAS_GENERACION = ["id", "lat", "lon", "tipo", "comentario"]
+# "sqlite" (recomendado) o "csv"; con sqlite el CSV se importa la primera vez
+STORAGE_BACKEND = "sqlite"
+DB_FILE = "ubicaciones_aguilas.db"
+# Resumen JSON de cada generación, junto al CSV
+RUN_SUMMARY_ENABLED = True
+# El mapa es una página fija que pide los puntos al servidor local y consulta
+# los cambios cada MAP_POLL_INTERVAL_MS
+MAP_FILE = "mapa_gestion_aguilas.html"
+MAP_POLL_INTERVAL_MS = 3000
+MARKER_STYLES = {
+    "Nido probable": ("red", "home"),
+    "Avistamiento": ("blue", "eye-open"),
+    "Generado Potencial": ("green", "star"),
+}
+DEFAULT_MARKER_STYLE = ("purple", "question-sign")
+SERVER_HOST = "127.0.0.1"
 SERVER_PORT = 8080
+# El mapa lo sirve el propio servidor, así que sus llamadas son del mismo
+# origen y no hace falta CORS. Sólo se atienden peticiones dirigidas a estos
+# nombres (evita el DNS rebinding) y, si traen Origin, desde el propio servidor
+SERVER_ALLOWED_HOSTS = ("127.0.0.1", "localhost")
 ELEVATION_API_URL = "https://api.open-meteo.com/v1/elevation"
 REVERSE_GEO_API_URL = "https://nominatim.openstreetmap.org/reverse"
 OVERPASS_API_URL = "https://overpass-api.de/api/interpreter"
 GBIF_API_URL = "https://api.gbif.org/v1/occurrence/search"
 PREY_TAXA = ["Bradypus", "Choloepus", "Alouatta", "Cebus", "Sapajus"]
+# Candidatos validándose en paralelo durante la generación
+MAX_WORKERS_VALIDACION = 8
+# Peticiones por segundo permitidas a cada servicio externo
+UPSTREAM_RATE_LIMITS = {
+    ELEVATION_API_URL: 10.0,
+    REVERSE_GEO_API_URL: 1.0,
+    OVERPASS_API_URL: 2.0,
+    GBIF_API_URL: 10.0,
+}
+# Peticiones que cada servicio admite de golpe (Nominatim no admite ráfagas)
+UPSTREAM_BURST = {
+    ELEVATION_API_URL: 5,
+    REVERSE_GEO_API_URL: 1,
+    OVERPASS_API_URL: 1,
+    GBIF_API_URL: 5,
+}
+# Reintentos ante 429/5xx y errores de red, con espera exponencial y jitter
+UPSTREAM_MAX_RETRIES = 3
+UPSTREAM_BACKOFF_BASE = 0.5
+UPSTREAM_BACKOFF_MAX = 30.0
+# Tras CIRCUIT_FAILURE_THRESHOLD fallos seguidos el servicio se pausa (la pausa
+# se duplica en cada reapertura); si hay que esperar más de CIRCUIT_MAX_WAIT_S
+# las peticiones fallan en el acto
+CIRCUIT_FAILURE_THRESHOLD = 5
+CIRCUIT_PAUSE_S = 15.0
+CIRCUIT_PAUSE_MAX_S = 300.0
+CIRCUIT_MAX_WAIT_S = 60.0
+# Peso de cada nido según su comentario: las claves de confianza alta
+# multiplican el peso, las de confianza baja le suman (mínimo 0.1); un nido
+# sin comentario pesa 0.5
+COMMENT_WEIGHTS_HIGH = {
+    "nido": 3.0,
+    "pichón": 2.5,
+    "adulto en nido": 3.5,
+    "llevando presa": 2.0,
+    "construyendo": 2.5,
+    "pareja": 2.0,
+}
+COMMENT_WEIGHTS_LOW = {
+    "lejos": -0.5,
+    "no estoy seguro": -1.0,
+    "canto lejano": -0.8,
+    "creo que": -0.5,
+    "posiblemente": -0.4,
+}
+# Caché en disco de las consultas externas, por celda lat/lon
+USE_SPATIAL_CACHE = True
+CACHE_FILE = "cache_espacial.sqlite"
+# Tamaño de celda en grados para cada servicio (~111 m por 0.001°)
+CACHE_PRECISION = {
+    ELEVATION_API_URL: 0.001,
+    REVERSE_GEO_API_URL: 0.001,
+    OVERPASS_API_URL: 0.0005,
+    GBIF_API_URL: 0.02,
+}
+# Vigencia en segundos de cada entrada
+CACHE_TTL = {
+    ELEVATION_API_URL: 365 * 86400,
+    REVERSE_GEO_API_URL: 30 * 86400,
+    OVERPASS_API_URL: 30 * 86400,
+    GBIF_API_URL: 7 * 86400,
+}
+CACHE_MAX_ENTRIES = 200000
+# Raster de densidad de presas precalculado una vez por ejecución
+PREY_RASTER_ENABLED = True
+PREY_RASTER_RES_DEG = 0.01
+# Con más ocurrencias en la región no se precarga y se consulta por punto.
+# GBIF no pagina más allá de offset + limit = 100000, y 300 es su máximo por
+# página: hasta ~334 peticiones, frente a una por candidato sin raster
+PREY_RASTER_MAX_RECORDS = 100000
+GBIF_PAGE_SIZE = 300
+# Descarga única de polígonos de bosque para la región de muestreo
+FOREST_PREFETCH_ENABLED = True
+FOREST_INDEX_DIR = "cache_bosques"
+FOREST_INDEX_TTL = 30 * 86400
+FOREST_PREFETCH_MAX_SPAN_DEG = 1.5
+FOREST_PREFETCH_GRID_DEG = 0.05
+# Rejilla local de agua y poblados (de OSM) para la región de muestreo: la
+# etapa de geocodificación inversa sólo consulta Nominatim fuera de ella. Las
+# rejillas importadas a mano (prefijo "importado_") no caducan.
+LANDUSE_PREFETCH_ENABLED = True
+LANDUSE_INDEX_DIR = "cache_suelo"
+LANDUSE_INDEX_TTL = 30 * 86400
+LANDUSE_GRID_RES_DEG = 0.0005
+LANDUSE_PREFETCH_MAX_SPAN_DEG = 1.5
+# Muestreo por lotes: tamaño del lote, celda de deduplicación (~50 m) y
+# fracción de cada lote (la de mayor densidad) que pasa a validación
+SAMPLE_BATCH_SIZE = 4096
+SAMPLE_CELL_DEG = 0.0005
+SAMPLE_KEEP_FRACTION = 0.5
+# Modelos de la distribución de nidos que se comparan en cada generación
+# (gaussiana global, mezclas de 2 a SAMPLING_MIXTURE_MAX_K componentes y KDE
+# por grupo de DBSCAN). Se elige por validación cruzada: la parte de sus
+# muestras que cae a menos de SAMPLING_HOLDOUT_RADIUS_KM de un nido reservado,
+# por la parte que pasa las capas locales (suelo, bosque, DEM)
+SAMPLING_MODELS = ["gaussiana", "mezcla", "kde_grupos"]
+SAMPLING_MIXTURE_MAX_K = 5
+SAMPLING_DBSCAN_EPS_KM = 5.0
+SAMPLING_DBSCAN_MIN_NESTS = 3
+SAMPLING_CV_FOLDS = 5
+SAMPLING_HOLDOUT_RADIUS_KM = 5.0
+# Historial de validaciones (SQLite): se guarda el resultado de cada candidato
+# validado y, por celda de ACCEPTANCE_CELL_DEG, una Beta(aceptados + a,
+# rechazos + b) con prior ACCEPTANCE_PRIOR. Los candidatos nuevos se ordenan
+# por densidad x aceptación esperada, y los de celdas con al menos
+# ACCEPTANCE_MIN_OBS resultados y aceptación esperada < ACCEPTANCE_SKIP_BELOW
+# (agua, poblado, sin bosque) no se validan
+ACCEPTANCE_HISTORY_ENABLED = True
+ACCEPTANCE_DB_FILE = "historial_validacion.sqlite"
+ACCEPTANCE_CELL_DEG = 0.0025
+ACCEPTANCE_PRIOR = (1.0, 1.0)
+ACCEPTANCE_MIN_OBS = 2
+ACCEPTANCE_SKIP_BELOW = 0.3
+# Cola persistente de trabajos de generación (SQLite, ver trabajos.py): cada
+# punto aceptado se guarda al validarse y el estado del muestreo cada
+# JOB_CHECKPOINT_EVERY candidatos. Los trabajos interrumpidos se reanudan al
+# volver a abrir la aplicación (o con 'python -m cli trabajos ejecutar'); uno
+# en curso sin latido en JOB_STALE_S segundos se da por abandonado
+JOBS_DB_FILE = "trabajos.sqlite"
+JOB_CHECKPOINT_EVERY = 20
+JOBS_CONCURRENT = 1
+JOB_STALE_S = 600
+# Separación mínima (m) de cada predicción frente a las ubicaciones guardadas y
+# a las demás predicciones de la misma ejecución. Se comprueba antes de validar,
+# con el índice espacial del almacén; 0 la desactiva
+PREDICTION_MIN_SPACING_M = 250.0
+# Prefiltro de elevación: los candidatos se consultan por lotes (la API admite
+# hasta 100 coordenadas por petición) y los de agua se descartan en bloque
+ELEVATION_PREFILTER_ENABLED = True
+ELEVATION_BATCH_SIZE = 100
+# Descartes permitidos por cada intento de la ejecución (agua en el prefiltro,
+# separación mínima). Son baratos y no cuentan como intentos, pero sin tope una
+# región toda de agua o ya llena de puntos no terminaría nunca
+CANDIDATE_MAX_DISCARDS_PER_TRY = 10
+# DEM local opcional (.npy + .json, ver modelo_elevacion.py): los puntos que
+# cubre no consultan la API de elevación
+DEM_FILE = None
+
+
+def _nombre_servicio(url):
+    return {
+        ELEVATION_API_URL: "elevacion",
+        REVERSE_GEO_API_URL: "geo_inversa",
+        OVERPASS_API_URL: "overpass",
+        GBIF_API_URL: "gbif",
+    }.get(url, urlparse(url).netloc)
+
+
+_clientes = {}
+_clientes_lock = threading.Lock()
+
+
+def _cliente(url):
+    # Un cliente (sesión, límite, circuito) por servicio, creado al primer uso
+    with _clientes_lock:
+        cliente = _clientes.get(url)
+        if cliente is None:
+            cliente = _clientes[url] = ClienteUpstream(
+                _nombre_servicio(url),
+                rate=UPSTREAM_RATE_LIMITS.get(url),
+                burst=UPSTREAM_BURST.get(url, 1),
+                reintentos=UPSTREAM_MAX_RETRIES,
+                backoff_base=UPSTREAM_BACKOFF_BASE,
+                backoff_max=UPSTREAM_BACKOFF_MAX,
+                circuito=Circuito(
+                    CIRCUIT_FAILURE_THRESHOLD,
+                    CIRCUIT_PAUSE_S,
+                    CIRCUIT_PAUSE_MAX_S,
+                    CIRCUIT_MAX_WAIT_S,
+                ),
+                pool=MAX_WORKERS_VALIDACION,
+            )
+        return cliente
+
+
+def _peticion(metodo, url, **kwargs):
+    return _cliente(url).peticion(metodo, url, **kwargs)
+
+
+_spatial_cache = None
+_spatial_cache_lock = threading.Lock()
+
+
+def get_spatial_cache():
+    global _spatial_cache
+    if not USE_SPATIAL_CACHE:
+        return None
+    with _spatial_cache_lock:
+        if _spatial_cache is None:
+            _spatial_cache = CacheEspacial(
+                CACHE_FILE, CACHE_PRECISION, CACHE_TTL, CACHE_MAX_ENTRIES
+            )
+            METRICAS.registrar_fuente(_metricas_cache)
+        return _spatial_cache
+
+
+_historial = None
+_historial_lock = threading.Lock()
+
+
+def get_historial():
+    global _historial
+    if not ACCEPTANCE_HISTORY_ENABLED:
+        return None
+    with _historial_lock:
+        if _historial is None:
+            _historial = HistorialValidacion(
+                ACCEPTANCE_DB_FILE,
+                ACCEPTANCE_CELL_DEG,
+                ACCEPTANCE_PRIOR,
+                ACCEPTANCE_MIN_OBS,
+                ACCEPTANCE_SKIP_BELOW,
+            )
+        return _historial
+
+
+_cola_trabajos = None
+_cola_trabajos_lock = threading.Lock()
+
+
+def get_cola_trabajos():
+    global _cola_trabajos
+    with _cola_trabajos_lock:
+        if _cola_trabajos is None:
+            _cola_trabajos = ColaTrabajos(JOBS_DB_FILE, JOB_STALE_S)
+        return _cola_trabajos
+
+
+METRICAS.describir("nestguesser_cache_aciertos", "Aciertos de la caché espacial")
+METRICAS.describir("nestguesser_cache_fallos", "Fallos de la caché espacial")
+METRICAS.describir(
+    "nestguesser_cache_tasa_aciertos", "Proporción de aciertos de la caché espacial"
+)
+METRICAS.describir(
+    "nestguesser_prefiltro_elevacion_total",
+    "Candidatos del prefiltro de elevación rechazados o sin dato",
+)
+METRICAS.describir(
+    "nestguesser_geo_inversa_fuente_total",
+    "Clasificaciones de suelo resueltas en local o con Nominatim",
+)
+METRICAS.describir(
+    "nestguesser_seleccion_modelo_segundos", "Duración de la selección de modelo"
+)
+METRICAS.describir("nestguesser_muestreo_segundos", "Duración de cada lote de muestreo")
+METRICAS.describir(
+    "nestguesser_descartados_espaciado_total",
+    "Candidatos descartados por estar cerca de otro punto",
+)
+METRICAS.describir("nestguesser_candidatos_total", "Candidatos validados")
+METRICAS.describir("nestguesser_aceptados_total", "Predicciones aceptadas")
+
+
+def _metricas_cache():
+    cache = _spatial_cache
+    if cache is None:
+        return []
+    medidas = []
+    for url, s in cache.estadisticas().items():
+        servicio = _nombre_servicio(url)
+        medidas += [
+            ("nestguesser_cache_aciertos", {"servicio": servicio}, s["hits"]),
+            ("nestguesser_cache_fallos", {"servicio": servicio}, s["misses"]),
+            ("nestguesser_cache_tasa_aciertos", {"servicio": servicio}, s["hit_rate"]),
+        ]
+    return medidas
+
+
+def _cache_get(url, lat, lon, extra=""):
+    cache = get_spatial_cache()
+    return cache.get(url, lat, lon, extra) if cache else None
+
+
+def _cache_put(url, lat, lon, value, extra=""):
+    cache = get_spatial_cache()
+    if cache:
+        cache.put(url, lat, lon, value, extra)
+
+
+_dem = None
+_dem_path = None
+_dem_lock = threading.Lock()
+
+
+def get_dem():
+    global _dem, _dem_path
+    if not DEM_FILE:
+        return None
+    with _dem_lock:
+        if _dem_path != DEM_FILE:
+            _dem_path = DEM_FILE
+            try:
+                _dem = ModeloElevacion.cargar(DEM_FILE)
+            except (OSError, ValueError, KeyError) as e:
+                print(f"No se pudo cargar el DEM {DEM_FILE}: {e}")
+                _dem = None
+        return _dem
+
+
+# Guarda el peso de cada fila por id entre generaciones
+_pesos_comentarios = PesosComentarios(COMMENT_WEIGHTS_HIGH, COMMENT_WEIGHTS_LOW)
 
 
 def calculate_comment_weight(comment):
-    if not isinstance(comment, str):
-        return 0.5
-    comment = comment.lower()
-    weight = 1.0
-    high_confidence = {
-        "nido": 3.0,
-        "pichón": 2.5,
-        "adulto en nido": 3.5,
-        "llevando presa": 2.0,
-        "construyendo": 2.5,
-        "pareja": 2.0,
-    }
-    low_confidence = {
-        "lejos": -0.5,
-        "no estoy seguro": -1.0,
-        "canto lejano": -0.8,
-        "creo que": -0.5,
-        "posiblemente": -0.4,
-    }
-    for k, v in high_confidence.items():
-        if k in comment:
-            weight *= v
-    for k, v in low_confidence.items():
-        if k in comment:
-            weight += v
-    return max(0.1, weight)
+    return _pesos_comentarios.peso(comment)
 
 
-def check_forest_cover(lat, lon, radius_m=50):
+def check_forest_cover(lat, lon, radius_m=50, forest_index=None):
+    if forest_index is not None and forest_index.cubre(lat, lon):
+        return forest_index.contiene(lat, lon, radius_m)
+    cached = _cache_get(OVERPASS_API_URL, lat, lon, radius_m)
+    if cached is not None:
+        return cached
     query = f"""[out:json];(
         node["landuse"="forest"](around:{radius_m},{lat},{lon});
         way["landuse"="forest"](around:{radius_m},{lat},{lon});
@@ -64,16 +406,156 @@ def check_forest_cover(lat, lon, radius_m=50):
         relation["natural"="wood"](around:{radius_m},{lat},{lon});
     );out geom;"""
     try:
-        r = requests.post(OVERPASS_API_URL, data=query, timeout=10)
-        r.raise_for_status()
-        return len(r.json()["elements"]) > 0
+        r = _peticion("POST", OVERPASS_API_URL, data=query, timeout=10)
+        has_forest = len(r.json()["elements"]) > 0
+        _cache_put(OVERPASS_API_URL, lat, lon, has_forest, radius_m)
+        return has_forest
     except requests.RequestException as e:
         print(f"Error API Overpass: {e}")
-        return False
+        raise ErrorEtapa("Error API Overpass")
+
+
+def _elementos_overpass(respuesta):
+    # Overpass responde 200 aunque la consulta se corte por tiempo o memoria:
+    # lo avisa en "remark" y los elementos quedan incompletos
+    datos = respuesta.json()
+    if datos.get("remark"):
+        raise ValueError(f"respuesta incompleta: {datos['remark']}")
+    return datos["elements"]
+
+
+def construir_indice_bosque(bbox):
+    # Redondea la caja hacia fuera para reutilizar el índice entre ejecuciones
+    g = FOREST_PREFETCH_GRID_DEG
+    min_lat, min_lon = np.floor(np.array(bbox[:2]) / g) * g
+    max_lat, max_lon = np.ceil(np.array(bbox[2:]) / g) * g
+    if max(max_lat - min_lat, max_lon - min_lon) > FOREST_PREFETCH_MAX_SPAN_DEG:
+        print("Región demasiado grande para precargar bosques; se consulta por punto.")
+        return None
+    path = os.path.join(
+        FOREST_INDEX_DIR,
+        f"bosque_{min_lat:.2f}_{min_lon:.2f}_{max_lat:.2f}_{max_lon:.2f}.npz",
+    )
+    if os.path.exists(path) and time.time() - os.path.getmtime(path) < FOREST_INDEX_TTL:
+        try:
+            return IndiceBosque.cargar(path)
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Índice de bosque dañado, se descarga de nuevo: {e}")
+    area = f"{min_lat},{min_lon},{max_lat},{max_lon}"
+    query = f"""[out:json][timeout:180];(
+        node["landuse"="forest"]({area});
+        way["landuse"="forest"]({area});
+        relation["landuse"="forest"]({area});
+        node["natural"="wood"]({area});
+        way["natural"="wood"]({area});
+        relation["natural"="wood"]({area});
+    );out geom;"""
+    try:
+        r = _peticion("POST", OVERPASS_API_URL, data=query, timeout=200)
+        index = IndiceBosque.desde_overpass(
+            (min_lat, min_lon, max_lat, max_lon), _elementos_overpass(r)
+        )
+    except (requests.RequestException, ValueError, KeyError) as e:
+        print(f"Error API Overpass (precarga de bosques): {e}")
+        return None
+    os.makedirs(FOREST_INDEX_DIR, exist_ok=True)
+    index.guardar(path)
+    return index
+
+
+def _clasificador_guardado(bbox):
+    # Sirve cualquier rejilla vigente que contenga la caja pedida
+    if not os.path.isdir(LANDUSE_INDEX_DIR):
+        return None
+    for nombre in sorted(os.listdir(LANDUSE_INDEX_DIR)):
+        path = os.path.join(LANDUSE_INDEX_DIR, nombre)
+        if not nombre.endswith(".npy"):
+            continue
+        if (
+            not nombre.startswith("importado_")
+            and time.time() - os.path.getmtime(path) >= LANDUSE_INDEX_TTL
+        ):
+            continue
+        try:
+            caja = ClasificadorSuelo.bbox_guardado(path)
+            if (
+                caja[0] <= bbox[0]
+                and caja[1] <= bbox[1]
+                and caja[2] >= bbox[2]
+                and caja[3] >= bbox[3]
+            ):
+                return ClasificadorSuelo.cargar(path)
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Rejilla de suelo dañada ({nombre}): {e}")
+    return None
+
+
+def construir_clasificador_suelo(bbox, elementos=None):
+    # Con `elementos` (p. ej. un extracto de OSM exportado de Overpass) se
+    # importa esa región sin red y se guarda sin caducidad
+    g = LANDUSE_GRID_RES_DEG * 100
+    min_lat, min_lon = np.floor(np.array(bbox[:2]) / g) * g
+    max_lat, max_lon = np.ceil(np.array(bbox[2:]) / g) * g
+    caja = (float(min_lat), float(min_lon), float(max_lat), float(max_lon))
+    prefijo = "importado" if elementos is not None else "suelo"
+    if elementos is None:
+        guardado = _clasificador_guardado(caja)
+        if guardado is not None:
+            return guardado
+        if max(max_lat - min_lat, max_lon - min_lon) > LANDUSE_PREFETCH_MAX_SPAN_DEG:
+            print("Región demasiado grande para precargar el uso del suelo.")
+            return None
+        area = f"{min_lat},{min_lon},{max_lat},{max_lon}"
+        query = f"""[out:json][timeout:180];(
+            way["natural"="water"]({area});
+            relation["natural"="water"]({area});
+            way["waterway"~"^(riverbank|river|canal)$"]({area});
+            way["landuse"~"^(reservoir|residential|commercial|industrial)$"]({area});
+            relation["landuse"~"^(reservoir|residential|commercial|industrial)$"]({area});
+            node["place"~"^(city|town|village|hamlet)$"]({area});
+        );out geom;"""
+        try:
+            r = _peticion("POST", OVERPASS_API_URL, data=query, timeout=200)
+            elementos = _elementos_overpass(r)
+        except (requests.RequestException, ValueError, KeyError) as e:
+            print(f"Error API Overpass (precarga de uso del suelo): {e}")
+            return None
+    clasificador = ClasificadorSuelo.desde_overpass(
+        caja, elementos, LANDUSE_GRID_RES_DEG
+    )
+    os.makedirs(LANDUSE_INDEX_DIR, exist_ok=True)
+    path = os.path.join(
+        LANDUSE_INDEX_DIR,
+        f"{prefijo}_{min_lat:.2f}_{min_lon:.2f}_{max_lat:.2f}_{max_lon:.2f}.npy",
+    )
+    clasificador.guardar(path)
+    # Se reabre como memory map para no mantener la rejilla en memoria
+    return ClasificadorSuelo.cargar(path)
+
+
+def _wkt_bbox(min_lon, min_lat, max_lon, max_lat):
+    return (
+        f"POLYGON(({min_lon} {min_lat}, {max_lon} {min_lat}, "
+        f"{max_lon} {max_lat}, {min_lon} {max_lat}, {min_lon} {min_lat}))"
+    )
+
+
+def _gbif_params_presas(wkt_polygon, **extra):
+    # Un solo filtro multivalor para todos los géneros de PREY_TAXA
+    return (
+        [("scientificName", genus) for genus in PREY_TAXA]
+        + [("geometry", wkt_polygon)]
+        + list(extra.items())
+    )
 
 
 # <<<--- FUNCIÓN CORREGIDA PARA LA API DE GBIF ---<<<
-def check_prey_availability(lat, lon, radius_km=10):
+def check_prey_availability(lat, lon, radius_km=10, prey_raster=None):
+    if prey_raster is not None and prey_raster.cubre(lat, lon, radius_km):
+        return prey_raster.contar(lat, lon, radius_km)
+    cached = _cache_get(GBIF_API_URL, lat, lon, radius_km)
+    if cached is not None:
+        return cached
     # Convertir radio en km a grados de latitud/longitud (aproximación)
     deg_radius_lat = radius_km / 111.0
     deg_radius_lon = radius_km / (111.0 * np.cos(np.deg2rad(lat)))
@@ -83,84 +565,1094 @@ def check_prey_availability(lat, lon, radius_km=10):
     min_lat, max_lat = lat - deg_radius_lat, lat + deg_radius_lat
 
     # Crear la cadena de polígono WKT
-    wkt_polygon = (
-        f"POLYGON(({min_lon} {min_lat}, {max_lon} {min_lat}, "
-        f"{max_lon} {max_lat}, {min_lon} {max_lat}, {min_lon} {min_lat}))"
+    wkt_polygon = _wkt_bbox(min_lon, min_lat, max_lon, max_lat)
+
+    params = _gbif_params_presas(wkt_polygon, limit=0)
+    try:
+        response = _peticion("GET", GBIF_API_URL, params=params, timeout=10)
+        total_prey_count = max(0, response.json().get("count", 0))
+    except requests.RequestException as e:
+        # Ahora este error no debería ocurrir, pero lo mantenemos por seguridad
+        print(f"Error API GBIF: {e}")
+        return 0
+    _cache_put(GBIF_API_URL, lat, lon, total_prey_count, radius_km)
+    return total_prey_count
+
+
+def construir_raster_presas(bbox, res_deg=None, max_records=None):
+    res_deg = res_deg or PREY_RASTER_RES_DEG
+    max_records = max_records or PREY_RASTER_MAX_RECORDS
+    min_lat, min_lon, max_lat, max_lon = bbox
+    wkt_polygon = _wkt_bbox(min_lon, min_lat, max_lon, max_lat)
+    lats, lons = [], []
+    offset = 0
+    try:
+        while True:
+            # Mismos filtros que la consulta por punto, para que ambos cuenten
+            # lo mismo
+            response = _peticion(
+                "GET",
+                GBIF_API_URL,
+                params=_gbif_params_presas(
+                    wkt_polygon, limit=GBIF_PAGE_SIZE, offset=offset
+                ),
+                timeout=30,
+            )
+            data = response.json()
+            count = data.get("count", 0)
+            if count > max_records:
+                # Una muestra parcial sesgaría la densidad
+                print(
+                    f"Raster de presas omitido: la región tiene {count} ocurrencias "
+                    f"y el límite es {max_records}; la puntuación de presas se "
+                    "consulta a GBIF punto a punto."
+                )
+                return None
+            for occ in data.get("results", []):
+                if "decimalLatitude" in occ and "decimalLongitude" in occ:
+                    lats.append(occ["decimalLatitude"])
+                    lons.append(occ["decimalLongitude"])
+            offset += GBIF_PAGE_SIZE
+            if data.get("endOfRecords", True):
+                break
+    except requests.RequestException as e:
+        print(f"Error API GBIF (raster de presas): {e}")
+        return None
+    return RasterPresas(bbox, res_deg, lats, lons)
+
+
+def _sampling_bbox(mean, cov, margin_km=0.0, n_sigma=3.0):
+    sd = np.sqrt(np.diag(cov)) * n_sigma
+    d_lat = sd[0] + margin_km / 111.0
+    d_lon = sd[1] + margin_km / (111.0 * np.cos(np.deg2rad(mean[0])))
+    return (
+        max(-90.0, mean[0] - d_lat),
+        max(-180.0, mean[1] - d_lon),
+        min(90.0, mean[0] + d_lat),
+        min(180.0, mean[1] + d_lon),
     )
 
-    total_prey_count = 0
-    for genus in PREY_TAXA:
-        params = {"genus": genus, "geometry": wkt_polygon, "limit": 1}
+
+def constructores_muestreo():
+    constructores = {}
+    for nombre in SAMPLING_MODELS:
+        if nombre == "gaussiana":
+            constructores[nombre] = gaussiana
+        elif nombre == "mezcla":
+            for k in range(2, SAMPLING_MIXTURE_MAX_K + 1):
+                constructores[f"mezcla_{k}"] = partial(mezcla_gaussiana, k=k)
+        elif nombre == "kde_grupos":
+            constructores[nombre] = partial(
+                kde_grupos,
+                eps_km=SAMPLING_DBSCAN_EPS_KM,
+                min_nidos=SAMPLING_DBSCAN_MIN_NESTS,
+            )
+        else:
+            raise ValueError(f"Modelo de muestreo desconocido: {nombre}")
+    return constructores
+
+
+def aceptacion_local(forest_index=None, clasificador_suelo=None):
+    # Veredicto de las capas ya descargadas, sin llamadas externas; None si
+    # ninguna cubre el punto
+    dem = get_dem()
+    if forest_index is None and clasificador_suelo is None and dem is None:
+        return None
+
+    def aceptar(lat, lon):
+        elev = dem.elevacion(lat, lon) if dem else None
+        if elev is not None and elev <= 0:
+            return False
+        clase = clasificador_suelo.clase(lat, lon) if clasificador_suelo else None
+        if clase in CLASES_EXCLUIDAS:
+            return False
+        if forest_index is not None and forest_index.cubre(lat, lon):
+            return bool(forest_index.contiene(lat, lon))
+        return True if elev is not None or clase == LIBRE else None
+
+    return aceptar
+
+
+def elevaciones_lote(lats, lons):
+    # DEM local, luego caché y, para el resto, la API con hasta
+    # ELEVATION_BATCH_SIZE coordenadas por petición. NaN donde no se obtuvo.
+    lats = np.asarray(lats, dtype=float)
+    lons = np.asarray(lons, dtype=float)
+    dem = get_dem()
+    elev = dem.elevaciones(lats, lons) if dem else np.full(len(lats), np.nan)
+    for i in np.flatnonzero(np.isnan(elev)):
+        cached = _cache_get(ELEVATION_API_URL, lats[i], lons[i])
+        if cached is not None:
+            elev[i] = cached
+    faltan = np.flatnonzero(np.isnan(elev))
+    for j in range(0, len(faltan), ELEVATION_BATCH_SIZE):
+        idx = faltan[j : j + ELEVATION_BATCH_SIZE]
         try:
-            response = requests.get(GBIF_API_URL, params=params, timeout=10)
-            response.raise_for_status()
-            data = response.json()
-            if data.get("count", 0) > 0:
-                total_prey_count += data["count"]
-        except requests.RequestException as e:
-            # Ahora este error no debería ocurrir, pero lo mantenemos por seguridad
-            print(f"Error API GBIF para {genus}: {e}")
+            r = _peticion(
+                "GET",
+                ELEVATION_API_URL,
+                params={
+                    "latitude": ",".join(f"{v:.6f}" for v in lats[idx]),
+                    "longitude": ",".join(f"{v:.6f}" for v in lons[idx]),
+                },
+                timeout=10,
+            )
+            valores = r.json()["elevation"]
+        except (requests.RequestException, ValueError, KeyError) as e:
+            print(f"Error API Elevación (lote): {e}")
             continue
-    return total_prey_count
+        for i, v in zip(idx, valores):
+            if v is not None:
+                elev[i] = v
+                _cache_put(ELEVATION_API_URL, lats[i], lons[i], v)
+    return elev
+
+
+def candidatos_prefiltrados(
+    sampler, conocidas, lote=None, historial=None, espaciado=None, max_descartes=None
+):
+    # Saca candidatos del muestreador por lotes y descarta de una vez los de
+    # agua. La elevación de los que quedan se deja en `conocidas` para que la
+    # etapa de elevación no vuelva a consultarla; si el lote falló, la etapa
+    # la pide punto a punto como antes. Los que quedan demasiado cerca de otro
+    # punto se descartan antes de pedir la elevación. Pasados `max_descartes`
+    # descartes se deja de generar, como si el muestreador se hubiera agotado.
+    lote = lote or ELEVATION_BATCH_SIZE
+    descartes = 0
+    while max_descartes is None or descartes < max_descartes:
+        pts = sampler.siguientes(lote)
+        if len(pts) == 0:
+            return
+        if espaciado is not None:
+            libres = espaciado.libres(pts)
+            descartes += int((~libres).sum())
+            pts = pts[libres]
+            if len(pts) == 0:
+                continue
+        elev = elevaciones_lote(pts[:, 0], pts[:, 1])
+        rechazados = elev <= 0
+        descartes += int(rechazados.sum())
+        METRICAS.contar(
+            "nestguesser_prefiltro_elevacion_total",
+            int(rechazados.sum()),
+            resultado="rechazado",
+        )
+        METRICAS.contar(
+            "nestguesser_prefiltro_elevacion_total",
+            int(np.isnan(elev).sum()),
+            resultado="sin_dato",
+        )
+        if historial is not None:
+            for (lat, lon), e in zip(pts[rechazados], elev[rechazados]):
+                historial.registrar(
+                    lat,
+                    lon,
+                    RECHAZADO,
+                    "elevacion",
+                    f"Inviable (Fuera rango/agua. Elev: {e}m)",
+                )
+        for (lat, lon), e in zip(pts[~rechazados], elev[~rechazados]):
+            if not np.isnan(e):
+                conocidas[(lat, lon)] = float(e)
+            yield lat, lon
+
+
+def etapa_elevacion(lat, lon, conocidas=None):
+    elev = conocidas.pop((lat, lon), None) if conocidas is not None else None
+    if elev is None:
+        dem = get_dem()
+        elev = dem.elevacion(lat, lon) if dem else None
+    if elev is None:
+        elev = _cache_get(ELEVATION_API_URL, lat, lon)
+    if elev is None:
+        try:
+            r = _peticion(
+                "GET",
+                ELEVATION_API_URL,
+                params={"latitude": lat, "longitude": lon},
+                timeout=5,
+            )
+            elev = r.json()["elevation"][0]
+            _cache_put(ELEVATION_API_URL, lat, lon, elev)
+        except requests.RequestException as e:
+            print(f"Error API Elevación: {e}")
+            raise ErrorEtapa("Error API Elevación")
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180) or elev <= 0:
+        return False, f"Inviable (Fuera rango/agua. Elev: {elev}m)", 0
+    return True, None, 0
+
+
+def etapa_geo_inversa(lat, lon, clasificador=None):
+    clase = clasificador.clase(lat, lon) if clasificador is not None else None
+    if clase in CLASES_EXCLUIDAS:
+        METRICAS.contar("nestguesser_geo_inversa_fuente_total", fuente="local")
+        return False, f"Inviable (Poblado/agua: {CLASES_EXCLUIDAS[clase]})", 0
+    if clase == LIBRE:
+        METRICAS.contar("nestguesser_geo_inversa_fuente_total", fuente="local")
+        return True, None, 0
+    METRICAS.contar("nestguesser_geo_inversa_fuente_total", fuente="nominatim")
+    geo = _cache_get(REVERSE_GEO_API_URL, lat, lon)
+    if geo is None:
+        try:
+            headers = {"User-Agent": "HarpiaNestApp/1.0"}
+            r = _peticion(
+                "GET",
+                REVERSE_GEO_API_URL,
+                params={"lat": lat, "lon": lon, "format": "jsonv2"},
+                headers=headers,
+                timeout=5,
+            )
+            data = r.json()
+            geo = [data.get("category", ""), data.get("type", "")]
+            _cache_put(REVERSE_GEO_API_URL, lat, lon, geo)
+        except requests.RequestException as e:
+            print(f"Error API Geo-Inversa: {e}")
+            raise ErrorEtapa("Error API Geo-Inversa")
+    cat, p_type = geo
+    excl_cats, excl_types = (
+        ["water", "waterway"],
+        [
+            "city",
+            "town",
+            "village",
+            "hamlet",
+            "residential",
+            "commercial",
+            "industrial",
+        ],
+    )
+    if cat in excl_cats or p_type in excl_types:
+        return False, f"Inviable (Poblado/agua: {p_type or cat})", 0
+    return True, None, 0
+
+
+def etapa_bosque(lat, lon, forest_index=None):
+    if check_forest_cover(lat, lon, forest_index=forest_index):
+        return True, "Boscoso", 50
+    return False, "Inviable (Hábitat no boscoso)", 0
+
+
+def etapa_presas(lat, lon, prey_raster=None):
+    prey_count = check_prey_availability(lat, lon, prey_raster=prey_raster)
+    if prey_count > 0:
+        prey_score = min(50, int(10 * np.log1p(prey_count)))
+        return True, f"Presas: {prey_count} (P: +{prey_score})", prey_score
+    return True, "Sin presas", 0
+
+
+def crear_pipeline(
+    prey_raster=None,
+    forest_index=None,
+    adaptativo=True,
+    elevaciones=None,
+    clasificador_suelo=None,
+):
+    # El orden de la lista es el inicial y el de las razones en el informe
+    return PipelineValidacion(
+        [
+            Etapa("elevacion", partial(etapa_elevacion, conocidas=elevaciones)),
+            Etapa(
+                "geo_inversa",
+                partial(etapa_geo_inversa, clasificador=clasificador_suelo),
+            ),
+            Etapa("bosque", partial(etapa_bosque, forest_index=forest_index)),
+            Etapa(
+                "presas", partial(etapa_presas, prey_raster=prey_raster), filtro=False
+            ),
+        ],
+        adaptativo=adaptativo,
+    )
+
+
+_default_pipeline = crear_pipeline(adaptativo=False)
 
 
-def get_location_viability(lat, lon):
-    score = 0
+def get_location_viability(lat, lon, cancel_event=None, pipeline=None):
+    return (pipeline or _default_pipeline).validar(lat, lon, cancel_event)
+
+
+def popup_html(row):
+    # Todo campo se escapa: los datos pueden venir de un CSV/JSON importado
+    uid = int(row["id"])
+    tipo = html.escape(str(row["tipo"]))
+    score_info = (
+        f"<b>Puntuación:</b> {html.escape(str(row.get('puntuacion', 'N/A')))}<br>"
+    )
+    reason_info = (
+        f"<b>Análisis:</b> {html.escape(str(row.get('razon_validacion', 'N/A')))}<br>"
+    )
+    coords = html.escape(f"({float(row['lat']):.5f}, {float(row['lon']):.5f})")
+    return f"""<b>ID:</b> {uid}<br><b>Tipo:</b> {tipo}<br>
+    <b>Coords:</b> {coords}<br>
+    <b>Comentario:</b> {html.escape(str(row.get("comentario", "N/A")))}<hr>
+    {"".join([score_info, reason_info]) if "Generado" in str(row["tipo"]) else ""}
+    <a href="#" style="color:red;" onclick="return nestGuesserEliminar([{uid}]);"><b>ELIMINAR</b></a>"""
+
+
+MAP_SHELL_TAG = "nest-guesser-mapa-v5"
+_mapa_lock = threading.Lock()
+
+
+def mapa_vigente(path, base_url):
     try:
-        r = requests.get(
-            ELEVATION_API_URL, params={"latitude": lat, "longitude": lon}, timeout=5
+        with open(path, "r", encoding="utf-8") as f:
+            contenido = f.read()
+    except OSError:
+        return False
+    return MAP_SHELL_TAG in contenido and json.dumps(base_url) in contenido
+
+
+def preparar_mapa(store, path):
+    # La página no lleva datos: sólo se reescribe si falta o es de otra versión.
+    # Pide los datos a su mismo origen, el servidor que la sirve
+    with _mapa_lock:
+        if not mapa_vigente(path, ""):
+            guardar_mapa_gestion(store.leer(["lat", "lon"]), path, "")
+
+
+class CapaPuntosRemota(MacroElement):
+    # Carga los puntos del servidor como arrays compactos, crea los marcadores
+    # en el navegador y después aplica sólo los cambios (altas/bajas) que
+    # publica /cambios. El popup de cada marcador se pide al abrirlo.
+    _template = Template("""{% macro script(this, kwargs) %}
+        /* {{ this.tag }} */
+        (function() {
+            var mapa = {{ this._parent.get_name() }};
+            var cluster = {{ this.cluster.get_name() }};
+            var base = {{ this.base_url|tojson }};
+            var estilos = {{ this.estilos|tojson }};
+            var intervalo = {{ this.intervalo }};
+            var iconos = {}, marcadores = {};
+            var sesion = "", version = 0, primera = true;
+            function icono(tipo) {
+                if (!iconos[tipo]) {
+                    var e = estilos[tipo] || estilos["_"];
+                    iconos[tipo] = L.AwesomeMarkers.icon(
+                        {markerColor: e[0], icon: e[1], prefix: "glyphicon"});
+                }
+                return iconos[tipo];
+            }
+            function crear(p) {
+                var m = L.marker([p[1], p[2]], {icon: icono(p[3])});
+                // Como texto: el tipo viene de los datos y no debe interpretarse
+                var etiqueta = document.createElement("span");
+                etiqueta.textContent = "ID: " + p[0] + " - " + p[3];
+                m.bindTooltip(etiqueta);
+                m.bindPopup("Cargando...", {maxWidth: 300});
+                m.on("popupopen", function(ev) {
+                    fetch(base + "/api/popup?id=" + p[0])
+                        .then(function(r) { return r.text(); })
+                        .then(function(h) { ev.popup.setContent(h); });
+                });
+                marcadores[p[0]] = m;
+                return m;
+            }
+            function baja(id) {
+                if (marcadores[id]) {
+                    cluster.removeLayer(marcadores[id]);
+                    delete marcadores[id];
+                }
+            }
+            function cargarTodo() {
+                return fetch(base + "/api/puntos").then(function(r) { return r.json(); })
+                    .then(function(d) {
+                        cluster.clearLayers();
+                        marcadores = {};
+                        cluster.addLayers(d.data.map(crear));
+                        sesion = d.sesion;
+                        version = d.version;
+                        if (primera && d.data.length) {
+                            mapa.fitBounds(cluster.getBounds());
+                        }
+                        primera = false;
+                    });
+            }
+            function sondear() {
+                fetch(base + "/api/cambios?sesion=" + sesion + "&desde=" + version)
+                    .then(function(r) { return r.json(); })
+                    .then(function(d) {
+                        if (d.reset) { return cargarTodo(); }
+                        d.eventos.forEach(function(e) {
+                            baja(e[1]);
+                            if (e[0] === "+") { cluster.addLayer(crear(e.slice(1))); }
+                        });
+                        version = d.version;
+                    })
+                    .catch(function() {})
+                    .then(function() { setTimeout(sondear, intervalo); });
+            }
+            window.nestGuesserRecargar = cargarTodo;
+            window.nestGuesserEliminar = function(ids) {
+                fetch(base + "/api/eliminar", {
+                    method: "POST",
+                    headers: {"Content-Type": "application/json"},
+                    body: JSON.stringify({ids: ids})
+                }).then(function(r) { return r.json(); })
+                    .then(function() {
+                        mapa.closePopup();
+                        ids.forEach(baja);
+                    });
+                return false;
+            };
+            cargarTodo().catch(function() {})
+                .then(function() { setTimeout(sondear, intervalo); });
+        })();
+        {% endmacro %}""")
+
+    def __init__(self, cluster, base_url, intervalo_ms=None):
+        super().__init__()
+        self._name = "CapaPuntosRemota"
+        self.tag = MAP_SHELL_TAG
+        self.cluster = cluster
+        self.base_url = base_url
+        self.intervalo = intervalo_ms or MAP_POLL_INTERVAL_MS
+        self.estilos = dict(MARKER_STYLES, _=DEFAULT_MARKER_STYLE)
+
+
+def puntos_compactos(df, sesion=None, version=0):
+    # [[id, lat, lon, tipo], ...] construido por columnas, sin iterar filas
+    return {
+        "sesion": sesion,
+        "version": version,
+        "columns": ["id", "lat", "lon", "tipo"],
+        "data": list(
+            zip(
+                df["id"].astype(int).tolist(),
+                df["lat"].round(6).tolist(),
+                df["lon"].round(6).tolist(),
+                df["tipo"].astype(str).tolist(),
+            )
+        ),
+    }
+
+
+class ManejadorAPI(http.server.BaseHTTPRequestHandler):
+    # HTTP/1.1 con keep-alive: toda respuesta lleva Content-Length
+    protocol_version = "HTTP/1.1"
+    app = None
+
+    def log_request(self, code="-", size="-"):
+        # El mapa sondea cada pocos segundos: sólo se registran los errores
+        if str(code).isdigit() and int(code) < 400:
+            return
+        super().log_request(code, size)
+
+    def finish(self):
+        # Cada conexión se atiende en un hilo nuevo: al acabar se cierra su
+        # conexión con el almacén
+        try:
+            super().finish()
+        finally:
+            self.app.store.cerrar_conexion_hilo()
+
+    def _send_body(self, body, content_type, status=200, cerrar=False):
+        self.send_response(status)
+        self.send_header("Content-type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        if cerrar:
+            # También marca close_connection: el cuerpo sin leer de la
+            # petición no se confunde con la siguiente
+            self.send_header("Connection", "close")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_json(self, data, status=200, cerrar=False):
+        self._send_body(
+            json.dumps(data, separators=(",", ":")).encode("utf-8"),
+            "application/json",
+            status,
+            cerrar,
         )
-        r.raise_for_status()
-        elev = r.json()["elevation"][0]
-        if not (-90 <= lat <= 90 and -180 <= lon <= 180) or elev <= 0:
-            return False, f"Inviable (Fuera rango/agua. Elev: {elev}m)", 0
-    except requests.RequestException as e:
-        print(f"Error API Elevación: {e}")
-        return False, "Error API Elevación", 0
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length", 0) or 0)
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def _origen_permitido(self):
+        # Sin cabecera Origin la petición no viene de una página web; con ella,
+        # sólo se acepta la del mapa servido desde aquí
+        host = self.headers.get("Host", "")
+        if urlparse(f"//{host}").hostname not in SERVER_ALLOWED_HOSTS:
+            return False
+        origen = self.headers.get("Origin")
+        return origen is None or origen == f"http://{host}"
+
+    def do_GET(self):
+        if not self._origen_permitido():
+            self._send_json({"error": "Origen no permitido"}, 403)
+            return
+        p = urlparse(self.path)
+        q = parse_qs(p.query)
+        rutas = {
+            "/": self._get_mapa,
+            "/api/puntos": self._get_puntos,
+            "/api/cambios": self._get_cambios,
+            "/api/estadisticas": self._get_estadisticas,
+            "/api/popup": self._get_popup,
+            "/api/cerca": self._get_cerca,
+            "/metrics": self._get_metrics,
+        }
+        ruta = rutas.get(p.path)
+        if ruta is None:
+            self._send_json({"error": "Pagina no encontrada"}, 404)
+            return
+        try:
+            ruta(q)
+        except (ValueError, IndexError, TypeError) as e:
+            self._send_json({"error": f"Solicitud invalida: {e}"}, 400)
+
+    def do_POST(self):
+        p = urlparse(self.path)
+        if p.path != "/api/eliminar":
+            self._send_json({"error": "Pagina no encontrada"}, 404, cerrar=True)
+            return
+        if not self._origen_permitido():
+            self._send_json({"error": "Origen no permitido"}, 403, cerrar=True)
+            return
+        try:
+            ids = [int(i) for i in self._read_json()["ids"]]
+        except (ValueError, KeyError, TypeError) as e:
+            self._send_json({"error": f"Solicitud invalida: {e}"}, 400, cerrar=True)
+            return
+        borrados = self.app.eliminar_ubicaciones(ids)
+        self._send_json({"solicitados": len(ids), "eliminados": borrados})
+
+    def _get_mapa(self, q):
+        path = os.path.realpath(MAP_FILE)
+        preparar_mapa(self.app.store, path)
+        with open(path, "rb") as f:
+            self._send_body(f.read(), "text/html; charset=utf-8")
+
+    def _get_puntos(self, q):
+        # La versión se toma antes de leer: un cambio concurrente
+        # puede repetirse en el siguiente delta, nunca perderse
+        sesion, version = self.app.store.cambios.actual()
+        cols = ["id", "lat", "lon", "tipo"]
+        if "bbox" in q:
+            min_lat, min_lon, max_lat, max_lon = map(float, q["bbox"][0].split(","))
+            df = self.app.store.consultar_bbox(min_lat, min_lon, max_lat, max_lon, cols)
+        else:
+            df = self.app.store.leer(cols)
+        self._send_json(puntos_compactos(df, sesion, version))
+
+    def _get_cambios(self, q):
+        try:
+            desde = int(q.get("desde", ["0"])[0])
+        except ValueError:
+            desde = -1
+        delta = self.app.store.cambios.desde(q.get("sesion", [""])[0], desde)
+        if delta is None:
+            self._send_json({"reset": True})
+        else:
+            self._send_json({"version": delta[0], "eventos": delta[1]})
+
+    def _get_estadisticas(self, q):
+        sesion, version = self.app.store.cambios.actual()
+        por_tipo = self.app.store.contar_por_tipo()
+        self._send_json(
+            {
+                "total": sum(por_tipo.values()),
+                "por_tipo": por_tipo,
+                "sesion": sesion,
+                "version": version,
+            }
+        )
+
+    def _get_popup(self, q):
+        row = self.app.store.obtener(int(q.get("id", [None])[0]))
+        if row is None:
+            self._send_json({"error": "Ubicacion no encontrada"}, 404)
+            return
+        self._send_body(popup_html(row).encode("utf-8"), "text/html; charset=utf-8")
+
+    def _get_cerca(self, q):
+        # Ubicaciones a menos de `radio` metros, de la más cercana a la más lejana
+        sesion, version = self.app.store.cambios.actual()
+        df = self.app.store.consultar_radio(
+            float(q.get("lat", [None])[0]),
+            float(q.get("lon", [None])[0]),
+            float(q.get("radio", [PREDICTION_MIN_SPACING_M])[0]),
+            ["id", "lat", "lon", "tipo"],
+        )
+        self._send_json(puntos_compactos(df, sesion, version))
+
+    def _get_metrics(self, q):
+        self._send_body(
+            METRICAS.texto_prometheus().encode("utf-8"),
+            "text/plain; version=0.0.4; charset=utf-8",
+        )
+
+
+def guardar_resumen_ejecucion(resumen):
+    carpeta = os.path.dirname(os.path.abspath(CSV_FILE))
+    # Varios trabajos y procesos acaban a la vez: el nombre lleva microsegundos,
+    # trabajo y pid, y "x" impide pisar un resumen ya escrito
+    trabajo = resumen.get("trabajo")
+    sufijo = f"t{trabajo}_" if trabajo is not None else ""
+    path = os.path.join(
+        carpeta,
+        f"resumen_generacion_{datetime.now():%Y%m%d_%H%M%S_%f}_{sufijo}p{os.getpid()}.json",
+    )
     try:
-        headers = {"User-Agent": "HarpiaNestApp/1.0"}
-        r = requests.get(
-            REVERSE_GEO_API_URL,
-            params={"lat": lat, "lon": lon, "format": "jsonv2"},
-            headers=headers,
-            timeout=5,
+        with open(path, "x", encoding="utf-8") as f:
+            json.dump(resumen, f, indent=2, ensure_ascii=False, default=str)
+    except OSError as e:
+        print(f"No se pudo guardar el resumen de la ejecución: {e}")
+        return None
+    return path
+
+
+def generar_predicciones(
+    df,
+    num_gen,
+    q,
+    max_workers=MAX_WORKERS_VALIDACION,
+    trabajo=None,
+    store=None,
+    rng=None,
+):
+    inicio = datetime.now()
+    t_inicio = time.perf_counter()
+    metricas_inicio = METRICAS.instantanea()
+    # Un trabajo con punto de control sigue con su modelo y su región, aunque
+    # los nidos registrados hayan cambiado desde entonces
+    guardado = trabajo.estado() if trabajo is not None else None
+    if guardado is None:
+        nidos = df[df["tipo"] == "Nido probable"].copy()
+        if len(nidos) < 2:
+            q.put(("ERROR", "Se necesitan al menos 2 'Nidos probables'."))
+            return
+        nidos["weight"] = _pesos_comentarios.pesos(
+            nidos["comentario"], nidos["id"] if "id" in nidos else None
         )
-        r.raise_for_status()
-        data = r.json()
-        cat, p_type = data.get("category", ""), data.get("type", "")
-        excl_cats, excl_types = (
-            ["water", "waterway"],
-            [
-                "city",
-                "town",
-                "village",
-                "hamlet",
-                "residential",
-                "commercial",
-                "industrial",
-            ],
+        coords = nidos[["lat", "lon"]].to_numpy()
+        weights = nidos["weight"].to_numpy()
+        if np.sum(weights) == 0:
+            q.put(("ERROR", "Pesos calculados son cero."))
+            return
+        mean, cov = (
+            np.average(coords, axis=0, weights=weights),
+            np.cov(coords, rowvar=False, aweights=weights) + np.eye(2) * 1e-5,
         )
-        if cat in excl_cats or p_type in excl_types:
-            return False, f"Inviable (Poblado/agua: {p_type or cat})", 0
-    except requests.RequestException as e:
-        print(f"Error API Geo-Inversa: {e}")
-        return False, "Error API Geo-Inversa", 0
+    else:
+        arrays, meta = guardado
+        mean, cov = arrays["media"], arrays["cov"]
+    prey_raster = None
+    if PREY_RASTER_ENABLED:
+        q.put(("STATUS", "Descargando densidad de presas de la región..."))
+        prey_raster = construir_raster_presas(_sampling_bbox(mean, cov, margin_km=10))
+    forest_index = None
+    if FOREST_PREFETCH_ENABLED:
+        q.put(("STATUS", "Descargando cobertura boscosa de la región..."))
+        forest_index = construir_indice_bosque(_sampling_bbox(mean, cov, margin_km=0.1))
+    clasificador_suelo = None
+    if LANDUSE_PREFETCH_ENABLED:
+        q.put(("STATUS", "Descargando agua y poblados de la región..."))
+        clasificador_suelo = construir_clasificador_suelo(
+            _sampling_bbox(mean, cov, margin_km=0.1)
+        )
+
+    elevaciones = {}
+    pipeline = crear_pipeline(
+        prey_raster,
+        forest_index,
+        elevaciones=elevaciones,
+        clasificador_suelo=clasificador_suelo,
+    )
+    if guardado is None:
+        with METRICAS.medir("nestguesser_seleccion_modelo_segundos"):
+            modelo, puntuaciones = seleccionar_modelo(
+                coords,
+                weights,
+                constructores_muestreo(),
+                keep_fraction=SAMPLE_KEEP_FRACTION,
+                pliegues=SAMPLING_CV_FOLDS,
+                radio_km=SAMPLING_HOLDOUT_RADIUS_KM,
+                aceptar=aceptacion_local(forest_index, clasificador_suelo),
+                rng=rng,
+            )
+    else:
+        modelo = ModeloMezcla(
+            meta["modelo"], arrays["pesos"], arrays["medias"], arrays["covs"]
+        )
+        puntuaciones = meta["modelos"]
+    q.put(("STATUS", f"Modelo de muestreo: {modelo.nombre}"))
+    historial = get_historial()
+    if historial:
+        historial.cargar_region(_sampling_bbox(mean, cov, margin_km=0.1))
+        q.put(("STATUS", historial.resumen()))
+    sampler = MuestreadorCandidatos(
+        modelo,
+        cell_deg=SAMPLE_CELL_DEG,
+        batch_size=SAMPLE_BATCH_SIZE,
+        keep_fraction=SAMPLE_KEEP_FRACTION,
+        rng=rng,
+        historial=historial,
+    )
+    valid_points = []
+    completed = 0
+    if trabajo is not None:
+        valid_points = trabajo.puntos()
+        completed = trabajo.intentos
+        if guardado is not None:
+            sampler.restaurar(arrays, meta["muestreo"])
+            q.put(
+                (
+                    "STATUS",
+                    f"Reanudando {trabajo.nombre}: {len(valid_points)}/{num_gen} "
+                    f"aceptados tras {completed} intentos",
+                )
+            )
 
-    reasons = []
-    if check_forest_cover(lat, lon):
-        score += 50
-        reasons.append("Boscoso")
+    def punto_control():
+        # Lo que hace falta para seguir donde se dejó: región, modelo, celdas
+        # probadas, cola y generador del muestreador. Los candidatos en vuelo
+        # se pierden, pero sus celdas ya cuentan como probadas
+        estado, meta_muestreo = sampler.estado()
+        estado.update(
+            media=mean,
+            cov=cov,
+            pesos=modelo.pesos,
+            medias=modelo.medias,
+            covs=modelo.covs,
+        )
+        trabajo.guardar_estado(
+            estado,
+            {
+                "modelo": modelo.nombre,
+                "modelos": puntuaciones,
+                "muestreo": meta_muestreo,
+            },
+            completed,
+        )
+        if historial:
+            historial.guardar()
+
+    if trabajo is not None and guardado is None:
+        punto_control()
+    espaciado = None
+    if PREDICTION_MIN_SPACING_M > 0:
+        espaciado = EspaciadoMinimo(
+            PREDICTION_MIN_SPACING_M,
+            store.indice_espacial() if store is not None else None,
+            store.refrescar_indice if store is not None else None,
+        )
+    max_tries = num_gen * 30
+    max_descartes = max_tries * CANDIDATE_MAX_DISCARDS_PER_TRY
+    if ELEVATION_PREFILTER_ENABLED:
+        candidatos = candidatos_prefiltrados(
+            sampler,
+            elevaciones,
+            historial=historial,
+            espaciado=espaciado,
+            max_descartes=max_descartes,
+        )
     else:
-        return False, "Inviable (Hábitat no boscoso)", 0
-    prey_count = check_prey_availability(lat, lon)
-    if prey_count > 0:
-        prey_score = min(50, int(10 * np.log1p(prey_count)))
-        score += prey_score
-        reasons.append(f"Presas: {prey_count} (P: +{prey_score})")
+        candidatos = iter(sampler.siguiente, None)
+
+    submitted = completed
+    sin_reserva = 0
+    stop = threading.Event()
+    if len(valid_points) >= num_gen:
+        stop.set()
+    pending = {}
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    try:
+        # Mantiene max_workers candidatos en vuelo hasta reunir num_gen válidos
+        while not stop.is_set() and (pending or submitted < max_tries):
+            while len(pending) < max_workers and submitted < max_tries:
+                with METRICAS.medir("nestguesser_muestreo_segundos"):
+                    candidate = next(candidatos, None)
+                if candidate is None:
+                    max_tries = submitted
+                    break
+                lat, lon = candidate
+                # Reserva el sitio mientras se valida: ningún otro candidato
+                # en vuelo puede quedar a menos de la separación mínima
+                reserva = espaciado.reservar(lat, lon) if espaciado else None
+                if espaciado and reserva is None:
+                    sin_reserva += 1
+                    if sin_reserva >= max_descartes:
+                        max_tries = submitted
+                        break
+                    continue
+                submitted += 1
+                fut = executor.submit(pipeline.validar_detalle, lat, lon, stop)
+                pending[fut] = (lat, lon, reserva)
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for fut in done:
+                lat, lon, reserva = pending.pop(fut)
+                completed += 1
+                try:
+                    resultado, reason, score, etapa = fut.result()
+                except Exception as e:
+                    resultado, reason, score, etapa = (
+                        RESULTADO_ERROR,
+                        f"Error: {e}",
+                        0,
+                        None,
+                    )
+                if historial:
+                    historial.registrar(lat, lon, resultado, etapa, reason, score)
+                is_valid = resultado == ACEPTADO
+                if (
+                    is_valid
+                    and len(valid_points) < num_gen
+                    and espaciado
+                    and not espaciado.confirmar(lat, lon)
+                ):
+                    is_valid = False
+                    reason = (
+                        f"Descartado (a menos de {PREDICTION_MIN_SPACING_M:g} m "
+                        "de otro punto)"
+                    )
+                if reserva is not None and not (
+                    is_valid and len(valid_points) < num_gen
+                ):
+                    espaciado.liberar(reserva)
+                q.put(
+                    (
+                        "STATUS",
+                        f"Intento {completed}/{max_tries}: ({lat:.3f}, {lon:.3f}) -> {reason}",
+                    )
+                )
+                if is_valid and len(valid_points) < num_gen:
+                    punto = {"lat": lat, "lon": lon, "score": score, "reason": reason}
+                    valid_points.append(punto)
+                    if trabajo is not None:
+                        trabajo.aceptado(punto)
+                    q.put(("VALIDO", punto))
+                    if len(valid_points) >= num_gen:
+                        stop.set()
+                if trabajo is not None and completed % JOB_CHECKPOINT_EVERY == 0:
+                    punto_control()
+                    if trabajo.cancelado():
+                        q.put(("STATUS", f"{trabajo.nombre} cancelado."))
+                        stop.set()
+    finally:
+        stop.set()
+        executor.shutdown(wait=False, cancel_futures=True)
+        if trabajo is not None:
+            punto_control()
+        elif historial:
+            historial.guardar()
+
+    print(sampler.resumen())
+    print(pipeline.resumen())
+    if historial:
+        print(historial.resumen())
+    if espaciado:
+        print(
+            f"Espaciado: {espaciado.descartados} candidatos a menos de "
+            f"{PREDICTION_MIN_SPACING_M:g} m de otro punto"
+        )
+        METRICAS.contar(
+            "nestguesser_descartados_espaciado_total", espaciado.descartados
+        )
+    cache = get_spatial_cache()
+    if cache:
+        print(cache.resumen())
+        q.put(("STATUS", cache.resumen()))
+    valid_points.sort(key=lambda p: p["score"], reverse=True)
+    METRICAS.contar("nestguesser_candidatos_total", completed)
+    METRICAS.contar("nestguesser_aceptados_total", len(valid_points))
+    resumen = {
+        "inicio": inicio.isoformat(timespec="seconds"),
+        "segundos": time.perf_counter() - t_inicio,
+        "solicitados": num_gen,
+        "intentos": completed,
+        "aceptados": len(valid_points),
+        "etapas": pipeline.estadisticas(),
+        "orden_etapas": pipeline.orden_actual(),
+        "muestreo": {
+            "modelo": modelo.nombre,
+            "modelos": puntuaciones,
+            "sorteados": sampler.sorteados,
+            "fuera_rango": sampler.fuera_rango,
+            "duplicados": sampler.duplicados,
+            "descartados_historial": sampler.descartados,
+            "descartados_espaciado": espaciado.descartados if espaciado else 0,
+        },
+        "cache": cache.estadisticas() if cache else {},
+        "historial": historial.estadisticas() if historial else {},
+        "trabajo": trabajo.id if trabajo is not None else None,
+        "metricas": METRICAS.diferencia(metricas_inicio, METRICAS.instantanea()),
+    }
+    if RUN_SUMMARY_ENABLED:
+        guardar_resumen_ejecucion(resumen)
+    q.put(("DONE", valid_points))
+    return resumen
+
+
+class ColaTrabajo:
+    # Adapta la cola de generar_predicciones para un trabajo: cada punto
+    # aceptado pasa al almacén antes de reenviarse, y se recuerda el error
+    def __init__(self, trabajo, store, destino):
+        self.trabajo = trabajo
+        self.store = store
+        self.destino = destino
+        self.error = None
+
+    def put(self, msg):
+        tipo, data = msg
+        if tipo == "VALIDO" and self.store is not None:
+            guardar_puntos_trabajo(self.trabajo, self.store, [data])
+        elif tipo == "ERROR":
+            self.error = data
+        self.destino.put(msg)
+
+
+def guardar_puntos_trabajo(trabajo, store, puntos):
+    for punto in puntos:
+        uid = id_prediccion_guardada(store, punto)
+        if uid is None:
+            (uid,) = store.insertar(registros_prediccion([punto]))
+        trabajo.marcar_guardado(punto, uid)
+
+
+def id_prediccion_guardada(store, punto):
+    # Si el proceso cayó entre el alta en el almacén y la marca en el trabajo,
+    # el punto ya está guardado: se reutiliza en lugar de duplicarlo
+    store.refrescar_indice()
+    df = store.consultar_radio(
+        punto["lat"], punto["lon"], 1.0, ["id", "lat", "lon", "tipo"]
+    )
+    df = df[
+        (df["tipo"] == "Generado Potencial")
+        & np.isclose(df["lat"], punto["lat"], rtol=0, atol=1e-9)
+        & np.isclose(df["lon"], punto["lon"], rtol=0, atol=1e-9)
+    ]
+    return int(df["id"].iloc[0]) if len(df) else None
+
+
+def nidos_trabajo(parametros, store):
+    # Los nidos propios del trabajo o, si no tiene, los registrados (en su bbox)
+    if parametros.get("nidos"):
+        df = pd.DataFrame(parametros["nidos"])
+        df["tipo"] = df.get("tipo", "Nido probable")
+        df["comentario"] = df.get("comentario", "")
+        df["comentario"] = df["comentario"].fillna("")
+        return df
+    df = store.leer(COLUMNAS_GENERACION, ["Nido probable"])
+    if parametros.get("bbox"):
+        min_lat, min_lon, max_lat, max_lon = parametros["bbox"]
+        df = df[
+            df["lat"].between(min_lat, max_lat) & df["lon"].between(min_lon, max_lon)
+        ]
+    return df
+
+
+def latir_trabajo(trabajo, parar):
+    # Mantiene vivo el trabajo aunque pase mucho sin punto de control (las
+    # precargas de la región pueden durar más que JOB_STALE_S)
+    while not parar.wait(JOB_STALE_S / 4):
+        try:
+            trabajo.latido()
+        except sqlite3.Error as e:
+            print(f"Error al actualizar el latido de {trabajo.nombre}: {e}")
+
+
+def ejecutar_trabajo(trabajo, store, q, max_workers=MAX_WORKERS_VALIDACION):
+    parar = threading.Event()
+    threading.Thread(target=latir_trabajo, args=(trabajo, parar), daemon=True).start()
+    cola = ColaTrabajo(trabajo, store, q)
+    try:
+        # Puntos aceptados en una ejecución anterior que no llegaron al almacén
+        if store is not None:
+            guardar_puntos_trabajo(trabajo, store, trabajo.sin_guardar())
+        resumen = generar_predicciones(
+            nidos_trabajo(trabajo.parametros, store),
+            trabajo.num,
+            cola,
+            max_workers,
+            trabajo=trabajo,
+            store=store,
+        )
+    except Exception as e:
+        trabajo.terminar(FALLIDO, str(e))
+        q.put(("ERROR", f"{trabajo.nombre}: {e}"))
+        return None
+    finally:
+        parar.set()
+    if resumen is None:
+        trabajo.terminar(FALLIDO, cola.error)
     else:
-        reasons.append("Sin presas")
+        trabajo.terminar(COMPLETADO)
+    return resumen
+
+
+def registros_prediccion(puntos):
+    return [
+        {
+            "lat": p["lat"],
+            "lon": p["lon"],
+            "tipo": "Generado Potencial",
+            "comentario": "Validado ecológicamente",
+            "puntuacion": p["score"],
+            "razon_validacion": p["reason"],
+        }
+        for p in puntos
+    ]
+
+
+def preparar_csv(path):
+    # Crea el CSV con la cabecera actual; uno con formato antiguo se renombra a
+    # .bak. Devuelve True si se hizo esa copia de seguridad.
+    respaldo = False
+    if os.path.exists(path):
+        try:
+            with open(path, "r", newline="", encoding="utf-8") as f:
+                if next(csv.reader(f)) == COLUMNAS:
+                    return False
+            os.rename(path, path + ".bak")
+            respaldo = True
+        except (StopIteration, IndexError):
+            pass
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        csv.writer(f).writerow(COLUMNAS)
+    return respaldo
+
+
+# <<<--- FUNCIÓN generar_mapa_base MODIFICADA ---<<<
+def generar_mapa_base(df):
+    if df.empty or df["lat"].isnull().all():
+        map_center = [9.0, -80.0]
+        zoom_start = 5
+    else:
+        map_center = [df["lat"].mean(), df["lon"].mean()]
+        zoom_start = 6
+
+    m = folium.Map(location=map_center, zoom_start=zoom_start, tiles=None)
 
-    return True, ", ".join(reasons), score
+    folium.TileLayer("OpenStreetMap", name="Estándar (Calles)").add_to(m)
+    folium.TileLayer(
+        "https://server.arcgisonline.com/ArcGIS/rest/services/World_Imagery/MapServer/tile/{z}/{y}/{x}",
+        attr="Esri",
+        name="Satélite",
+    ).add_to(m)
+    folium.TileLayer(
+        "https://{s}.tile.opentopomap.org/{z}/{x}/{y}.png",
+        attr="OpenTopoMap",
+        name="Topográfico",
+    ).add_to(m)
+    folium.TileLayer(
+        "https://{s}.basemaps.cartocdn.com/dark_all/{z}/{x}/{y}{r}.png",
+        attr="CartoDB",
+        name="Modo Oscuro",
+    ).add_to(m)
+
+    folium.LatLngPopup().add_to(m)
+    return m
+
+
+def guardar_mapa_gestion(df, map_path, base_url):
+    m = generar_mapa_base(df)  # Obtiene el mapa con las capas base
+    mc = MarkerCluster(
+        name="Ubicaciones Registradas", options={"chunkedLoading": True}
+    ).add_to(m)
+    CapaPuntosRemota(mc, base_url).add_to(m)
+    folium.LayerControl().add_to(m)
+    m.save(map_path)
 
 
 class App:
@@ -168,57 +1660,49 @@ class App:
         self.root = root
         self.root.title("Nest-Guesser")
         self.root.geometry("450x500")
-        if not self.setup_csv():
+        if not self.setup_storage():
             self.root.destroy()
             return
         self.httpd = None
         self.start_server()
         self.generation_queue = queue.Queue()
+        self.cola_trabajos = get_cola_trabajos()
+        self.hilos_trabajos = []
         if self.httpd:
             self.create_widgets()
             self.root.protocol("WM_DELETE_WINDOW", self.on_closing)
             self.process_generation_queue()
+            # Trabajos que quedaron a medias al cerrar la última vez
+            self.cola_trabajos.recuperar()
+            pendientes = self.cola_trabajos.pendientes()
+            if pendientes:
+                self.status_lbl.config(
+                    text=f"Reanudando {pendientes} trabajos pendientes..."
+                )
+                self.lanzar_trabajos()
+
+    def setup_storage(self):
+        if STORAGE_BACKEND == "csv" and not self.setup_csv():
+            return False
+        try:
+            self.store = crear_almacen(STORAGE_BACKEND, DB_FILE, CSV_FILE)
+            return True
+        except Exception as e:
+            messagebox.showerror("Error", f"No se pudo abrir el almacenamiento: {e}")
+            return False
 
     def setup_csv(self):
-        HEADER = [
-            "id",
-            "lat",
-            "lon",
-            "tipo",
-            "comentario",
-            "puntuacion",
-            "razon_validacion",
-        ]
-        if os.path.exists(CSV_FILE):
-            try:
-                with open(CSV_FILE, "r", newline="", encoding="utf-8") as f:
-                    if next(csv.reader(f)) == HEADER:
-                        return True
-                os.rename(CSV_FILE, CSV_FILE + ".bak")
+        try:
+            if preparar_csv(CSV_FILE):
                 messagebox.showwarning(
                     "Formato Antiguo",
                     "CSV antiguo detectado. Se ha creado una copia de seguridad y se generará un archivo nuevo.",
                 )
-            except (StopIteration, IndexError):
-                pass
-            except Exception as e:
-                messagebox.showerror("Error", f"No se pudo verificar CSV: {e}")
-                return False
-        try:
-            with open(CSV_FILE, "w", newline="", encoding="utf-8") as f:
-                csv.writer(f).writerow(HEADER)
             return True
         except Exception as e:
-            messagebox.showerror("Error", f"No se pudo crear CSV: {e}")
+            messagebox.showerror("Error", f"No se pudo preparar CSV: {e}")
             return False
 
-    def _get_next_id(self):
-        try:
-            df = pd.read_csv(CSV_FILE)
-            return 1 if df.empty else int(df["id"].max()) + 1
-        except (FileNotFoundError, pd.errors.EmptyDataError):
-            return 1
-
     def create_widgets(self):
         main = Frame(self.root, padx=10, pady=10)
         main.pack(fill=tk.BOTH, expand=True)
@@ -288,164 +1772,104 @@ class App:
         except ValueError:
             messagebox.showerror("Error", "Latitud y Longitud deben ser números.")
             return
-        new_id = self._get_next_id()
-        with open(CSV_FILE, "a", newline="", encoding="utf-8") as f:
-            csv.writer(f).writerow(
-                [new_id, lat_f, lon_f, tipo, com, "N/A", "Registro manual"]
-            )
+        (new_id,) = self.store.insertar(
+            [
+                {
+                    "lat": lat_f,
+                    "lon": lon_f,
+                    "tipo": tipo,
+                    "comentario": com,
+                    "puntuacion": "N/A",
+                    "razon_validacion": "Registro manual",
+                }
+            ]
+        )
         messagebox.showinfo("Éxito", f"Ubicación guardada con ID: {new_id}.")
         self.entry_lat.delete(0, tk.END)
         self.entry_lon.delete(0, tk.END)
         self.entry_comentario.delete(0, tk.END)
 
     def generar_mapa_completo(self):
-        df = self.leer_datos()
-        m = self.generar_mapa_base(df)  # Obtiene el mapa con las capas base
-
-        if not df.empty:
-            # Crea el clúster de marcadores y lo añade al mapa
-            mc = MarkerCluster(name="Ubicaciones Registradas").add_to(m)
-            for _, row in df.iterrows():
-                uid = int(row["id"])
-                score_info = f"<b>Puntuación:</b> {row.get('puntuacion', 'N/A')}<br>"
-                reason_info = (
-                    f"<b>Análisis:</b> {row.get('razon_validacion', 'N/A')}<br>"
-                )
-                popup_html = f"""<b>ID:</b> {uid}<br><b>Tipo:</b> {row["tipo"]}<br>
-                <b>Coords:</b> ({row["lat"]:.5f}, {row["lon"]:.5f})<br>
-                <b>Comentario:</b> {row.get("comentario", "N/A")}<hr>
-                {"".join([score_info, reason_info]) if "Generado" in str(row["tipo"]) else ""}
-                <a href="http://localhost:{SERVER_PORT}/delete?id={uid}" target="_blank" style="color:red;"><b>ELIMINAR</b></a>"""
-                iframe = folium.IFrame(html=popup_html, width=300, height=180)
-                popup = folium.Popup(iframe, max_width=300)
-                color, icon = (
-                    ("red", "home")
-                    if row["tipo"] == "Nido probable"
-                    else ("blue", "eye-open")
-                    if row["tipo"] == "Avistamiento"
-                    else ("green", "star")
-                    if row["tipo"] == "Generado Potencial"
-                    else ("purple", "question-sign")
-                )
-                folium.Marker(
-                    [row["lat"], row["lon"]],
-                    popup=popup,
-                    tooltip=f"ID: {uid} - {row['tipo']}",
-                    icon=folium.Icon(color=color, icon=icon, prefix="glyphicon"),
-                ).add_to(mc)
-
-        folium.LayerControl().add_to(m)
+        # Se construye fuera del hilo de Tk para no congelar la ventana
+        threading.Thread(target=self._construir_mapa, daemon=True).start()
 
-        map_path = os.path.realpath("mapa_gestion_aguilas.html")
-        m.save(map_path)
-        webbrowser.open(f"file://{map_path}")
-
-    def generar_y_validar_ubicaciones_threaded(self, num_gen, q):
-        df = self.leer_datos()
-        nidos = df[df["tipo"] == "Nido probable"].copy()
-        if len(nidos) < 2:
-            q.put(("ERROR", "Se necesitan al menos 2 'Nidos probables'."))
-            return
-        nidos["weight"] = nidos["comentario"].apply(calculate_comment_weight)
-        coords = nidos[["lat", "lon"]].to_numpy()
-        weights = nidos["weight"].to_numpy()
-        if np.sum(weights) == 0:
-            q.put(("ERROR", "Pesos calculados son cero."))
+    def _construir_mapa(self):
+        try:
+            preparar_mapa(self.store, os.path.realpath(MAP_FILE))
+        except Exception as e:
+            self.root.after(
+                0,
+                lambda e=e: messagebox.showerror("Error", f"No se pudo leer: {e}"),
+            )
             return
-        mean, cov = (
-            np.average(coords, axis=0, weights=weights),
-            np.cov(coords, rowvar=False, aweights=weights) + np.eye(2) * 1e-5,
-        )
+        url = f"http://127.0.0.1:{SERVER_PORT}/"
+        self.root.after(0, lambda: webbrowser.open(url))
 
-        valid_points = []
-        max_tries = num_gen * 30
-        for i in range(max_tries):
-            if len(valid_points) >= num_gen:
-                break
-            lat, lon = np.random.multivariate_normal(mean, cov, 1)[0]
-            is_valid, reason, score = get_location_viability(lat, lon)
-            q.put(
-                (
-                    "STATUS",
-                    f"Intento {i + 1}/{max_tries}: ({lat:.3f}, {lon:.3f}) -> {reason}",
-                )
-            )
-            if is_valid:
-                valid_points.append(
-                    {"lat": lat, "lon": lon, "score": score, "reason": reason}
-                )
-            time.sleep(0.2)
+    def ejecutar_trabajos_threaded(self, q):
+        # Toma trabajos de la cola hasta vaciarla
+        try:
+            while True:
+                trabajo = self.cola_trabajos.tomar()
+                if trabajo is None:
+                    break
+                q.put(("STATUS", f"{trabajo.nombre}: buscando {trabajo.num} puntos..."))
+                ejecutar_trabajo(trabajo, self.store, q)
+        finally:
+            self.store.cerrar_conexion_hilo()
+        q.put(("COLA_VACIA", None))
 
-        valid_points.sort(key=lambda p: p["score"], reverse=True)
-        q.put(("DONE", valid_points))
+    def lanzar_trabajos(self):
+        self.hilos_trabajos = [h for h in self.hilos_trabajos if h.is_alive()]
+        while len(self.hilos_trabajos) < JOBS_CONCURRENT:
+            hilo = threading.Thread(
+                target=self.ejecutar_trabajos_threaded,
+                args=(self.generation_queue,),
+                daemon=True,
+            )
+            hilo.start()
+            self.hilos_trabajos.append(hilo)
 
     def process_generation_queue(self):
-        try:
-            msg_type, data = self.generation_queue.get_nowait()
+        # Se vacía la cola en cada tic: con muchos hilos los STATUS llegan más
+        # rápido que uno cada 100 ms; de ellos solo se muestra el último
+        ultimo_estado = None
+        while True:
+            try:
+                msg_type, data = self.generation_queue.get_nowait()
+            except queue.Empty:
+                break
             if msg_type == "STATUS":
-                self.status_lbl.config(text=data)
-            elif msg_type == "ERROR":
+                ultimo_estado = data
+                continue
+            # Los demás mensajes fijan su propio texto
+            ultimo_estado = None
+            if msg_type == "ERROR":
                 messagebox.showerror("Error", data)
-                self.gen_btn.config(
-                    state=tk.NORMAL, text="Generar Predicciones Validadas"
-                )
                 self.status_lbl.config(text="Error. Inténtelo de nuevo.")
             elif msg_type == "DONE":
-                new_regs = []
-                if data:
-                    curr_id = self._get_next_id()
-                    new_regs = [
-                        [
-                            curr_id + i,
-                            p["lat"],
-                            p["lon"],
-                            "Generado Potencial",
-                            "Validado ecológicamente",
-                            p["score"],
-                            p["reason"],
-                        ]
-                        for i, p in enumerate(data)
-                    ]
-                    with open(CSV_FILE, "a", newline="", encoding="utf-8") as f:
-                        csv.writer(f).writerows(new_regs)
+                # Los puntos ya se guardaron uno a uno al validarse
                 messagebox.showinfo(
                     "Completo",
-                    f"Análisis finalizado. {len(new_regs)} ubicaciones viables guardadas.\nRegenere el mapa para verlas.",
-                )
-                self.gen_btn.config(
-                    state=tk.NORMAL, text="Generar Predicciones Validadas"
+                    f"Análisis finalizado. {len(data)} ubicaciones viables guardadas.\nEl mapa abierto las mostrará automáticamente.",
                 )
                 self.status_lbl.config(
-                    text=f"Proceso finalizado. {len(new_regs)} puntos añadidos."
+                    text=f"Proceso finalizado. {len(data)} puntos añadidos."
                 )
-        except queue.Empty:
-            pass
+            elif msg_type == "COLA_VACIA":
+                # Un trabajo encolado justo cuando el hilo terminaba
+                if self.cola_trabajos.pendientes():
+                    self.lanzar_trabajos()
+        if ultimo_estado is not None:
+            self.status_lbl.config(text=ultimo_estado)
         self.root.after(100, self.process_generation_queue)
 
     def start_server(self):
-        class Handler(http.server.SimpleHTTPRequestHandler):
-            app = self
-
-            def do_GET(self):
-                p = urlparse(self.path)
-                if p.path == "/delete":
-                    try:
-                        q = parse_qs(p.query)
-                        id_del = int(q.get("id", [None])[0])
-                        self.app.eliminar_ubicacion_por_id(id_del)
-                        self.send_response(200)
-                        self.send_header("Content-type", "text/html; charset=utf-8")
-                        self.end_headers()
-                        self.wfile.write(
-                            b"<html><body><p>Solicitud de eliminacion enviada. Puede cerrar esta pestana.</p></body></html>"
-                        )
-                    except (ValueError, IndexError, TypeError) as e:
-                        self.send_error(400, f"Solicitud invalida: {e}")
-                else:
-                    self.send_error(404, "Pagina no encontrada")
-
+        Handler = type("Handler", (ManejadorAPI,), {"app": self})
         try:
-            self.httpd = socketserver.TCPServer(("", SERVER_PORT), Handler)
+            self.httpd = http.server.ThreadingHTTPServer(
+                (SERVER_HOST, SERVER_PORT), Handler
+            )
+            self.httpd.daemon_threads = True
             threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
         except OSError as e:
             messagebox.showerror(
@@ -459,93 +1883,21 @@ class App:
         if self.httpd:
             self.httpd.shutdown()
             self.httpd.server_close()
+        # Los trabajos en curso se reanudarán al volver a abrir
+        self.cola_trabajos.liberar()
+        self.store.close()
         self.root.destroy()
 
-    def eliminar_ubicacion_por_id(self, id_del):
-        try:
-            df = pd.read_csv(CSV_FILE)
-            if id_del not in df["id"].values:
-                self.root.after(
-                    0,
-                    lambda: messagebox.showerror(
-                        "Error", f"No se encontro ID {id_del}."
-                    ),
-                )
-                return
-            df = df[df["id"] != id_del]
-            df.to_csv(CSV_FILE, index=False)
-            self.root.after(0, lambda: self.ask_to_regenerate_map(id_del))
-        except Exception as e:
+    def eliminar_ubicaciones(self, ids):
+        borrados = self.store.eliminar(ids)
+        if borrados:
             self.root.after(
-                0, lambda e=e: messagebox.showerror("Error al eliminar", str(e))
+                0,
+                lambda: self.status_lbl.config(
+                    text=f"{borrados} ubicaciones eliminadas. El mapa se actualiza solo."
+                ),
             )
-
-    def ask_to_regenerate_map(self, del_id):
-        if messagebox.askyesno(
-            "Exito",
-            f"Ubicacion con ID {del_id} eliminada.\nDesea regenerar el mapa ahora?",
-        ):
-            self.generar_mapa_completo()
-
-    def leer_datos(self):
-        try:
-            return pd.read_csv(CSV_FILE)
-        except (FileNotFoundError, pd.errors.EmptyDataError):
-            return pd.DataFrame(
-                columns=[
-                    "id",
-                    "lat",
-                    "lon",
-                    "tipo",
-                    "comentario",
-                    "puntuacion",
-                    "razon_validacion",
-                ]
-            )
-        except Exception as e:
-            messagebox.showerror("Error", f"No se pudo leer CSV: {e}")
-            return pd.DataFrame(
-                columns=[
-                    "id",
-                    "lat",
-                    "lon",
-                    "tipo",
-                    "comentario",
-                    "puntuacion",
-                    "razon_validacion",
-                ]
-            )
-
-    # <<<--- FUNCIÓN generar_mapa_base MODIFICADA ---<<<
-    def generar_mapa_base(self, df):
-        if df.empty or df["lat"].isnull().all():
-            map_center = [9.0, -80.0]
-            zoom_start = 5
-        else:
-            map_center = [df["lat"].mean(), df["lon"].mean()]
-            zoom_start = 6
-
-        m = folium.Map(location=map_center, zoom_start=zoom_start, tiles=None)
-
-        folium.TileLayer("OpenStreetMap", name="Estándar (Calles)").add_to(m)
-        folium.TileLayer(
-            "https://server.arcgisonline.com/ArcGIS/rest/services/World_Imagery/MapServer/tile/{z}/{y}/{x}",
-            attr="Esri",
-            name="Satélite",
-        ).add_to(m)
-        folium.TileLayer(
-            "https://{s}.tile.opentopomap.org/{z}/{x}/{y}.png",
-            attr="OpenTopoMap",
-            name="Topográfico",
-        ).add_to(m)
-        folium.TileLayer(
-            "https://{s}.basemaps.cartocdn.com/dark_all/{z}/{x}/{y}{r}.png",
-            attr="CartoDB",
-            name="Modo Oscuro",
-        ).add_to(m)
-
-        folium.LatLngPopup().add_to(m)
-        return m
+        return borrados
 
     def start_generation_thread(self):
         try:
@@ -557,16 +1909,16 @@ class App:
                 "Error", "Numero de predicciones debe ser un entero positivo."
             )
             return
-        self.gen_btn.config(state=tk.DISABLED, text="Analizando...")
-        self.status_lbl.config(text=f"Iniciando analisis para {num} puntos...")
-        threading.Thread(
-            target=self.generar_y_validar_ubicaciones_threaded,
-            args=(num, self.generation_queue),
-            daemon=True,
-        ).start()
+        trabajo_id = self.cola_trabajos.crear(num)
+        self.status_lbl.config(
+            text=f"Trabajo {trabajo_id} en cola: analisis para {num} puntos..."
+        )
+        self.lanzar_trabajos()
 
 
 if __name__ == "__main__":
+    if tk is None:
+        raise SystemExit("Tkinter no está instalado; use 'python -m cli --help'.")
     root = tk.Tk()
     app = App(root)
     if app.root.winfo_exists():
@@ -0,0 +1,466 @@
+import argparse
+import http.server
+import json
+import math
+import queue
+import random
+import re
+import tempfile
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse, parse_qs
+
+import numpy as np
+import pandas as pd
+
+import app
+from muestreo import MuestreadorCandidatos
+from modelos_muestreo import gaussiana
+
+# Banco de pruebas sin red: un servidor local imita elevación (open-meteo),
+# geocodificación inversa (Nominatim), Overpass y GBIF con capas sintéticas
+# deterministas de tierra/agua, poblados, bosque y presas, con latencia y
+# tasa de error configurables. Uso: python benchmark.py --candidatos 200
+
+FOREST_CELL_DEG = 0.01
+TOWN_CELL_DEG = 0.02
+CENTRO = (9.0, -79.5)
+
+
+def _hash01(i, j, salt):
+    h = (i * 73856093) ^ (j * 19349663) ^ (salt * 83492791)
+    h = (h ^ (h >> 13)) * 1274126177
+    return ((h ^ (h >> 16)) & 0xFFFFFFFF) / 2**32
+
+
+class CapasSinteticas:
+    def __init__(
+        self, semilla=0, bosque=0.55, poblados=0.08, n_presas=20000, extension=1.0
+    ):
+        self.semilla = semilla
+        self.bosque = bosque
+        self.poblados = poblados
+        rng = np.random.default_rng(semilla)
+        self.presas = np.column_stack(
+            [
+                rng.normal(CENTRO[0], extension, n_presas),
+                rng.normal(CENTRO[1], extension, n_presas),
+            ]
+        )
+
+    def elevacion(self, lat, lon):
+        if math.sin(lat * 7.0) + math.cos(lon * 5.0) < -1.3:
+            return 0.0
+        return round(40 + 900 * abs(math.sin(lat) * math.cos(lon)), 1)
+
+    def lugar(self, lat, lon):
+        if self.elevacion(lat, lon) <= 0:
+            return "water", "water"
+        i, j = math.floor(lat / TOWN_CELL_DEG), math.floor(lon / TOWN_CELL_DEG)
+        if _hash01(i, j, self.semilla + 1) < self.poblados:
+            return "place", "town"
+        return "landuse", "farmland"
+
+    def _celda_boscosa(self, i, j):
+        return _hash01(i, j, self.semilla + 2) < self.bosque
+
+    def bosques_en(self, min_lat, min_lon, max_lat, max_lon):
+        celdas = []
+        for i in range(
+            math.floor(min_lat / FOREST_CELL_DEG),
+            math.floor(max_lat / FOREST_CELL_DEG) + 1,
+        ):
+            for j in range(
+                math.floor(min_lon / FOREST_CELL_DEG),
+                math.floor(max_lon / FOREST_CELL_DEG) + 1,
+            ):
+                if self._celda_boscosa(i, j):
+                    celdas.append((i, j))
+        return celdas
+
+    @staticmethod
+    def _poligono(i, j):
+        lat, lon, d = i * FOREST_CELL_DEG, j * FOREST_CELL_DEG, FOREST_CELL_DEG
+        esquinas = [(lat, lon), (lat + d, lon), (lat + d, lon + d), (lat, lon + d)]
+        return {
+            "type": "way",
+            "tags": {"landuse": "forest"},
+            "geometry": [{"lat": a, "lon": b} for a, b in esquinas + esquinas[:1]],
+        }
+
+    def elementos_bosque(self, min_lat, min_lon, max_lat, max_lon):
+        return [
+            self._poligono(i, j)
+            for i, j in self.bosques_en(min_lat, min_lon, max_lat, max_lon)
+        ]
+
+    def elementos_suelo(self, min_lat, min_lon, max_lat, max_lon):
+        # Las celdas con poblado, como polígonos landuse=residential
+        elementos = []
+        for i in range(
+            math.floor(min_lat / TOWN_CELL_DEG), math.floor(max_lat / TOWN_CELL_DEG) + 1
+        ):
+            for j in range(
+                math.floor(min_lon / TOWN_CELL_DEG),
+                math.floor(max_lon / TOWN_CELL_DEG) + 1,
+            ):
+                if _hash01(i, j, self.semilla + 1) < self.poblados:
+                    lat, lon, d = i * TOWN_CELL_DEG, j * TOWN_CELL_DEG, TOWN_CELL_DEG
+                    esquinas = [
+                        (lat, lon),
+                        (lat + d, lon),
+                        (lat + d, lon + d),
+                        (lat, lon + d),
+                    ]
+                    elementos.append(
+                        {
+                            "type": "way",
+                            "tags": {"landuse": "residential"},
+                            "geometry": [
+                                {"lat": a, "lon": b} for a, b in esquinas + esquinas[:1]
+                            ],
+                        }
+                    )
+        return elementos
+
+    def presas_en(self, min_lat, min_lon, max_lat, max_lon):
+        p = self.presas
+        mask = (
+            (p[:, 0] >= min_lat)
+            & (p[:, 0] <= max_lat)
+            & (p[:, 1] >= min_lon)
+            & (p[:, 1] <= max_lon)
+        )
+        return p[mask]
+
+
+def _bbox_wkt(wkt):
+    nums = [float(v) for v in re.findall(r"-?\d+(?:\.\d+)?(?:e-?\d+)?", wkt)]
+    lons, lats = nums[0::2], nums[1::2]
+    return min(lats), min(lons), max(lats), max(lons)
+
+
+class ServidorSimulado:
+    def __init__(self, capas, latencia=0.0, error=0.0, semilla=0):
+        self.capas = capas
+        self.latencia = latencia
+        self.error = error
+        self.rng = random.Random(semilla)
+        self.rng_lock = threading.Lock()
+        self.llamadas = Counter()
+        self.fallos = Counter()
+        self.lock = threading.Lock()
+        Handler = type("Handler", (_ManejadorSimulado,), {"servidor": self})
+        self.httpd = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.httpd.daemon_threads = True
+        self.base = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+
+    def __enter__(self):
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def urls(self):
+        return {
+            "ELEVATION_API_URL": self.base + "/v1/elevation",
+            "REVERSE_GEO_API_URL": self.base + "/reverse",
+            "OVERPASS_API_URL": self.base + "/api/interpreter",
+            "GBIF_API_URL": self.base + "/v1/occurrence/search",
+        }
+
+    def contar(self, servicio):
+        with self.lock:
+            self.llamadas[servicio] += 1
+        with self.rng_lock:
+            falla = self.rng.random() < self.error
+            espera = self.rng.expovariate(1 / self.latencia) if self.latencia else 0
+        if espera:
+            time.sleep(espera)
+        if falla:
+            with self.lock:
+                self.fallos[servicio] += 1
+        return falla
+
+    def reiniciar(self):
+        with self.lock:
+            self.llamadas.clear()
+            self.fallos.clear()
+
+
+class _ManejadorSimulado(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    servidor = None
+
+    def log_message(self, *args):
+        pass
+
+    def _json(self, data, status=200):
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        p = urlparse(self.path)
+        q = parse_qs(p.query)
+        capas = self.servidor.capas
+        if p.path == "/v1/elevation":
+            if self.servidor.contar("elevacion"):
+                return self._json({"error": True}, 503)
+            lats = [float(v) for v in q["latitude"][0].split(",")]
+            lons = [float(v) for v in q["longitude"][0].split(",")]
+            self._json(
+                {"elevation": [capas.elevacion(a, b) for a, b in zip(lats, lons)]}
+            )
+        elif p.path == "/reverse":
+            if self.servidor.contar("geo_inversa"):
+                return self._json({"error": True}, 503)
+            cat, tipo = capas.lugar(float(q["lat"][0]), float(q["lon"][0]))
+            self._json({"category": cat, "type": tipo})
+        elif p.path == "/v1/occurrence/search":
+            if self.servidor.contar("gbif"):
+                return self._json({"error": True}, 503)
+            pts = capas.presas_en(*_bbox_wkt(q["geometry"][0]))
+            limit = int(q.get("limit", ["20"])[0])
+            offset = int(q.get("offset", ["0"])[0])
+            pagina = pts[offset : offset + limit]
+            self._json(
+                {
+                    "count": int(len(pts)),
+                    "offset": offset,
+                    "limit": limit,
+                    "endOfRecords": offset + limit >= len(pts),
+                    "results": [
+                        {"decimalLatitude": float(a), "decimalLongitude": float(b)}
+                        for a, b in pagina
+                    ],
+                }
+            )
+        else:
+            self._json({"error": "no encontrado"}, 404)
+
+    def do_POST(self):
+        if urlparse(self.path).path != "/api/interpreter":
+            return self._json({"error": "no encontrado"}, 404)
+        length = int(self.headers.get("Content-Length", 0) or 0)
+        query = self.rfile.read(length).decode("utf-8")
+        if self.servidor.contar("overpass"):
+            return self._json({"error": True}, 503)
+        capas = self.servidor.capas
+        around = re.search(r"around:([\d.]+),(-?[\d.]+),(-?[\d.]+)", query)
+        if around:
+            r, lat, lon = (float(v) for v in around.groups())
+            d_lat = r / 111320.0
+            d_lon = d_lat / max(math.cos(math.radians(lat)), 1e-6)
+            elementos = capas.elementos_bosque(
+                lat - d_lat, lon - d_lon, lat + d_lat, lon + d_lon
+            )
+        else:
+            bbox = re.search(r"\((-?[\d.]+),(-?[\d.]+),(-?[\d.]+),(-?[\d.]+)\)", query)
+            caja = [float(v) for v in bbox.groups()]
+            if '"place"' in query:
+                elementos = capas.elementos_suelo(*caja)
+            else:
+                elementos = capas.elementos_bosque(*caja)
+        self._json({"elements": elementos})
+
+
+def nidos_sinteticos(n=8, semilla=0, dispersion=0.15, grupos=1, separacion=0.6):
+    # Con grupos > 1 los nidos se reparten en zonas separadas ~separacion°
+    rng = np.random.default_rng(semilla)
+    centro = np.tile(CENTRO, (n, 1))
+    if grupos > 1:
+        centros = centro[0] + rng.uniform(-separacion, separacion, (grupos, 2))
+        centro = centros[np.arange(n) % grupos]
+        dispersion /= grupos
+    return pd.DataFrame(
+        {
+            "id": np.arange(1, n + 1),
+            "lat": centro[:, 0] + rng.normal(0, dispersion, n),
+            "lon": centro[:, 1] + rng.normal(0, dispersion, n),
+            "tipo": "Nido probable",
+            "comentario": ["nido con pareja", "adulto en nido", "pichón"] * (n // 3)
+            + ["nido"] * (n % 3),
+            "puntuacion": np.nan,
+            "razon_validacion": "Registro manual",
+        }
+    )
+
+
+def configurar_app(servidor, cache=False, tmpdir=None):
+    for nombre, url in servidor.urls().items():
+        setattr(app, nombre, url)
+    app.USE_SPATIAL_CACHE = cache
+    app._spatial_cache = None
+    tmpdir = tmpdir or tempfile.mkdtemp(prefix="nestguesser_bench_")
+    app.CACHE_FILE = f"{tmpdir}/cache.sqlite"
+    app.FOREST_INDEX_DIR = f"{tmpdir}/bosques"
+    app.LANDUSE_INDEX_DIR = f"{tmpdir}/suelo"
+    app.ACCEPTANCE_DB_FILE = f"{tmpdir}/historial.sqlite"
+    app._historial = None
+    app.RUN_SUMMARY_ENABLED = False
+    app._clientes = {}
+
+
+def _tabla_etapas(etapas):
+    filas = [
+        f"  {'etapa':<12}{'llamadas':>9}{'rech.':>7}{'err.':>6}{'p50 ms':>9}{'p99 ms':>9}"
+    ]
+    for nombre, s in etapas.items():
+        filas.append(
+            f"  {nombre:<12}{s['llamadas']:>9}{s['rechazos']:>7}{s['errores']:>6}"
+            f"{s['p50_s'] * 1000:>9.1f}{s['p99_s'] * 1000:>9.1f}"
+        )
+    return "\n".join(filas)
+
+
+def bench_validacion(servidor, n_candidatos, workers, semilla=0, nidos=8, grupos=1):
+    df = nidos_sinteticos(nidos, semilla=semilla, grupos=grupos)
+    coords = df[["lat", "lon"]].to_numpy()
+    sampler = MuestreadorCandidatos(
+        gaussiana(coords, np.ones(len(coords))),
+        rng=np.random.default_rng(semilla),
+    )
+    candidatos = sampler.siguientes(n_candidatos)
+    pipeline = app.crear_pipeline()
+    servidor.reiniciar()
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as ex:
+        resultados = list(
+            ex.map(
+                lambda p: app.get_location_viability(p[0], p[1], None, pipeline),
+                candidatos,
+            )
+        )
+    dt = time.perf_counter() - t0
+    aceptados = sum(1 for r in resultados if r[0])
+    llamadas = sum(servidor.llamadas.values())
+    return {
+        "candidatos": len(candidatos),
+        "aceptados": aceptados,
+        "segundos": dt,
+        "candidatos_s": len(candidatos) / dt if dt else 0.0,
+        "aceptados_s": aceptados / dt if dt else 0.0,
+        "http": dict(servidor.llamadas),
+        "http_por_aceptado": llamadas / aceptados if aceptados else float("inf"),
+        "etapas": pipeline.estadisticas(),
+    }
+
+
+def bench_generacion(servidor, n_predicciones, workers, semilla=0, nidos=8, grupos=1):
+    q = queue.Queue()
+    servidor.reiniciar()
+    t0 = time.perf_counter()
+    resumen = app.generar_predicciones(
+        nidos_sinteticos(nidos, semilla=semilla, grupos=grupos),
+        n_predicciones,
+        q,
+        max_workers=workers,
+        rng=np.random.default_rng(semilla),
+    )
+    dt = time.perf_counter() - t0
+    resumen = resumen or {"intentos": 0, "aceptados": 0, "etapas": {}}
+    llamadas = sum(servidor.llamadas.values())
+    aceptados = resumen["aceptados"]
+    return dict(
+        resumen,
+        segundos=dt,
+        candidatos_s=resumen["intentos"] / dt if dt else 0.0,
+        aceptados_s=aceptados / dt if dt else 0.0,
+        http=dict(servidor.llamadas),
+        http_por_aceptado=llamadas / aceptados if aceptados else float("inf"),
+    )
+
+
+def informe(nombre, r):
+    http_txt = ", ".join(f"{k}: {v}" for k, v in sorted(r["http"].items()))
+    filas = [
+        f"== {nombre} ==",
+        f"  {r.get('candidatos', r.get('intentos'))} candidatos, {r['aceptados']} aceptados "
+        f"en {r['segundos']:.2f} s",
+        f"  {r['candidatos_s']:.1f} candidatos/s, {r['aceptados_s']:.2f} aceptados/s",
+        f"  HTTP: {http_txt or 'ninguna'}",
+        f"  HTTP por punto aceptado: {r['http_por_aceptado']:.2f}",
+    ]
+    if "muestreo" in r:
+        m = r["muestreo"]
+        filas.append(
+            f"  Modelo de muestreo: {m['modelo']}, "
+            f"{m['descartados_historial']} descartados por historial"
+        )
+    filas.append(_tabla_etapas(r["etapas"]))
+    return "\n".join(filas)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark offline de Nest-Guesser")
+    parser.add_argument("--candidatos", type=int, default=200)
+    parser.add_argument("--predicciones", type=int, default=20)
+    parser.add_argument("--workers", type=int, default=app.MAX_WORKERS_VALIDACION)
+    parser.add_argument("--latencia-ms", type=float, default=20.0)
+    parser.add_argument("--error", type=float, default=0.0)
+    parser.add_argument("--bosque", type=float, default=0.55)
+    parser.add_argument("--poblados", type=float, default=0.08)
+    parser.add_argument("--semilla", type=int, default=0)
+    parser.add_argument("--nidos", type=int, default=8)
+    parser.add_argument(
+        "--rondas",
+        type=int,
+        default=1,
+        help="generaciones seguidas en la misma región (usan el historial)",
+    )
+    parser.add_argument(
+        "--grupos", type=int, default=1, help="zonas separadas de nidos sintéticos"
+    )
+    parser.add_argument("--cache", action="store_true", help="usar la caché espacial")
+    parser.add_argument("--json", help="guardar resultados en este archivo")
+    args = parser.parse_args(argv)
+
+    capas = CapasSinteticas(args.semilla, args.bosque, args.poblados)
+    with ServidorSimulado(
+        capas, args.latencia_ms / 1000.0, args.error, args.semilla
+    ) as servidor:
+        configurar_app(servidor, cache=args.cache)
+        resultados = {
+            "validacion": bench_validacion(
+                servidor,
+                args.candidatos,
+                args.workers,
+                args.semilla,
+                args.nidos,
+                args.grupos,
+            )
+        }
+        rondas = [
+            bench_generacion(
+                servidor,
+                args.predicciones,
+                args.workers,
+                args.semilla,
+                args.nidos,
+                args.grupos,
+            )
+            for _ in range(args.rondas)
+        ]
+        resultados["generacion"] = rondas[0]
+        if len(rondas) > 1:
+            resultados["rondas"] = rondas
+    print(informe("get_location_viability", resultados["validacion"]))
+    for n, r in enumerate(rondas, 1):
+        sufijo = f" (ronda {n})" if len(rondas) > 1 else ""
+        print(informe("generar_predicciones" + sufijo, r))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(dict(resultados, parametros=vars(args)), f, indent=2)
+    return resultados
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+import json
+import math
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+
+# Caché persistente de consultas externas indexada por celda lat/lon.
+# Cada servicio (namespace) tiene su propia precisión de celda, TTL y
+# límite de entradas; al superarlo se desalojan las menos usadas (LRU).
+
+DEFAULT_CELL_DEG = 0.001
+EVICTION_CHECK_EVERY = 200
+
+
+class CacheEspacial:
+    def __init__(self, path, precision=None, ttl=None, max_entries=100000):
+        self.path = path
+        self.precision = dict(precision or {})
+        self.ttl = dict(ttl or {})
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.hits = defaultdict(int)
+        self.misses = defaultdict(int)
+        self._puts = 0
+        self.conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        with self.lock:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+            self.conn.execute(
+                """CREATE TABLE IF NOT EXISTS cache (
+                    ns TEXT NOT NULL,
+                    clave TEXT NOT NULL,
+                    valor TEXT NOT NULL,
+                    creado REAL NOT NULL,
+                    accedido REAL NOT NULL,
+                    PRIMARY KEY (ns, clave)
+                )"""
+            )
+            self.conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_cache_lru ON cache (ns, accedido)"
+            )
+            self.conn.commit()
+
+    def clave(self, ns, lat, lon, extra=""):
+        cell = self.precision.get(ns, DEFAULT_CELL_DEG)
+        # El redondeo evita que 9.0 / 0.01 caiga en la celda 899
+        i, j = math.floor(round(lat / cell, 9)), math.floor(round(lon / cell, 9))
+        key = f"{i}:{j}"
+        return f"{key}:{extra}" if extra != "" else key
+
+    def get(self, ns, lat, lon, extra=""):
+        key = self.clave(ns, lat, lon, extra)
+        now = time.time()
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT valor, creado FROM cache WHERE ns = ? AND clave = ?",
+                (ns, key),
+            ).fetchone()
+            ttl = self.ttl.get(ns)
+            if row is None or (ttl is not None and now - row[1] > ttl):
+                self.misses[ns] += 1
+                return None
+            self.conn.execute(
+                "UPDATE cache SET accedido = ? WHERE ns = ? AND clave = ?",
+                (now, ns, key),
+            )
+            self.conn.commit()
+            self.hits[ns] += 1
+        return json.loads(row[0])
+
+    def put(self, ns, lat, lon, value, extra=""):
+        key = self.clave(ns, lat, lon, extra)
+        now = time.time()
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO cache (ns, clave, valor, creado, accedido) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (ns, key, json.dumps(value), now, now),
+            )
+            self._puts += 1
+            if self._puts % EVICTION_CHECK_EVERY == 0:
+                self._desalojar(ns)
+            self.conn.commit()
+
+    def _desalojar(self, ns):
+        ttl = self.ttl.get(ns)
+        if ttl is not None:
+            self.conn.execute(
+                "DELETE FROM cache WHERE ns = ? AND creado < ?", (ns, time.time() - ttl)
+            )
+        (count,) = self.conn.execute(
+            "SELECT COUNT(*) FROM cache WHERE ns = ?", (ns,)
+        ).fetchone()
+        if count > self.max_entries:
+            self.conn.execute(
+                """DELETE FROM cache WHERE ns = ? AND clave IN (
+                    SELECT clave FROM cache WHERE ns = ? ORDER BY accedido LIMIT ?
+                )""",
+                (ns, ns, count - self.max_entries),
+            )
+
+    def estadisticas(self):
+        with self.lock:
+            stats = {}
+            for ns in set(self.hits) | set(self.misses):
+                hits, misses = self.hits[ns], self.misses[ns]
+                total = hits + misses
+                stats[ns] = {
+                    "hits": hits,
+                    "misses": misses,
+                    "hit_rate": hits / total if total else 0.0,
+                }
+            return stats
+
+    def resumen(self):
+        partes = [
+            f"{ns.split('//')[-1].split('/')[0]}: {s['hits']}/{s['hits'] + s['misses']}"
+            for ns, s in sorted(self.estadisticas().items())
+        ]
+        return "Caché (aciertos/consultas) " + (", ".join(partes) or "sin uso")
+
+    def limpiar(self, ns=None):
+        with self.lock:
+            if ns is None:
+                self.conn.execute("DELETE FROM cache")
+            else:
+                self.conn.execute("DELETE FROM cache WHERE ns = ?", (ns,))
+            self.conn.commit()
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
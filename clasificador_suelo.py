@@ -0,0 +1,174 @@
+import json
+import math
+import os
+
+import numpy as np
+
+from indice_bosque import _anillo, _unir_anillos, _segmentos, METERS_PER_DEG
+
+# Rejilla local de uso del suelo (agua y poblados) para una región, construida
+# una vez a partir de elementos de OSM (Overpass) y guardada como .npy + .json
+# junto a ella. Se abre como memory map: cada consulta es una lectura de celda.
+
+SIN_DATO, LIBRE, AGUA, POBLADO = 0, 1, 2, 3
+NOMBRES = {AGUA: "agua", POBLADO: "poblado"}
+# Los poblados suelen venir como un nodo place=*: se marca un radio alrededor
+RADIOS_LUGAR_M = {"city": 5000, "town": 2000, "village": 800, "hamlet": 300}
+# Ancho con el que se marcan los ríos que sólo vienen como línea
+ANCHO_RIO_M = 30
+
+
+def _clase(tags):
+    if (
+        tags.get("natural") == "water"
+        or tags.get("waterway") in ("riverbank", "river", "canal")
+        or tags.get("landuse") == "reservoir"
+    ):
+        return AGUA
+    if tags.get("landuse") in ("residential", "commercial", "industrial"):
+        return POBLADO
+    if tags.get("place") in RADIOS_LUGAR_M:
+        return POBLADO
+    return None
+
+
+class ClasificadorSuelo:
+    def __init__(self, bbox, clases):
+        self.min_lat, self.min_lon, self.max_lat, self.max_lon = map(float, bbox)
+        self.clases = clases
+        self.n_filas, self.n_cols = clases.shape
+        self.res_lat = (self.max_lat - self.min_lat) / self.n_filas
+        self.res_lon = (self.max_lon - self.min_lon) / self.n_cols
+
+    @property
+    def bbox(self):
+        return self.min_lat, self.min_lon, self.max_lat, self.max_lon
+
+    @classmethod
+    def desde_overpass(cls, bbox, elements, res_deg):
+        min_lat, min_lon, max_lat, max_lon = bbox
+        n_filas = max(1, math.ceil(round((max_lat - min_lat) / res_deg, 6)))
+        n_cols = max(1, math.ceil(round((max_lon - min_lon) / res_deg, 6)))
+        clasificador = cls(
+            (min_lat, min_lon, min_lat + n_filas * res_deg, min_lon + n_cols * res_deg),
+            np.full((n_filas, n_cols), LIBRE, dtype=np.uint8),
+        )
+        # El agua se pinta al final: prevalece sobre un poblado que la rodee
+        for clase in (POBLADO, AGUA):
+            for el in elements:
+                if _clase(el.get("tags", {})) != clase:
+                    continue
+                if el.get("type") == "node" and "lat" in el:
+                    radio = RADIOS_LUGAR_M.get(el["tags"].get("place"), ANCHO_RIO_M)
+                    clasificador._marcar_circulo(el["lat"], el["lon"], radio, clase)
+                elif el.get("type") == "way" and el.get("geometry"):
+                    anillo = _anillo(el["geometry"])
+                    if anillo[0] == anillo[-1]:
+                        clasificador._rellenar([anillo], clase)
+                    else:
+                        clasificador._marcar_linea(anillo, clase)
+                elif el.get("type") == "relation":
+                    tramos = [
+                        _anillo(m["geometry"])
+                        for m in el.get("members", [])
+                        if m.get("type") == "way" and m.get("geometry")
+                    ]
+                    anillos = _unir_anillos(tramos)
+                    if anillos:
+                        clasificador._rellenar(anillos, clase)
+        return clasificador
+
+    def _fila(self, lat):
+        return int(math.floor((self.max_lat - lat) / self.res_lat))
+
+    def _col(self, lon):
+        return int(math.floor((lon - self.min_lon) / self.res_lon))
+
+    def _rellenar(self, anillos, clase):
+        # Barrido por filas con la regla par-impar sobre el centro de cada celda
+        segs = _segmentos(anillos)
+        if not len(segs):
+            return
+        f0 = max(0, self._fila(segs[:, [0, 2]].max()))
+        f1 = min(self.n_filas - 1, self._fila(segs[:, [0, 2]].min()))
+        y1, x1, y2, x2 = segs.T
+        for f in range(f0, f1 + 1):
+            y = self.max_lat - (f + 0.5) * self.res_lat
+            cruza = (y1 > y) != (y2 > y)
+            if not cruza.any():
+                continue
+            xs = np.sort(
+                x1[cruza]
+                + (y - y1[cruza]) * (x2[cruza] - x1[cruza]) / (y2[cruza] - y1[cruza])
+            )
+            for a, b in zip(xs[0::2], xs[1::2]):
+                c0 = max(0, math.ceil((a - self.min_lon) / self.res_lon - 0.5))
+                c1 = min(
+                    self.n_cols - 1, math.floor((b - self.min_lon) / self.res_lon - 0.5)
+                )
+                if c0 <= c1:
+                    self.clases[f, c0 : c1 + 1] = clase
+
+    def _marcar_circulo(self, lat, lon, radio_m, clase):
+        d_lat = radio_m / METERS_PER_DEG
+        d_lon = d_lat / max(math.cos(math.radians(lat)), 1e-6)
+        f0, f1 = max(0, self._fila(lat + d_lat)), min(
+            self.n_filas - 1, self._fila(lat - d_lat)
+        )
+        c0, c1 = max(0, self._col(lon - d_lon)), min(
+            self.n_cols - 1, self._col(lon + d_lon)
+        )
+        if f0 > f1 or c0 > c1:
+            return
+        lats = self.max_lat - (np.arange(f0, f1 + 1) + 0.5) * self.res_lat
+        lons = self.min_lon + (np.arange(c0, c1 + 1) + 0.5) * self.res_lon
+        dentro = ((lats[:, None] - lat) / d_lat) ** 2 + (
+            (lons[None, :] - lon) / d_lon
+        ) ** 2 <= 1
+        # Una celda más pequeña que el radio siempre queda marcada
+        fila, col = self._fila(lat), self._col(lon)
+        if f0 <= fila <= f1 and c0 <= col <= c1:
+            dentro[fila - f0, col - c0] = True
+        self.clases[f0 : f1 + 1, c0 : c1 + 1][dentro] = clase
+
+    def _marcar_linea(self, puntos, clase):
+        # Muestrea la línea a media celda y marca un ancho de ANCHO_RIO_M
+        paso = min(self.res_lat, self.res_lon) / 2
+        for (a_lat, a_lon), (b_lat, b_lon) in zip(puntos[:-1], puntos[1:]):
+            n = max(1, int(math.hypot(b_lat - a_lat, b_lon - a_lon) / paso))
+            for t in np.linspace(0, 1, n + 1):
+                self._marcar_circulo(
+                    a_lat + t * (b_lat - a_lat),
+                    a_lon + t * (b_lon - a_lon),
+                    ANCHO_RIO_M / 2,
+                    clase,
+                )
+
+    def guardar(self, path):
+        np.save(path, np.asarray(self.clases))
+        with open(os.path.splitext(path)[0] + ".json", "w", encoding="utf-8") as f:
+            json.dump({"bbox": list(self.bbox)}, f)
+
+    @classmethod
+    def cargar(cls, path):
+        with open(os.path.splitext(path)[0] + ".json", encoding="utf-8") as f:
+            meta = json.load(f)
+        clases = np.load(path, mmap_mode="r")
+        if clases.ndim != 2:
+            raise ValueError(f"La rejilla de suelo debe ser 2D, no {clases.shape}")
+        return cls(meta["bbox"], clases)
+
+    @staticmethod
+    def bbox_guardado(path):
+        with open(os.path.splitext(path)[0] + ".json", encoding="utf-8") as f:
+            return tuple(json.load(f)["bbox"])
+
+    def cubre(self, lat, lon):
+        return self.min_lat <= lat < self.max_lat and self.min_lon <= lon < self.max_lon
+
+    def clase(self, lat, lon):
+        if not self.cubre(lat, lon):
+            return SIN_DATO
+        fila = min(self._fila(lat), self.n_filas - 1)
+        col = min(self._col(lon), self.n_cols - 1)
+        return int(self.clases[fila, col])
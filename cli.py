@@ -0,0 +1,596 @@
+import argparse
+import http.server
+import json
+import multiprocessing
+import os
+import queue
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stdout
+
+import app
+from almacenamiento import (
+    crear_almacen,
+    exportar_bloques,
+    leer_fuente,
+    preparar_importacion,
+    BLOQUE_FILAS,
+)
+
+# Modo sin ventana: las mismas operaciones de la interfaz desde la línea de
+# comandos, para servidores y cron.
+#
+#   python -m cli generar --num 20 --salida predicciones.jsonl
+#   python -m cli lote regiones.json --procesos 4
+#   python -m cli importar avistamientos.csv
+#   python -m cli exportar ubicaciones.csv --tipo "Nido probable"
+#   python -m cli mapa --salida mapa.html
+#   python -m cli suelo --bbox 8.5,-80.2,9.5,-79.2 --desde extracto_osm.json
+#   python -m cli servir --puerto 8080
+#   python -m cli trabajos encolar --num 50 --bbox 8.5,-80.2,9.5,-79.2
+#   python -m cli trabajos ejecutar --concurrentes 2
+#
+# Las predicciones se escriben como JSON Lines (una por línea) a medida que se
+# validan, no al terminar; los resúmenes y mensajes de avance van a stderr.
+
+TIPO_NIDO = "Nido probable"
+
+
+class ColaRegion:
+    # Adapta la cola de generar_predicciones: etiqueta cada mensaje con la región
+    def __init__(self, region, destino):
+        self.region = region
+        self.destino = destino
+
+    def put(self, msg):
+        self.destino.put((self.region, msg))
+
+
+class _Directa:
+    # En un solo proceso los mensajes se atienden en el momento (desde varios
+    # hilos si hay trabajos simultáneos)
+    def __init__(self, manejador):
+        self.manejador = manejador
+        self.lock = threading.Lock()
+
+    def put(self, item):
+        with self.lock:
+            self.manejador.manejar(*item)
+
+
+class SalidaPredicciones:
+    def __init__(self, archivo, store=None, verbose=False):
+        self.archivo = archivo
+        self.store = store
+        self.verbose = verbose
+        self.validos = {}
+        self.errores = {}
+
+    def manejar(self, region, msg):
+        tipo, data = msg
+        if tipo == "VALIDO":
+            registro = {"region": region, **data}
+            if self.store is not None:
+                (registro["id"],) = self.store.insertar(
+                    app.registros_prediccion([data])
+                )
+            self.archivo.write(json.dumps(registro, ensure_ascii=False) + "\n")
+            self.archivo.flush()
+            self.validos[region] = self.validos.get(region, 0) + 1
+        elif tipo == "ERROR":
+            self.errores[region] = data
+            print(f"[{region}] Error: {data}", file=sys.stderr)
+        elif tipo == "STATUS" and self.verbose:
+            print(f"[{region}] {data}", file=sys.stderr)
+
+
+def configurar(args):
+    app.STORAGE_BACKEND = args.backend
+    app.DB_FILE = args.db
+    app.CSV_FILE = args.csv
+    app.USE_SPATIAL_CACHE = not args.sin_cache
+    app.ACCEPTANCE_HISTORY_ENABLED = not args.sin_historial
+    app.JOBS_DB_FILE = args.db_trabajos
+    app.RUN_SUMMARY_ENABLED = not args.sin_resumen
+
+
+def abrir_almacen():
+    if app.STORAGE_BACKEND == "csv" and app.preparar_csv(app.CSV_FILE):
+        print(f"CSV antiguo renombrado a {app.CSV_FILE}.bak", file=sys.stderr)
+    return crear_almacen(app.STORAGE_BACKEND, app.DB_FILE, app.CSV_FILE)
+
+
+def abrir_salida(path):
+    if path in (None, "-"):
+        return sys.stdout
+    return open(path, "a", encoding="utf-8")
+
+
+def cmd_generar(args):
+    store = abrir_almacen()
+    try:
+        salida = abrir_salida(args.salida)
+        manejador = SalidaPredicciones(
+            salida, None if args.no_guardar else store, args.verbose
+        )
+        df = store.leer(app.COLUMNAS_GENERACION, [TIPO_NIDO])
+        if args.bbox:
+            df = filtrar_bbox(df, args.bbox)
+        with redirect_stdout(sys.stderr):
+            app.generar_predicciones(
+                df,
+                args.num,
+                ColaRegion("local", _Directa(manejador)),
+                args.workers,
+                store=store,
+            )
+        if salida is not sys.stdout:
+            salida.close()
+    finally:
+        store.close()
+    print(
+        f"{manejador.validos.get('local', 0)} predicciones validadas.", file=sys.stderr
+    )
+    return 1 if manejador.errores else 0
+
+
+def filtrar_bbox(df, bbox):
+    min_lat, min_lon, max_lat, max_lon = bbox
+    return df[df["lat"].between(min_lat, max_lat) & df["lon"].between(min_lon, max_lon)]
+
+
+def leer_regiones(path):
+    # JSON con una lista de regiones, o JSON Lines con una región por línea:
+    # {"nombre": ..., "num": 5, "nidos": [{"lat", "lon", "comentario"}, ...]}
+    # o, en lugar de "nidos", "bbox": [min_lat, min_lon, max_lat, max_lon] para
+    # tomar los nidos registrados en esa zona.
+    with open(path, encoding="utf-8") as f:
+        texto = f.read()
+    try:
+        regiones = json.loads(texto)
+    except json.JSONDecodeError:
+        regiones = [json.loads(l) for l in texto.splitlines() if l.strip()]
+    if isinstance(regiones, dict):
+        regiones = regiones.get("regiones", [regiones])
+    for i, region in enumerate(regiones):
+        region.setdefault("nombre", f"region_{i + 1}")
+        if "nidos" not in region and "bbox" not in region:
+            raise ValueError(f"La región {region['nombre']} no tiene 'nidos' ni 'bbox'")
+    return regiones
+
+
+def _iniciar_proceso(config, procesos):
+    for nombre, valor in config.items():
+        setattr(app, nombre, valor)
+    # Los límites por servicio (Nominatim: 1 petición/s) y sus ráfagas se
+    # reparten entre procesos para que el total no los supere; la ráfaga nunca
+    # baja de una petición, o el cliente no podría hacer ninguna
+    app.UPSTREAM_RATE_LIMITS = {
+        url: rate / procesos for url, rate in app.UPSTREAM_RATE_LIMITS.items()
+    }
+    app.UPSTREAM_BURST = {
+        url: max(1, burst // procesos) for url, burst in app.UPSTREAM_BURST.items()
+    }
+    app._clientes = {}
+    app._historial = None
+
+
+def _procesar_region(region, df, cola, workers):
+    t0 = time.perf_counter()
+    # Sólo para leer: la separación mínima frente a lo ya guardado
+    store = crear_almacen(app.STORAGE_BACKEND, app.DB_FILE, app.CSV_FILE)
+    try:
+        with redirect_stdout(sys.stderr):
+            resumen = app.generar_predicciones(
+                df,
+                int(region.get("num", 5)),
+                ColaRegion(region["nombre"], cola),
+                workers,
+                store=store,
+            )
+    finally:
+        store.close()
+    return {
+        "region": region["nombre"],
+        "segundos": time.perf_counter() - t0,
+        "intentos": resumen["intentos"] if resumen else 0,
+        "aceptados": resumen["aceptados"] if resumen else 0,
+    }
+
+
+def cmd_lote(args):
+    regiones = leer_regiones(args.archivo)
+    store = abrir_almacen()
+    try:
+        salida = abrir_salida(args.salida)
+        manejador = SalidaPredicciones(
+            salida, None if args.no_guardar else store, args.verbose
+        )
+        procesos = max(1, min(args.procesos, len(regiones)))
+        config = {
+            nombre: getattr(app, nombre)
+            for nombre in (
+                "STORAGE_BACKEND",
+                "DB_FILE",
+                "CSV_FILE",
+                "USE_SPATIAL_CACHE",
+                "ACCEPTANCE_HISTORY_ENABLED",
+                "RUN_SUMMARY_ENABLED",
+            )
+        }
+        with multiprocessing.Manager() as manager:
+            cola = manager.Queue()
+            with ProcessPoolExecutor(
+                max_workers=procesos,
+                initializer=_iniciar_proceso,
+                initargs=(config, procesos),
+            ) as pool:
+                futuros = {
+                    pool.submit(
+                        _procesar_region,
+                        region,
+                        # Las regiones tienen el mismo formato que los trabajos
+                        app.nidos_trabajo(region, store),
+                        cola,
+                        args.workers,
+                    ): region["nombre"]
+                    for region in regiones
+                }
+                pendientes = set(futuros)
+                # Sólo este proceso escribe la salida y el almacén
+                while pendientes or not cola.empty():
+                    try:
+                        manejador.manejar(*cola.get(timeout=0.2))
+                    except queue.Empty:
+                        pass
+                    pendientes = {f for f in pendientes if not f.done()}
+            for fut, nombre in futuros.items():
+                try:
+                    r = fut.result()
+                    print(
+                        f"[{nombre}] {r['aceptados']} aceptados de {r['intentos']} "
+                        f"intentos en {r['segundos']:.1f} s",
+                        file=sys.stderr,
+                    )
+                except Exception as e:
+                    manejador.errores[nombre] = str(e)
+                    print(f"[{nombre}] Error: {e}", file=sys.stderr)
+        if salida is not sys.stdout:
+            salida.close()
+    finally:
+        store.close()
+    return 1 if manejador.errores else 0
+
+
+def cmd_trabajos_encolar(args):
+    cola = app.get_cola_trabajos()
+    if args.desde:
+        trabajos = leer_regiones(args.desde)
+    else:
+        trabajos = [{"num": args.num}]
+        if args.nombre:
+            trabajos[0]["nombre"] = args.nombre
+        if args.bbox:
+            trabajos[0]["bbox"] = args.bbox
+    for parametros in trabajos:
+        trabajo_id = cola.crear(int(parametros.get("num", 5)), parametros)
+        print(f"Trabajo {trabajo_id} en cola.", file=sys.stderr)
+    return 0
+
+
+def cmd_trabajos_lista(args):
+    for t in app.get_cola_trabajos().listar(args.estado):
+        nombre = json.loads(t["parametros"] or "{}").get("nombre", "")
+        error = f"  {t['error']}" if t["error"] else ""
+        print(
+            f"{t['id']:>5}  {t['estado']:<10}  {t['aceptados']:>4}/{t['num']:<4}  "
+            f"{t['intentos']:>6} intentos  {nombre}{error}"
+        )
+    return 0
+
+
+def cmd_trabajos_cancelar(args):
+    if not app.get_cola_trabajos().cancelar(args.id):
+        print(f"El trabajo {args.id} no está pendiente ni en curso.", file=sys.stderr)
+        return 1
+    return 0
+
+
+def cmd_trabajos_reanudar(args):
+    if not app.get_cola_trabajos().reanudar(args.id):
+        print(f"El trabajo {args.id} no está fallido ni cancelado.", file=sys.stderr)
+        return 1
+    return 0
+
+
+def _ejecutar_cola(cola, store, destino, workers):
+    try:
+        while True:
+            trabajo = cola.tomar()
+            if trabajo is None:
+                return
+            app.ejecutar_trabajo(
+                trabajo, store, ColaRegion(trabajo.nombre, destino), workers
+            )
+    finally:
+        store.cerrar_conexion_hilo()
+
+
+def cmd_trabajos_ejecutar(args):
+    # Ejecuta los trabajos pendientes (y los interrumpidos) hasta vaciar la
+    # cola. Otros procesos pueden atender la misma cola a la vez
+    cola = app.get_cola_trabajos()
+    recuperados = cola.recuperar()
+    if recuperados:
+        print(
+            f"{recuperados} trabajos interrumpidos vuelven a la cola.", file=sys.stderr
+        )
+    store = abrir_almacen()
+    salida = abrir_salida(args.salida)
+    # El almacén lo escribe ejecutar_trabajo; aquí sólo se escribe la salida
+    manejador = SalidaPredicciones(salida, None, args.verbose)
+    hilos = [
+        threading.Thread(
+            target=_ejecutar_cola,
+            args=(cola, store, _Directa(manejador), args.workers),
+            daemon=True,
+        )
+        for _ in range(max(1, args.concurrentes))
+    ]
+    try:
+        # salida ya apunta al stdout real: los print de los hilos van a stderr
+        with redirect_stdout(sys.stderr):
+            for hilo in hilos:
+                hilo.start()
+            for hilo in hilos:
+                while hilo.is_alive():
+                    hilo.join(0.5)
+    except KeyboardInterrupt:
+        print("Interrumpido; los trabajos se reanudarán.", file=sys.stderr)
+    finally:
+        cola.liberar()
+        if salida is not sys.stdout:
+            salida.close()
+        store.close()
+    print(f"{sum(manejador.validos.values())} predicciones validadas.", file=sys.stderr)
+    return 1 if manejador.errores else 0
+
+
+def cmd_importar(args):
+    # Por bloques: el archivo nunca se carga entero en memoria
+    store = abrir_almacen()
+    importadas = descartadas = 0
+    try:
+        for df in leer_fuente(args.archivo, tamano=args.bloque):
+            validas, n = preparar_importacion(df, args.tipo)
+            importadas += store.insertar_bloque(validas)
+            descartadas += n
+            if args.verbose:
+                print(f"{importadas} importadas...", file=sys.stderr)
+    except (ValueError, RuntimeError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    finally:
+        store.close()
+    print(
+        f"{importadas} ubicaciones importadas, {descartadas} descartadas.",
+        file=sys.stderr,
+    )
+    return 0
+
+
+def cmd_exportar(args):
+    columnas = args.columnas.split(",") if args.columnas else None
+    lectura = columnas
+    if columnas and args.bbox:
+        lectura = list(dict.fromkeys(columnas + ["lat", "lon"]))
+
+    def bloques():
+        # A precisión completa: la exportación debe poder reimportarse igual
+        for df in store.leer_por_bloques(
+            lectura, args.tipo, args.bloque, compactos=False
+        ):
+            if args.bbox:
+                df = filtrar_bbox(df, args.bbox)
+            yield df[columnas] if columnas else df
+
+    store = abrir_almacen()
+    try:
+        filas = exportar_bloques(bloques(), args.salida)
+    except RuntimeError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    finally:
+        store.close()
+    print(f"{filas} ubicaciones exportadas a {args.salida}.", file=sys.stderr)
+    return 0
+
+
+def cmd_suelo(args):
+    elementos = None
+    if args.desde:
+        with open(args.desde, encoding="utf-8") as f:
+            datos = json.load(f)
+        if isinstance(datos, dict) and datos.get("remark"):
+            # Un extracto cortado por Overpass se guardaría sin caducidad
+            print(f"Extracto incompleto: {datos['remark']}", file=sys.stderr)
+            return 1
+        elementos = datos["elements"] if isinstance(datos, dict) else datos
+    clasificador = app.construir_clasificador_suelo(args.bbox, elementos)
+    if clasificador is None:
+        return 1
+    print(
+        f"Rejilla de suelo {clasificador.n_filas}x{clasificador.n_cols} "
+        f"guardada en {app.LANDUSE_INDEX_DIR}.",
+        file=sys.stderr,
+    )
+    return 0
+
+
+def cmd_mapa(args):
+    map_path = os.path.realpath(args.salida)
+    store = abrir_almacen()
+    try:
+        # Sin URL propia: pide los datos al servidor que la sirve (servir --mapa)
+        app.guardar_mapa_gestion(store.leer(["lat", "lon"]), map_path, "")
+    finally:
+        store.close()
+    print(f"Mapa guardado en {map_path}; se abre desde 'servir'.", file=sys.stderr)
+    return 0
+
+
+class AppSinVentana:
+    # Lo que ManejadorAPI necesita de App, sin Tk
+    def __init__(self, store):
+        self.store = store
+
+    def eliminar_ubicaciones(self, ids):
+        return self.store.eliminar(ids)
+
+
+def cmd_servir(args):
+    app.MAP_FILE = args.mapa
+    if args.host not in app.SERVER_ALLOWED_HOSTS + ("", "0.0.0.0"):
+        app.SERVER_ALLOWED_HOSTS += (args.host,)
+    store = abrir_almacen()
+    Handler = type("Handler", (app.ManejadorAPI,), {"app": AppSinVentana(store)})
+    httpd = http.server.ThreadingHTTPServer((args.host, args.puerto), Handler)
+    httpd.daemon_threads = True
+    print(
+        f"Sirviendo el mapa y su API en http://{args.host or '127.0.0.1'}:{args.puerto}/.",
+        file=sys.stderr,
+    )
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.server_close()
+        store.close()
+    return 0
+
+
+def _bbox(texto):
+    valores = [float(v) for v in texto.split(",")]
+    if len(valores) != 4:
+        raise argparse.ArgumentTypeError("bbox: min_lat,min_lon,max_lat,max_lon")
+    return valores
+
+
+def crear_parser():
+    parser = argparse.ArgumentParser(prog="cli", description="Nest-Guesser sin ventana")
+    parser.add_argument(
+        "--backend", choices=["sqlite", "csv"], default=app.STORAGE_BACKEND
+    )
+    parser.add_argument("--db", default=app.DB_FILE)
+    parser.add_argument("--csv", default=app.CSV_FILE)
+    parser.add_argument(
+        "--db-trabajos", default=app.JOBS_DB_FILE, help="cola de trabajos (SQLite)"
+    )
+    parser.add_argument(
+        "--sin-cache", action="store_true", help="no usar la caché espacial"
+    )
+    parser.add_argument(
+        "--sin-historial",
+        action="store_true",
+        help="no usar ni guardar el historial de validaciones",
+    )
+    parser.add_argument(
+        "--sin-resumen",
+        action="store_true",
+        help="no guardar el resumen JSON de cada ejecución",
+    )
+    parser.add_argument("-v", "--verbose", action="store_true")
+    sub = parser.add_subparsers(dest="comando", required=True)
+
+    p = sub.add_parser("generar", help="generar predicciones con los nidos registrados")
+    p.add_argument("--num", type=int, default=5)
+    p.add_argument("--workers", type=int, default=app.MAX_WORKERS_VALIDACION)
+    p.add_argument("--bbox", type=_bbox, help="usar sólo los nidos de esta zona")
+    p.add_argument("--salida", help="archivo JSON Lines (por defecto, stdout)")
+    p.add_argument("--no-guardar", action="store_true", help="no añadirlas al almacén")
+    p.set_defaults(func=cmd_generar)
+
+    p = sub.add_parser("lote", help="procesar varias regiones en paralelo")
+    p.add_argument("archivo", help="JSON o JSON Lines con las regiones")
+    p.add_argument("--procesos", type=int, default=os.cpu_count() or 1)
+    p.add_argument("--workers", type=int, default=app.MAX_WORKERS_VALIDACION)
+    p.add_argument("--salida", help="archivo JSON Lines (por defecto, stdout)")
+    p.add_argument("--no-guardar", action="store_true", help="no añadirlas al almacén")
+    p.set_defaults(func=cmd_lote)
+
+    p = sub.add_parser(
+        "importar", help="añadir ubicaciones desde CSV, Parquet o Feather"
+    )
+    p.add_argument("archivo")
+    p.add_argument("--tipo", help="tipo para todas las filas importadas")
+    p.add_argument("--bloque", type=int, default=BLOQUE_FILAS, help="filas por bloque")
+    p.set_defaults(func=cmd_importar)
+
+    p = sub.add_parser(
+        "exportar",
+        help="exportar ubicaciones (.csv, .json, .jsonl, .parquet o .feather)",
+    )
+    p.add_argument("salida")
+    p.add_argument("--columnas", help="lista separada por comas (por defecto, todas)")
+    p.add_argument("--bloque", type=int, default=BLOQUE_FILAS, help="filas por bloque")
+    p.add_argument("--tipo", action="append", help="filtrar por tipo (repetible)")
+    p.add_argument("--bbox", type=_bbox)
+    p.set_defaults(func=cmd_exportar)
+
+    p = sub.add_parser("suelo", help="preparar la rejilla local de agua y poblados")
+    p.add_argument("--bbox", type=_bbox, required=True)
+    p.add_argument(
+        "--desde", help="JSON de Overpass (extracto de OSM) en lugar de descargarlo"
+    )
+    p.set_defaults(func=cmd_suelo)
+
+    p = sub.add_parser("mapa", help="escribir el mapa de gestión")
+    p.add_argument("--salida", default=app.MAP_FILE)
+    p.set_defaults(func=cmd_mapa)
+
+    p = sub.add_parser("servir", help="servir la API del mapa sin interfaz")
+    p.add_argument("--host", default=app.SERVER_HOST)
+    p.add_argument("--mapa", default=app.MAP_FILE)
+    p.add_argument("--puerto", type=int, default=app.SERVER_PORT)
+    p.set_defaults(func=cmd_servir)
+
+    p = sub.add_parser("trabajos", help="cola de trabajos de generación reanudables")
+    acciones = p.add_subparsers(dest="accion", required=True)
+    a = acciones.add_parser("encolar", help="añadir un trabajo a la cola")
+    a.add_argument("--num", type=int, default=5)
+    a.add_argument("--nombre")
+    a.add_argument("--bbox", type=_bbox, help="usar sólo los nidos de esta zona")
+    a.add_argument(
+        "--desde", help="JSON o JSON Lines con regiones (como 'lote'): uno por región"
+    )
+    a.set_defaults(func=cmd_trabajos_encolar)
+    a = acciones.add_parser("lista", help="ver los trabajos y su avance")
+    a.add_argument("--estado", action="append", help="filtrar por estado (repetible)")
+    a.set_defaults(func=cmd_trabajos_lista)
+    a = acciones.add_parser(
+        "ejecutar", help="ejecutar los trabajos pendientes e interrumpidos"
+    )
+    a.add_argument("--concurrentes", type=int, default=app.JOBS_CONCURRENT)
+    a.add_argument("--workers", type=int, default=app.MAX_WORKERS_VALIDACION)
+    a.add_argument("--salida", help="archivo JSON Lines (por defecto, stdout)")
+    a.set_defaults(func=cmd_trabajos_ejecutar)
+    a = acciones.add_parser("cancelar", help="cancelar un trabajo")
+    a.add_argument("id", type=int)
+    a.set_defaults(func=cmd_trabajos_cancelar)
+    a = acciones.add_parser("reanudar", help="volver a encolar un trabajo fallido")
+    a.add_argument("id", type=int)
+    a.set_defaults(func=cmd_trabajos_reanudar)
+    return parser
+
+
+def main(argv=None):
+    args = crear_parser().parse_args(argv)
+    configurar(args)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
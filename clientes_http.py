@@ -0,0 +1,213 @@
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from metricas import METRICAS
+
+# Cliente compartido para cada servicio externo: una sesión con conexiones
+# persistentes (keep-alive), cubeta de fichas para el límite de peticiones,
+# reintentos con espera exponencial y jitter ante 429/5xx o errores de red, y
+# un cortacircuitos que pausa el servicio cuando falla de forma continuada.
+
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+METRICAS.describir(
+    "nestguesser_http_peticiones_total", "Peticiones HTTP respondidas por servicio"
+)
+METRICAS.describir(
+    "nestguesser_http_errores_total",
+    "Peticiones HTTP fallidas (red, 429/5xx o circuito abierto)",
+)
+METRICAS.describir("nestguesser_http_reintentos_total", "Reintentos de peticiones HTTP")
+METRICAS.describir(
+    "nestguesser_http_circuito_aperturas_total",
+    "Veces que se abrió el cortacircuitos de un servicio",
+)
+METRICAS.describir(
+    "nestguesser_http_segundos", "Duración de las peticiones HTTP respondidas"
+)
+
+
+class CircuitoAbierto(requests.RequestException):
+    pass
+
+
+class TokenBucket:
+    def __init__(self, rate, capacidad=1.0):
+        self.rate = rate
+        self.capacidad = capacidad
+        self.fichas = capacidad
+        self.ultimo = time.monotonic()
+        self.lock = threading.Lock()
+
+    def esperar(self):
+        # Las fichas pueden quedar en negativo: cada hilo reserva su turno y
+        # duerme fuera del lock hasta que le corresponde
+        with self.lock:
+            ahora = time.monotonic()
+            self.fichas = min(
+                self.capacidad, self.fichas + (ahora - self.ultimo) * self.rate
+            )
+            self.ultimo = ahora
+            self.fichas -= 1
+            espera = -self.fichas / self.rate if self.fichas < 0 else 0.0
+        if espera > 0:
+            time.sleep(espera)
+
+
+class Circuito:
+    def __init__(self, umbral=5, pausa=15.0, pausa_max=300.0, espera_max=60.0):
+        self.umbral = umbral
+        self.pausa = pausa
+        self.pausa_max = pausa_max
+        self.espera_max = espera_max
+        self.cond = threading.Condition()
+        self.fallos = 0
+        self.aperturas = 0
+        self.abierto_hasta = 0.0
+        self.sondeando = False
+
+    def esperar(self, nombre):
+        # Con el circuito abierto las peticiones esperan a que termine la
+        # pausa y sólo una sale a probar el servicio; si la pausa supera
+        # espera_max se falla en el acto
+        limite = time.monotonic() + self.espera_max
+        with self.cond:
+            while self.fallos >= self.umbral:
+                ahora = time.monotonic()
+                if ahora >= self.abierto_hasta and not self.sondeando:
+                    self.sondeando = True
+                    return
+                if self.abierto_hasta > limite:
+                    raise CircuitoAbierto(f"Servicio {nombre} en pausa por fallos")
+                self.cond.wait(
+                    self.abierto_hasta - ahora if ahora < self.abierto_hasta else 1.0
+                )
+
+    def exito(self):
+        with self.cond:
+            self.fallos = 0
+            self.aperturas = 0
+            self.sondeando = False
+            self.cond.notify_all()
+
+    def soltar(self):
+        # La petición falló por una causa ajena al servicio
+        with self.cond:
+            self.sondeando = False
+            self.cond.notify_all()
+
+    def fallo(self, nombre):
+        with self.cond:
+            self.fallos += 1
+            self.sondeando = False
+            ahora = time.monotonic()
+            if self.fallos >= self.umbral and ahora >= self.abierto_hasta:
+                self.aperturas += 1
+                pausa = min(self.pausa * 2 ** (self.aperturas - 1), self.pausa_max)
+                self.abierto_hasta = ahora + pausa
+                METRICAS.contar(
+                    "nestguesser_http_circuito_aperturas_total", servicio=nombre
+                )
+                print(
+                    f"Servicio {nombre} en pausa {pausa:.0f} s tras {self.fallos} fallos"
+                )
+            self.cond.notify_all()
+
+
+def _retry_after(respuesta):
+    try:
+        return max(0.0, float(respuesta.headers.get("Retry-After", "")))
+    except ValueError:
+        return None
+
+
+class ClienteUpstream:
+    def __init__(
+        self,
+        nombre,
+        rate=None,
+        burst=1,
+        reintentos=3,
+        backoff_base=0.5,
+        backoff_max=30.0,
+        circuito=None,
+        pool=10,
+    ):
+        self.nombre = nombre
+        self.bucket = TokenBucket(rate, burst) if rate else None
+        self.reintentos = reintentos
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.circuito = circuito or Circuito()
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool, max_retries=0)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def _espera(self, intento, respuesta=None):
+        # Jitter completo: uniforme entre 0 y la espera exponencial
+        espera = random.uniform(
+            0, min(self.backoff_max, self.backoff_base * 2**intento)
+        )
+        if respuesta is not None:
+            pedida = _retry_after(respuesta)
+            if pedida is not None:
+                espera = min(max(espera, pedida), self.backoff_max)
+        return espera
+
+    def _intento(self, metodo, url, kwargs):
+        self.circuito.esperar(self.nombre)
+        if self.bucket:
+            self.bucket.esperar()
+        t0 = time.perf_counter()
+        try:
+            r = self.session.request(metodo, url, **kwargs)
+        except (requests.ConnectionError, requests.Timeout):
+            METRICAS.contar("nestguesser_http_errores_total", servicio=self.nombre)
+            self.circuito.fallo(self.nombre)
+            raise
+        except Exception:
+            self.circuito.soltar()
+            raise
+        finally:
+            METRICAS.contar("nestguesser_http_peticiones_total", servicio=self.nombre)
+            METRICAS.observar(
+                "nestguesser_http_segundos",
+                time.perf_counter() - t0,
+                servicio=self.nombre,
+            )
+        if r.status_code in RETRY_STATUS:
+            METRICAS.contar("nestguesser_http_errores_total", servicio=self.nombre)
+            self.circuito.fallo(self.nombre)
+        else:
+            # Un 4xx es un error de la consulta, no del servicio
+            self.circuito.exito()
+            if r.status_code >= 400:
+                METRICAS.contar("nestguesser_http_errores_total", servicio=self.nombre)
+        return r
+
+    def peticion(self, metodo, url, **kwargs):
+        intento = 0
+        while True:
+            try:
+                r = self._intento(metodo, url, kwargs)
+            except (requests.ConnectionError, requests.Timeout):
+                if intento >= self.reintentos:
+                    raise
+                espera = self._espera(intento)
+            else:
+                if r.status_code not in RETRY_STATUS or intento >= self.reintentos:
+                    r.raise_for_status()
+                    return r
+                espera = self._espera(intento, r)
+                r.close()
+            intento += 1
+            METRICAS.contar("nestguesser_http_reintentos_total", servicio=self.nombre)
+            time.sleep(espera)
+
+    def close(self):
+        self.session.close()
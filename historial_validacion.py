@@ -0,0 +1,169 @@
+import math
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+from pipeline_validacion import ACEPTADO, RECHAZADO
+
+# Historial persistente de validaciones. Cada candidato validado se guarda con
+# su resultado, etapa y razón; además, por celda lat/lon se acumulan los
+# aceptados y rechazados, que dan una Beta(aceptados + a, rechazos + b) con la
+# probabilidad de aceptación esperada de un candidato nuevo en esa celda. Los
+# errores y cancelaciones se guardan pero no cuentan para la Beta.
+
+GUARDAR_CADA = 50
+
+
+def _claves(i, j):
+    return (np.asarray(i, dtype=np.int64) << 32) + (
+        np.asarray(j, dtype=np.int64) & 0xFFFFFFFF
+    )
+
+
+class HistorialValidacion:
+    def __init__(
+        self, path, cell_deg=0.001, prior=(1.0, 1.0), min_obs=2, umbral_descarte=0.3
+    ):
+        self.path = path
+        self.cell_deg = cell_deg
+        self.prior = prior
+        self.min_obs = min_obs
+        self.umbral_descarte = umbral_descarte
+        self.lock = threading.Lock()
+        # clave de celda -> [aceptados, rechazos] de la región cargada
+        self.celdas = {}
+        self._pendientes = []
+        self.registrados = 0
+        self.conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        with self.lock:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+            self.conn.execute(
+                """CREATE TABLE IF NOT EXISTS resultados (
+                    id INTEGER PRIMARY KEY,
+                    lat REAL NOT NULL,
+                    lon REAL NOT NULL,
+                    resultado TEXT NOT NULL,
+                    etapa TEXT,
+                    razon TEXT,
+                    puntuacion REAL,
+                    creado REAL NOT NULL
+                )"""
+            )
+            self.conn.execute(
+                """CREATE TABLE IF NOT EXISTS celdas (
+                    i INTEGER NOT NULL,
+                    j INTEGER NOT NULL,
+                    aceptados INTEGER NOT NULL DEFAULT 0,
+                    rechazos INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY (i, j)
+                )"""
+            )
+            self.conn.commit()
+
+    def _celda(self, lat, lon):
+        # El redondeo evita que 9.0 / 0.01 caiga en la celda 899
+        return (
+            math.floor(round(lat / self.cell_deg, 9)),
+            math.floor(round(lon / self.cell_deg, 9)),
+        )
+
+    def cargar_region(self, bbox):
+        min_lat, min_lon, max_lat, max_lon = bbox
+        i0, j0 = self._celda(min_lat, min_lon)
+        i1, j1 = self._celda(max_lat, max_lon)
+        with self.lock:
+            # Se suma a las regiones ya cargadas (varios trabajos a la vez);
+            # lo pendiente se guarda antes para que la base tenga lo último
+            self._guardar()
+            filas = self.conn.execute(
+                "SELECT i, j, aceptados, rechazos FROM celdas "
+                "WHERE i BETWEEN ? AND ? AND j BETWEEN ? AND ?",
+                (i0, i1, j0, j1),
+            ).fetchall()
+            self.celdas.update(
+                (int(_claves(i, j)), [acc, rech]) for i, j, acc, rech in filas
+            )
+        return len(filas)
+
+    def registrar(self, lat, lon, resultado, etapa=None, razon=None, puntos=0):
+        i, j = self._celda(lat, lon)
+        with self.lock:
+            self._pendientes.append(
+                (lat, lon, resultado, etapa, razon, puntos, time.time(), i, j)
+            )
+            if resultado in (ACEPTADO, RECHAZADO):
+                cuenta = self.celdas.setdefault(int(_claves(i, j)), [0, 0])
+                cuenta[0 if resultado == ACEPTADO else 1] += 1
+            self.registrados += 1
+            if len(self._pendientes) >= GUARDAR_CADA:
+                self._guardar()
+
+    def _guardar(self):
+        pendientes, self._pendientes = self._pendientes, []
+        if not pendientes:
+            return
+        self.conn.executemany(
+            "INSERT INTO resultados "
+            "(lat, lon, resultado, etapa, razon, puntuacion, creado) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [p[:7] for p in pendientes],
+        )
+        self.conn.executemany(
+            "INSERT INTO celdas (i, j, aceptados, rechazos) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (i, j) DO UPDATE SET "
+            "aceptados = aceptados + excluded.aceptados, "
+            "rechazos = rechazos + excluded.rechazos",
+            [
+                (i, j, int(r == ACEPTADO), int(r == RECHAZADO))
+                for _, _, r, _, _, _, _, i, j in pendientes
+                if r in (ACEPTADO, RECHAZADO)
+            ],
+        )
+        self.conn.commit()
+
+    def guardar(self):
+        with self.lock:
+            self._guardar()
+
+    def evaluar(self, pts):
+        # Media de la Beta por punto y máscara de los que no merece la pena
+        # validar: celdas con al menos min_obs resultados y tasa esperada por
+        # debajo de umbral_descarte
+        pts = np.asarray(pts, dtype=float).reshape(-1, 2)
+        celdas = np.floor(np.round(pts / self.cell_deg, 9)).astype(np.int64)
+        claves = _claves(celdas[:, 0], celdas[:, 1]).tolist()
+        with self.lock:
+            cuentas = np.array(
+                [self.celdas.get(c, (0, 0)) for c in claves], dtype=float
+            ).reshape(-1, 2)
+        a, b = self.prior
+        n = cuentas.sum(axis=1)
+        media = (cuentas[:, 0] + a) / (n + a + b)
+        return media, (n >= self.min_obs) & (media < self.umbral_descarte)
+
+    def estadisticas(self):
+        with self.lock:
+            aceptados = sum(c[0] for c in self.celdas.values())
+            rechazos = sum(c[1] for c in self.celdas.values())
+            return {
+                "celdas": len(self.celdas),
+                "aceptados": aceptados,
+                "rechazos": rechazos,
+                "registrados": self.registrados,
+            }
+
+    def resumen(self):
+        s = self.estadisticas()
+        return (
+            f"Historial: {s['celdas']} celdas conocidas en la región "
+            f"({s['aceptados']} aceptados, {s['rechazos']} rechazos), "
+            f"{s['registrados']} resultados nuevos"
+        )
+
+    def close(self):
+        with self.lock:
+            self._guardar()
+            self.conn.close()
@@ -0,0 +1,192 @@
+import math
+
+import numpy as np
+
+# Índice local de polígonos de bosque (landuse=forest / natural=wood) para una
+# región. Los polígonos se agrupan en hojas con empaquetado STR (Sort-Tile-
+# Recursive) y cada consulta sólo prueba los segmentos de los polígonos cuyas
+# cajas intersectan el radio pedido.
+
+NODE_CAPACITY = 16
+METERS_PER_DEG = 111320.0
+
+
+def _anillo(geometry):
+    return [(p["lat"], p["lon"]) for p in geometry]
+
+
+def _unir_anillos(tramos):
+    # Encadena los tramos abiertos de una relación multipolígono en anillos
+    tramos = [list(t) for t in tramos if len(t) > 1]
+    anillos = []
+    while tramos:
+        actual = tramos.pop()
+        while actual[0] != actual[-1]:
+            for i, t in enumerate(tramos):
+                if t[0] == actual[-1]:
+                    actual.extend(t[1:])
+                elif t[-1] == actual[-1]:
+                    actual.extend(reversed(t[:-1]))
+                else:
+                    continue
+                tramos.pop(i)
+                break
+            else:
+                break
+        anillos.append(actual)
+    return anillos
+
+
+def _segmentos(anillos):
+    segs = []
+    for anillo in anillos:
+        pts = np.asarray(anillo, dtype=float)
+        if len(pts) < 2:
+            continue
+        if (pts[0] != pts[-1]).any():
+            pts = np.vstack([pts, pts[:1]])
+        segs.append(np.hstack([pts[:-1], pts[1:]]))
+    return np.vstack(segs) if segs else np.empty((0, 4))
+
+
+class IndiceBosque:
+    def __init__(self, bbox, poligonos, puntos=()):
+        # poligonos: lista de listas de anillos [(lat, lon), ...]
+        self.bbox = tuple(float(v) for v in bbox)
+        seg_list = [_segmentos(anillos) for anillos in poligonos]
+        seg_list = [s for s in seg_list if len(s)]
+        self.segs = np.vstack(seg_list) if seg_list else np.empty((0, 4))
+        self.seg_offsets = np.zeros(len(seg_list) + 1, dtype=np.int64)
+        self.seg_offsets[1:] = np.cumsum([len(s) for s in seg_list])
+        self.bboxes = np.array(
+            [
+                [
+                    min(s[:, 0].min(), s[:, 2].min()),
+                    min(s[:, 1].min(), s[:, 3].min()),
+                    max(s[:, 0].max(), s[:, 2].max()),
+                    max(s[:, 1].max(), s[:, 3].max()),
+                ]
+                for s in seg_list
+            ]
+        ).reshape(-1, 4)
+        self.puntos = np.asarray(puntos, dtype=float).reshape(-1, 2)
+        self._empaquetar_str()
+
+    def _empaquetar_str(self):
+        n = len(self.bboxes)
+        n_hojas = math.ceil(n / NODE_CAPACITY)
+        n_franjas = max(1, math.ceil(math.sqrt(n_hojas)))
+        centros = (self.bboxes[:, :2] + self.bboxes[:, 2:]) / 2
+        orden = np.argsort(centros[:, 1], kind="stable")
+        por_franja = n_franjas * NODE_CAPACITY
+        partes = []
+        for i in range(0, n, por_franja):
+            franja = orden[i : i + por_franja]
+            partes.append(franja[np.argsort(centros[franja, 0], kind="stable")])
+        self.orden = np.concatenate(partes) if partes else np.empty(0, np.int64)
+        inicios = np.arange(0, n, NODE_CAPACITY)
+        self.hojas = np.array(
+            [
+                np.concatenate(
+                    [
+                        self.bboxes[self.orden[i : i + NODE_CAPACITY], :2].min(0),
+                        self.bboxes[self.orden[i : i + NODE_CAPACITY], 2:].max(0),
+                    ]
+                )
+                for i in inicios
+            ]
+        ).reshape(-1, 4)
+
+    @classmethod
+    def desde_overpass(cls, bbox, elements):
+        poligonos, puntos = [], []
+        for el in elements:
+            if el.get("type") == "node" and "lat" in el:
+                puntos.append((el["lat"], el["lon"]))
+            elif el.get("type") == "way" and el.get("geometry"):
+                poligonos.append([_anillo(el["geometry"])])
+            elif el.get("type") == "relation":
+                tramos = [
+                    _anillo(m["geometry"])
+                    for m in el.get("members", [])
+                    if m.get("type") == "way" and m.get("geometry")
+                ]
+                anillos = _unir_anillos(tramos)
+                if anillos:
+                    poligonos.append(anillos)
+        return cls(bbox, poligonos, puntos)
+
+    def guardar(self, path):
+        np.savez(
+            path,
+            bbox=np.array(self.bbox),
+            segs=self.segs,
+            seg_offsets=self.seg_offsets,
+            bboxes=self.bboxes,
+            puntos=self.puntos,
+            orden=self.orden,
+            hojas=self.hojas,
+        )
+
+    @classmethod
+    def cargar(cls, path):
+        data = np.load(path)
+        idx = cls.__new__(cls)
+        idx.bbox = tuple(float(v) for v in data["bbox"])
+        for name in ("segs", "seg_offsets", "bboxes", "puntos", "orden", "hojas"):
+            setattr(idx, name, data[name])
+        return idx
+
+    def cubre(self, lat, lon):
+        min_lat, min_lon, max_lat, max_lon = self.bbox
+        return min_lat <= lat <= max_lat and min_lon <= lon <= max_lon
+
+    def contiene(self, lat, lon, radius_m=50):
+        d_lat = radius_m / METERS_PER_DEG
+        cos_lat = max(math.cos(math.radians(lat)), 1e-6)
+        d_lon = d_lat / cos_lat
+        if len(self.puntos):
+            dy = (self.puntos[:, 0] - lat) * METERS_PER_DEG
+            dx = (self.puntos[:, 1] - lon) * METERS_PER_DEG * cos_lat
+            if (dx * dx + dy * dy <= radius_m * radius_m).any():
+                return True
+        if not len(self.hojas):
+            return False
+        hojas = np.nonzero(
+            (self.hojas[:, 0] <= lat + d_lat)
+            & (self.hojas[:, 2] >= lat - d_lat)
+            & (self.hojas[:, 1] <= lon + d_lon)
+            & (self.hojas[:, 3] >= lon - d_lon)
+        )[0]
+        for h in hojas:
+            for p in self.orden[h * NODE_CAPACITY : (h + 1) * NODE_CAPACITY]:
+                b = self.bboxes[p]
+                if (
+                    b[0] <= lat + d_lat
+                    and b[2] >= lat - d_lat
+                    and b[1] <= lon + d_lon
+                    and b[3] >= lon - d_lon
+                    and self._dentro_o_cerca(p, lat, lon, radius_m, cos_lat)
+                ):
+                    return True
+        return False
+
+    def _dentro_o_cerca(self, p, lat, lon, radius_m, cos_lat):
+        s = self.segs[self.seg_offsets[p] : self.seg_offsets[p + 1]]
+        # Coordenadas locales en metros con el candidato en el origen
+        y1 = (s[:, 0] - lat) * METERS_PER_DEG
+        x1 = (s[:, 1] - lon) * METERS_PER_DEG * cos_lat
+        y2 = (s[:, 2] - lat) * METERS_PER_DEG
+        x2 = (s[:, 3] - lon) * METERS_PER_DEG * cos_lat
+        # Regla par-impar: también descuenta los huecos (anillos interiores)
+        cruza = (y1 > 0) != (y2 > 0)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            x_corte = x1 + (0 - y1) * (x2 - x1) / (y2 - y1)
+        if np.count_nonzero(cruza & (x_corte > 0)) % 2 == 1:
+            return True
+        dx, dy = x2 - x1, y2 - y1
+        largo2 = dx * dx + dy * dy
+        with np.errstate(divide="ignore", invalid="ignore"):
+            t = np.clip(np.where(largo2 > 0, -(x1 * dx + y1 * dy) / largo2, 0), 0, 1)
+        px, py = x1 + t * dx, y1 + t * dy
+        return bool((px * px + py * py <= radius_m * radius_m).any())
@@ -0,0 +1,183 @@
+import math
+import threading
+
+import numpy as np
+
+# Índice espacial en memoria sobre una rejilla lat/lon de celdas fijas (como
+# un geohash). Las claves de celda se guardan ordenadas, fila a fila, de modo
+# que las celdas de una fila dentro de un rango son un tramo contiguo: una
+# consulta por radio o por caja hace una búsqueda binaria por fila y compara
+# la distancia sólo con los puntos de esos tramos.
+
+METROS_POR_GRADO = 111320.0
+# Desplaza la columna para que la clave crezca con ella también en longitudes
+# negativas
+_DESPLAZAMIENTO = 1 << 31
+
+
+def _clave(i, j):
+    return np.asarray(i, dtype=np.int64) * (1 << 32) + (
+        np.asarray(j, dtype=np.int64) + _DESPLAZAMIENTO
+    )
+
+
+def _tramos(ini, fin):
+    # Índices de todos los tramos [ini, fin) seguidos, y a qué tramo pertenecen
+    n = np.maximum(fin - ini, 0)
+    tramo = np.repeat(np.arange(len(n)), n)
+    desde = np.cumsum(n) - n
+    return np.arange(n.sum()) - np.repeat(desde, n) + np.repeat(ini, n), tramo
+
+
+class IndiceEspacial:
+    def __init__(self, celda_m=250.0):
+        self.celda = celda_m / METROS_POR_GRADO
+        self.lock = threading.Lock()
+        self.claves = np.empty(0, dtype=np.int64)
+        self.ids = np.empty(0, dtype=np.int64)
+        self.lat = np.empty(0)
+        self.lon = np.empty(0)
+        self._siguiente = 0
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _celdas(self, lat, lon):
+        return (
+            np.floor(np.asarray(lat, dtype=float) / self.celda).astype(np.int64),
+            np.floor(np.asarray(lon, dtype=float) / self.celda).astype(np.int64),
+        )
+
+    def agregar(self, lats, lons, ids=None):
+        # Sin ids, se numeran por orden de alta; devuelve los ids
+        lats = np.asarray(lats, dtype=float).ravel()
+        lons = np.asarray(lons, dtype=float).ravel()
+        with self.lock:
+            if ids is None:
+                ids = np.arange(self._siguiente, self._siguiente + len(lats))
+            ids = np.asarray(ids, dtype=np.int64).ravel()
+            if len(ids):
+                self._siguiente = max(self._siguiente, int(ids.max()) + 1)
+            claves = _clave(*self._celdas(lats, lons))
+            orden = np.argsort(claves, kind="stable")
+            pos = np.searchsorted(self.claves, claves[orden], side="right")
+            self.claves = np.insert(self.claves, pos, claves[orden])
+            self.ids = np.insert(self.ids, pos, ids[orden])
+            self.lat = np.insert(self.lat, pos, lats[orden])
+            self.lon = np.insert(self.lon, pos, lons[orden])
+        return ids
+
+    def quitar(self, ids):
+        with self.lock:
+            quedan = ~np.isin(self.ids, np.asarray(list(ids), dtype=np.int64))
+            self.claves = self.claves[quedan]
+            self.ids = self.ids[quedan]
+            self.lat = self.lat[quedan]
+            self.lon = self.lon[quedan]
+        return int((~quedan).sum())
+
+    def _pares(self, lat, lon, radio_m):
+        # (consulta, id indexado, distancia²) de los pares a menos de radio_m,
+        # con la aproximación equirectangular
+        lat = np.asarray(lat, dtype=float).ravel()
+        lon = np.asarray(lon, dtype=float).ravel()
+        ci, cj = self._celdas(lat, lon)
+        cos_lat = np.maximum(np.cos(np.deg2rad(lat)), 1e-6)
+        radio = radio_m / METROS_POR_GRADO
+        dj = np.ceil(radio / cos_lat / self.celda).astype(np.int64)
+        di = math.ceil(radio / self.celda)
+        consultas, encontrados, distancias = [], [], []
+        with self.lock:
+            claves, ids, lat_i, lon_i = self.claves, self.ids, self.lat, self.lon
+        for d in range(-di, di + 1):
+            ini = np.searchsorted(claves, _clave(ci + d, cj - dj), side="left")
+            fin = np.searchsorted(claves, _clave(ci + d, cj + dj), side="right")
+            pos, q = _tramos(ini, fin)
+            d2 = ((lat[q] - lat_i[pos]) * METROS_POR_GRADO) ** 2 + (
+                (lon[q] - lon_i[pos]) * METROS_POR_GRADO * cos_lat[q]
+            ) ** 2
+            cerca = d2 <= radio_m**2
+            consultas.append(q[cerca])
+            encontrados.append(ids[pos[cerca]])
+            distancias.append(d2[cerca])
+        return (
+            np.concatenate(consultas),
+            np.concatenate(encontrados),
+            np.concatenate(distancias),
+        )
+
+    def lejos(self, pts, radio_m):
+        # Máscara de los puntos (lat, lon) sin ningún punto indexado a menos
+        # de radio_m
+        pts = np.asarray(pts, dtype=float).reshape(-1, 2)
+        libres = np.ones(len(pts), dtype=bool)
+        if len(self) and len(pts):
+            q, _, _ = self._pares(pts[:, 0], pts[:, 1], radio_m)
+            libres[q] = False
+        return libres
+
+    def cerca(self, lat, lon, radio_m):
+        # Ids a menos de radio_m, del más cercano al más lejano
+        _, ids, d2 = self._pares([lat], [lon], radio_m)
+        ids = ids[np.argsort(d2, kind="stable")]
+        return ids[np.sort(np.unique(ids, return_index=True)[1])]
+
+    def en_caja(self, min_lat, min_lon, max_lat, max_lon):
+        i0, j0 = self._celdas(min_lat, min_lon)
+        i1, j1 = self._celdas(max_lat, max_lon)
+        filas = np.arange(i0, i1 + 1)
+        with self.lock:
+            claves, ids, lat, lon = self.claves, self.ids, self.lat, self.lon
+        ini = np.searchsorted(claves, _clave(filas, j0), side="left")
+        fin = np.searchsorted(claves, _clave(filas, j1), side="right")
+        pos, _ = _tramos(ini, fin)
+        dentro = (
+            (lat[pos] >= min_lat)
+            & (lat[pos] <= max_lat)
+            & (lon[pos] >= min_lon)
+            & (lon[pos] <= max_lon)
+        )
+        return np.unique(ids[pos[dentro]])
+
+
+class EspaciadoMinimo:
+    # Separación mínima de las predicciones de una ejecución: frente a lo ya
+    # guardado (el índice del almacén) y entre sí, contando también los
+    # candidatos que aún se están validando. `refrescar` trae al índice lo que
+    # hayan guardado otros procesos antes de cada comprobación
+    def __init__(self, radio_m, existentes=None, refrescar=None):
+        self.radio_m = radio_m
+        self.existentes = existentes
+        self.refrescar = refrescar
+        self.reservas = IndiceEspacial(radio_m)
+        self.descartados = 0
+
+    def _lejos_existentes(self, pts):
+        if self.existentes is None:
+            return np.ones(len(pts), dtype=bool)
+        if self.refrescar is not None:
+            self.refrescar()
+        return self.existentes.lejos(pts, self.radio_m)
+
+    def libres(self, pts):
+        pts = np.asarray(pts, dtype=float).reshape(-1, 2)
+        ok = self.reservas.lejos(pts, self.radio_m) & self._lejos_existentes(pts)
+        self.descartados += int((~ok).sum())
+        return ok
+
+    def reservar(self, lat, lon):
+        # Id de la reserva, o None si el candidato queda demasiado cerca
+        if not self.libres([(lat, lon)])[0]:
+            return None
+        return int(self.reservas.agregar([lat], [lon])[0])
+
+    def confirmar(self, lat, lon):
+        # Antes de aceptar un candidato ya validado: otro proceso ha podido
+        # guardar un punto cerca mientras tanto
+        if self._lejos_existentes(np.array([(lat, lon)], dtype=float))[0]:
+            return True
+        self.descartados += 1
+        return False
+
+    def liberar(self, reserva):
+        self.reservas.quitar([reserva])
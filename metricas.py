@@ -0,0 +1,153 @@
+import threading
+import time
+from contextlib import contextmanager
+
+# Registro de métricas en memoria (contadores, histogramas y valores
+# calculados al momento) con exportación en formato de texto de Prometheus.
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _clave(nombre, labels):
+    return nombre, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _escapar(valor):
+    return valor.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _formato_labels(labels, extra=()):
+    pares = list(labels) + list(extra)
+    if not pares:
+        return ""
+    return "{" + ",".join(f'{k}="{_escapar(v)}"' for k, v in pares) + "}"
+
+
+class RegistroMetricas:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.lock = threading.Lock()
+        self.contadores = {}
+        self.histogramas = {}
+        self.ayudas = {}
+        self.fuentes = []
+
+    def describir(self, nombre, ayuda):
+        self.ayudas[nombre] = ayuda
+
+    def contar(self, nombre, valor=1, **labels):
+        clave = _clave(nombre, labels)
+        with self.lock:
+            self.contadores[clave] = self.contadores.get(clave, 0) + valor
+
+    def observar(self, nombre, valor, **labels):
+        clave = _clave(nombre, labels)
+        with self.lock:
+            h = self.histogramas.get(clave)
+            if h is None:
+                h = self.histogramas[clave] = {
+                    "buckets": [0] * len(self.buckets),
+                    "count": 0,
+                    "sum": 0.0,
+                }
+            for i, limite in enumerate(self.buckets):
+                if valor <= limite:
+                    h["buckets"][i] += 1
+            h["count"] += 1
+            h["sum"] += valor
+
+    @contextmanager
+    def medir(self, nombre, **labels):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observar(nombre, time.perf_counter() - t0, **labels)
+
+    def registrar_fuente(self, fuente):
+        # fuente() -> [(nombre, {labels}, valor), ...], evaluada en cada exportación
+        with self.lock:
+            self.fuentes.append(fuente)
+
+    def _medidas(self):
+        medidas = []
+        for fuente in list(self.fuentes):
+            try:
+                medidas.extend(fuente())
+            except Exception as e:
+                print(f"Error en fuente de métricas: {e}")
+        return medidas
+
+    def instantanea(self):
+        with self.lock:
+            contadores = dict(self.contadores)
+            histogramas = {
+                k: {"count": h["count"], "sum": h["sum"]}
+                for k, h in self.histogramas.items()
+            }
+        return {"contadores": contadores, "histogramas": histogramas}
+
+    @staticmethod
+    def diferencia(antes, despues):
+        # Métricas de una ejecución a partir de dos instantáneas, en formato JSON
+        def nombre(clave):
+            n, labels = clave
+            return n + _formato_labels(labels)
+
+        contadores = {
+            nombre(k): v - antes["contadores"].get(k, 0)
+            for k, v in despues["contadores"].items()
+            if v - antes["contadores"].get(k, 0)
+        }
+        histogramas = {}
+        for k, h in despues["histogramas"].items():
+            prev = antes["histogramas"].get(k, {"count": 0, "sum": 0.0})
+            count = h["count"] - prev["count"]
+            if count:
+                total = h["sum"] - prev["sum"]
+                histogramas[nombre(k)] = {
+                    "count": count,
+                    "sum": total,
+                    "media": total / count,
+                }
+        return {"contadores": contadores, "histogramas": histogramas}
+
+    def texto_prometheus(self):
+        with self.lock:
+            contadores = sorted(self.contadores.items())
+            histogramas = sorted(
+                (k, dict(h, buckets=list(h["buckets"])))
+                for k, h in self.histogramas.items()
+            )
+        lineas, vistos = [], set()
+
+        def cabecera(nombre, tipo):
+            if nombre not in vistos:
+                vistos.add(nombre)
+                if nombre in self.ayudas:
+                    lineas.append(f"# HELP {nombre} {self.ayudas[nombre]}")
+                lineas.append(f"# TYPE {nombre} {tipo}")
+
+        for (nombre, labels), valor in contadores:
+            cabecera(nombre, "counter")
+            lineas.append(f"{nombre}{_formato_labels(labels)} {valor}")
+        for (nombre, labels), h in histogramas:
+            cabecera(nombre, "histogram")
+            for limite, n in zip(self.buckets, h["buckets"]):
+                lineas.append(
+                    f"{nombre}_bucket{_formato_labels(labels, [('le', repr(limite))])} {n}"
+                )
+            lineas.append(
+                f"{nombre}_bucket{_formato_labels(labels, [('le', '+Inf')])} {h['count']}"
+            )
+            lineas.append(f"{nombre}_sum{_formato_labels(labels)} {h['sum']}")
+            lineas.append(f"{nombre}_count{_formato_labels(labels)} {h['count']}")
+        for nombre, labels, valor in self._medidas():
+            cabecera(nombre, "gauge")
+            lineas.append(
+                f"{nombre}{_formato_labels(_clave(nombre, labels)[1])} {valor}"
+            )
+        return "\n".join(lineas) + "\n"
+
+
+METRICAS = RegistroMetricas()
@@ -0,0 +1,72 @@
+import json
+import os
+
+import numpy as np
+
+# Modelo digital de elevación local: una rejilla .npy (fila 0 = borde norte)
+# con un .json al lado que indica su caja {"bbox": [min_lat, min_lon,
+# max_lat, max_lon], "nodata": -32768}. Se abre como memory map, así que sólo
+# se leen del disco las celdas consultadas.
+
+
+class ModeloElevacion:
+    def __init__(self, bbox, datos, nodata=None):
+        self.min_lat, self.min_lon, self.max_lat, self.max_lon = map(float, bbox)
+        self.datos = datos
+        self.nodata = nodata
+        self.n_filas, self.n_cols = datos.shape
+        self.res_lat = (self.max_lat - self.min_lat) / self.n_filas
+        self.res_lon = (self.max_lon - self.min_lon) / self.n_cols
+
+    @classmethod
+    def cargar(cls, path):
+        with open(os.path.splitext(path)[0] + ".json", encoding="utf-8") as f:
+            meta = json.load(f)
+        datos = np.load(path, mmap_mode="r")
+        if datos.ndim != 2:
+            raise ValueError(f"El DEM debe ser una rejilla 2D, no {datos.shape}")
+        return cls(meta["bbox"], datos, meta.get("nodata"))
+
+    def guardar(self, path):
+        np.save(path, np.asarray(self.datos))
+        with open(os.path.splitext(path)[0] + ".json", "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "bbox": [self.min_lat, self.min_lon, self.max_lat, self.max_lon],
+                    "nodata": self.nodata,
+                },
+                f,
+            )
+
+    def cubre(self, lats, lons):
+        lats, lons = np.asarray(lats, dtype=float), np.asarray(lons, dtype=float)
+        return (
+            (self.min_lat <= lats)
+            & (lats < self.max_lat)
+            & (self.min_lon <= lons)
+            & (lons < self.max_lon)
+        )
+
+    def elevaciones(self, lats, lons):
+        # NaN donde el DEM no cubre el punto o no tiene dato
+        lats, lons = np.asarray(lats, dtype=float), np.asarray(lons, dtype=float)
+        out = np.full(lats.shape, np.nan)
+        ok = self.cubre(lats, lons)
+        if not ok.any():
+            return out
+        filas = ((self.max_lat - lats[ok]) / self.res_lat).astype(np.int64)
+        cols = ((lons[ok] - self.min_lon) / self.res_lon).astype(np.int64)
+        valores = np.asarray(
+            self.datos[
+                np.clip(filas, 0, self.n_filas - 1), np.clip(cols, 0, self.n_cols - 1)
+            ],
+            dtype=float,
+        )
+        if self.nodata is not None:
+            valores[valores == self.nodata] = np.nan
+        out[ok] = valores
+        return out
+
+    def elevacion(self, lat, lon):
+        valor = self.elevaciones([lat], [lon])[0]
+        return None if np.isnan(valor) else float(valor)
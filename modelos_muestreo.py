@@ -0,0 +1,238 @@
+import numpy as np
+
+# Modelos de la distribución de los nidos de los que se sortean candidatos.
+# Todos son una mezcla de gaussianas (pesos, medias, covarianzas): la gaussiana
+# global es una mezcla de un componente, la mezcla se ajusta con EM ponderado y
+# el KDE por grupo pone un núcleo en cada nido de cada grupo de DBSCAN. Cuando
+# los nidos están en varias zonas separadas, la gaussiana global concentra las
+# muestras en el hueco entre ellas; los modelos por grupos no.
+
+REGULARIZACION = 1e-5
+KM_POR_GRADO = 111.0
+# Pares punto-componente por bloque al evaluar la densidad
+BLOQUE_DENSIDAD = 1 << 20
+
+
+def _logsumexp(x):
+    m = x.max(axis=1, keepdims=True)
+    m[~np.isfinite(m)] = 0.0
+    return (m + np.log(np.exp(x - m).sum(axis=1, keepdims=True)))[:, 0]
+
+
+def _cov_ponderada(coords, pesos):
+    if len(coords) < 2:
+        return np.eye(2) * REGULARIZACION
+    return np.cov(coords, rowvar=False, aweights=pesos) + np.eye(2) * REGULARIZACION
+
+
+class ModeloMezcla:
+    def __init__(self, nombre, pesos, medias, covs):
+        pesos = np.asarray(pesos, dtype=float)
+        self.nombre = nombre
+        self.pesos = pesos / pesos.sum()
+        self.medias = np.asarray(medias, dtype=float).reshape(-1, 2)
+        self.covs = np.asarray(covs, dtype=float).reshape(-1, 2, 2)
+        self.chol = np.linalg.cholesky(self.covs)
+        self.inv = np.linalg.inv(self.covs)
+        _, logdet = np.linalg.slogdet(self.covs)
+        self._log_norm = np.log(self.pesos) - 0.5 * logdet - np.log(2 * np.pi)
+
+    @property
+    def media(self):
+        return self.pesos @ self.medias
+
+    @property
+    def cov(self):
+        # Covarianza total de la mezcla (para la caja de la región)
+        diff = self.medias - self.media
+        return np.einsum("k,kij->ij", self.pesos, self.covs) + np.einsum(
+            "k,ki,kj->ij", self.pesos, diff, diff
+        )
+
+    def muestrear(self, n, rng):
+        comp = rng.choice(len(self.pesos), size=n, p=self.pesos)
+        z = rng.standard_normal((n, 2))
+        return self.medias[comp] + np.einsum("nij,nj->ni", self.chol[comp], z)
+
+    def _log_componentes(self, pts):
+        diff = pts[:, None, :] - self.medias[None, :, :]
+        m2 = np.einsum("pki,kij,pkj->pk", diff, self.inv, diff)
+        return self._log_norm - 0.5 * m2
+
+    def log_densidad(self, pts):
+        pts = np.asarray(pts, dtype=float).reshape(-1, 2)
+        paso = max(1, BLOQUE_DENSIDAD // len(self.pesos))
+        out = np.empty(len(pts))
+        for i in range(0, len(pts), paso):
+            out[i : i + paso] = _logsumexp(self._log_componentes(pts[i : i + paso]))
+        return out
+
+
+def gaussiana(coords, pesos, rng=None):
+    media = np.average(coords, axis=0, weights=pesos)
+    return ModeloMezcla("gaussiana", [1.0], media, _cov_ponderada(coords, pesos))
+
+
+def _kmeans_pp(coords, pesos, k, rng):
+    # Semillas de k-means++ ponderadas por el peso de cada nido
+    centros = [coords[rng.choice(len(coords), p=pesos / pesos.sum())]]
+    for _ in range(1, k):
+        d2 = ((coords[:, None, :] - np.array(centros)[None]) ** 2).sum(-1).min(1)
+        p = d2 * pesos
+        if p.sum() <= 0:
+            break
+        centros.append(coords[rng.choice(len(coords), p=p / p.sum())])
+    return np.array(centros)
+
+
+def mezcla_gaussiana(coords, pesos, rng, k=2, iteraciones=200, tol=1e-6):
+    # EM ponderado; None si no hay nidos suficientes para k componentes
+    if len(coords) < 3 * k:
+        return None
+    medias = _kmeans_pp(coords, pesos, k, rng)
+    k = len(medias)
+    covs = np.repeat(_cov_ponderada(coords, pesos)[None] / k, k, axis=0)
+    pis = np.full(k, 1.0 / k)
+    anterior = -np.inf
+    for _ in range(iteraciones):
+        modelo = ModeloMezcla(f"mezcla_{k}", pis, medias, covs)
+        log_comp = modelo._log_componentes(coords)
+        log_tot = _logsumexp(log_comp)
+        resp = np.exp(log_comp - log_tot[:, None]) * pesos[:, None]
+        nk = resp.sum(axis=0)
+        vivos = nk > 1e-9 * pesos.sum()
+        resp, nk = resp[:, vivos], nk[vivos]
+        pis = nk / nk.sum()
+        medias = (resp.T @ coords) / nk[:, None]
+        diff = coords[:, None, :] - medias[None]
+        covs = np.einsum("nk,nki,nkj->kij", resp, diff, diff) / nk[:, None, None]
+        covs += np.eye(2) * REGULARIZACION
+        verosimilitud = np.average(log_tot, weights=pesos)
+        if abs(verosimilitud - anterior) < tol:
+            break
+        anterior = verosimilitud
+    return ModeloMezcla(f"mezcla_{len(pis)}", pis, medias, covs)
+
+
+def _proyectar_km(coords, lat0=None):
+    lat0 = coords[:, 0].mean() if lat0 is None else lat0
+    cos_lat = max(np.cos(np.deg2rad(lat0)), 1e-6)
+    return coords * [KM_POR_GRADO, KM_POR_GRADO * cos_lat]
+
+
+def dbscan(coords, eps_km, min_nidos):
+    # Etiqueta de grupo por nido; -1 para los aislados
+    xy = _proyectar_km(coords)
+    n = len(xy)
+    vecinos = []
+    for i in range(0, n, 1024):
+        d2 = ((xy[i : i + 1024, None, :] - xy[None]) ** 2).sum(-1)
+        vecinos.extend(np.nonzero(fila <= eps_km**2)[0] for fila in d2)
+    nucleo = np.array([len(v) >= min_nidos for v in vecinos], dtype=bool)
+    etiquetas = np.full(n, -1)
+    grupo = 0
+    for i in np.nonzero(nucleo)[0]:
+        if etiquetas[i] != -1:
+            continue
+        etiquetas[i] = grupo
+        pendientes = [i]
+        while pendientes:
+            j = pendientes.pop()
+            if not nucleo[j]:
+                continue
+            for v in vecinos[j]:
+                if etiquetas[v] == -1:
+                    etiquetas[v] = grupo
+                    pendientes.append(v)
+        grupo += 1
+    return etiquetas
+
+
+def kde_grupos(coords, pesos, rng=None, eps_km=5.0, min_nidos=3):
+    # Un núcleo gaussiano por nido con el ancho de Scott de su grupo; los
+    # nidos aislados llevan un núcleo de radio eps_km / 2
+    etiquetas = dbscan(coords, eps_km, min_nidos)
+    cos_lat = max(np.cos(np.deg2rad(coords[:, 0].mean())), 1e-6)
+    radio = eps_km / 2 / KM_POR_GRADO
+    aislado = np.diag([radio**2, (radio / cos_lat) ** 2]) + np.eye(2) * REGULARIZACION
+    covs = np.repeat(aislado[None], len(coords), axis=0)
+    for g in np.unique(etiquetas[etiquetas >= 0]):
+        sel = etiquetas == g
+        w = pesos[sel]
+        n_eff = w.sum() ** 2 / (w**2).sum()
+        covs[sel] = _cov_ponderada(coords[sel], w) * n_eff ** (-1 / 3)
+    n_grupos = len(np.unique(etiquetas[etiquetas >= 0]))
+    return ModeloMezcla(f"kde_grupos_{n_grupos}", pesos, coords, covs)
+
+
+def _conservados(modelo, rng, keep_fraction, muestras):
+    # Muestras que el muestreador pasaría a validación: la fracción más densa
+    pts = modelo.muestrear(muestras, rng)
+    dens = modelo.log_densidad(pts)
+    return pts[dens >= np.quantile(dens, 1 - keep_fraction)]
+
+
+def _cerca(pts, nidos, radio_km, lat0):
+    xy, nidos = _proyectar_km(pts, lat0), _proyectar_km(nidos, lat0)
+    cerca = np.zeros(len(xy), dtype=bool)
+    for i in range(0, len(nidos), 256):
+        d2 = ((xy[:, None, :] - nidos[None, i : i + 256]) ** 2).sum(-1)
+        cerca |= (d2 <= radio_km**2).any(axis=1)
+    return cerca
+
+
+def seleccionar_modelo(
+    coords,
+    pesos,
+    constructores,
+    keep_fraction=0.5,
+    pliegues=5,
+    radio_km=5.0,
+    muestras=2000,
+    aceptar=None,
+    muestras_locales=200,
+    margen=0.02,
+    rng=None,
+):
+    # constructores: {nombre: construir(coords, pesos, rng)}. Cada modelo se
+    # ajusta sin un pliegue de los nidos y su tasa es la parte de las muestras
+    # que conservaría que cae a menos de radio_km de un nido reservado. Si hay
+    # capas locales (aceptar(lat, lon) -> True/False/None) se multiplica por
+    # la parte de sus muestras que las pasa. Un modelo sólo sustituye al
+    # anterior (más simple) si lo mejora en más de margen.
+    rng = rng if rng is not None else np.random.default_rng()
+    coords = np.asarray(coords, dtype=float)
+    pesos = np.asarray(pesos, dtype=float)
+    base = gaussiana(coords, pesos)
+    if len(coords) < 2 * pliegues:
+        return base, {}
+    lat0 = coords[:, 0].mean()
+    grupos = np.array_split(rng.permutation(len(coords)), pliegues)
+    puntuaciones = {}
+    mejor, mejor_tasa = base, None
+    for nombre, construir in constructores.items():
+        tasas = []
+        for reservados in grupos:
+            entreno = np.setdiff1d(np.arange(len(coords)), reservados)
+            parcial = construir(coords[entreno], pesos[entreno], rng)
+            if parcial is None:
+                break
+            pts = _conservados(parcial, rng, keep_fraction, muestras)
+            tasas.append(_cerca(pts, coords[reservados], radio_km, lat0).mean())
+        modelo = construir(coords, pesos, rng) if len(tasas) == pliegues else None
+        if modelo is None:
+            continue
+        tasa = float(np.mean(tasas))
+        if aceptar is not None:
+            pts = _conservados(modelo, rng, keep_fraction, muestras)
+            decididos = [
+                r
+                for r in (aceptar(lat, lon) for lat, lon in pts[:muestras_locales])
+                if r is not None
+            ]
+            if decididos:
+                tasa *= sum(decididos) / len(decididos)
+        puntuaciones[nombre] = tasa
+        if mejor_tasa is None or tasa > mejor_tasa + margen:
+            mejor, mejor_tasa = modelo, tasa
+    return mejor, puntuaciones
@@ -0,0 +1,103 @@
+import numpy as np
+
+# Muestreo por lotes de candidatos: se sortean miles de puntos a la vez, se
+# descartan en bloque los que están fuera de rango o repiten una celda ya
+# probada, y el resto se entrega ordenado por densidad del modelo (ver
+# modelos_muestreo.py).
+
+MAX_EMPTY_BATCHES = 20
+
+
+def _claves(celdas):
+    return (celdas[:, 0] << 32) + (celdas[:, 1] & 0xFFFFFFFF)
+
+
+class MuestreadorCandidatos:
+    def __init__(
+        self,
+        modelo,
+        cell_deg=0.0005,
+        batch_size=4096,
+        keep_fraction=0.5,
+        rng=None,
+        historial=None,
+    ):
+        self.modelo = modelo
+        self.historial = historial
+        self.cell_deg = cell_deg
+        self.batch_size = batch_size
+        self.keep_fraction = keep_fraction
+        self.rng = rng if rng is not None else np.random.default_rng()
+        self.vistos = np.empty(0, dtype=np.int64)
+        self._cola = np.empty((0, 2))
+        self.sorteados = 0
+        self.fuera_rango = 0
+        self.duplicados = 0
+        self.descartados = 0
+
+    def _lote(self):
+        pts = self.modelo.muestrear(self.batch_size, self.rng)
+        self.sorteados += len(pts)
+        ok = (np.abs(pts[:, 0]) <= 90) & (np.abs(pts[:, 1]) <= 180)
+        self.fuera_rango += int((~ok).sum())
+        pts = pts[ok]
+        claves = _claves(np.floor(pts / self.cell_deg).astype(np.int64))
+        # Una sola muestra por celda, y sólo celdas que no se hayan probado
+        claves, idx = np.unique(claves, return_index=True)
+        nuevos = ~np.isin(claves, self.vistos, assume_unique=True)
+        self.duplicados += len(pts) - int(nuevos.sum())
+        pts, claves = pts[idx][nuevos], claves[nuevos]
+        prioridad = self.modelo.log_densidad(pts)
+        if self.historial is not None:
+            # Las celdas que ya acumulan rechazos no se validan; el resto se
+            # ordena por densidad x probabilidad de aceptación del historial
+            media, descartar = self.historial.evaluar(pts)
+            self.descartados += int(descartar.sum())
+            pts, claves = pts[~descartar], claves[~descartar]
+            prioridad = prioridad[~descartar] + np.log(media[~descartar])
+        orden = np.argsort(-prioridad, kind="stable")
+        orden = orden[: max(1, int(len(orden) * self.keep_fraction))]
+        return pts[orden], claves[orden]
+
+    def siguientes(self, n):
+        vacios = 0
+        while len(self._cola) < n and vacios < MAX_EMPTY_BATCHES:
+            pts, claves = self._lote()
+            # Las celdas del lote ya cuentan como probadas
+            self.vistos = np.union1d(self.vistos, claves)
+            vacios = vacios + 1 if len(pts) == 0 else 0
+            self._cola = np.vstack([self._cola, pts])
+        out, self._cola = self._cola[:n], self._cola[n:]
+        return out
+
+    def siguiente(self):
+        pts = self.siguientes(1)
+        return tuple(pts[0]) if len(pts) else None
+
+    def estado(self):
+        # Punto de control: celdas probadas, cola y generador aleatorio. El
+        # modelo se guarda aparte (ver trabajos.py)
+        arrays = {"vistos": self.vistos, "cola": self._cola}
+        meta = {
+            "rng": self.rng.bit_generator.state,
+            "sorteados": self.sorteados,
+            "fuera_rango": self.fuera_rango,
+            "duplicados": self.duplicados,
+            "descartados": self.descartados,
+        }
+        return arrays, meta
+
+    def restaurar(self, arrays, meta):
+        self.vistos = np.asarray(arrays["vistos"], dtype=np.int64)
+        self._cola = np.asarray(arrays["cola"], dtype=float).reshape(-1, 2)
+        if meta.get("rng"):
+            self.rng.bit_generator.state = meta["rng"]
+        for k in ("sorteados", "fuera_rango", "duplicados", "descartados"):
+            setattr(self, k, meta.get(k, 0))
+
+    def resumen(self):
+        return (
+            f"Muestreo: {self.sorteados} sorteados, {self.fuera_rango} fuera de rango, "
+            f"{self.duplicados} celdas repetidas, "
+            f"{self.descartados} descartados por historial"
+        )
@@ -0,0 +1,108 @@
+import re
+import threading
+
+import numpy as np
+import pandas as pd
+
+# Peso de cada nido según las palabras clave de su comentario. Los comentarios
+# distintos se unen en un solo texto que un único regex compilado recorre una
+# vez; las reglas se aplican después por columnas con numpy. El peso de cada
+# fila se guarda por id para no recalcular las que no cambian.
+
+# Separa los comentarios en el texto unido; ninguna clave lo contiene
+SEPARADOR = "\x00"
+
+
+class PesosComentarios:
+    def __init__(self, multiplicativos, aditivos, minimo=0.1, sin_comentario=0.5):
+        self.multiplicativos = dict(multiplicativos)
+        self.aditivos = dict(aditivos)
+        self.minimo = minimo
+        self.sin_comentario = sin_comentario
+        self.claves = list(self.multiplicativos) + list(self.aditivos)
+        self.indice = {k: i for i, k in enumerate(self.claves)}
+        # Lookahead: una sola pasada encuentra también claves solapadas
+        patron = "|".join(
+            re.escape(k) for k in sorted(self.claves, key=len, reverse=True)
+        )
+        self.regex = re.compile(f"(?=({patron}))")
+        # contenida[i, j]: la clave j aparece dentro de la clave i. Si dos
+        # claves empiezan en el mismo carácter el regex sólo da la más larga
+        self.contenida = np.array(
+            [[c in k for c in self.claves] for k in self.claves], dtype=np.uint8
+        )
+        self.lock = threading.Lock()
+        self.por_id = {}
+
+    def _presencias(self, textos):
+        # Matriz comentario x clave
+        presentes = np.zeros((len(textos), len(self.claves)), dtype=np.uint8)
+        if not textos:
+            return presentes.astype(bool)
+        texto = SEPARADOR.join(textos)
+        inicios = np.cumsum([0] + [len(t) + 1 for t in textos[:-1]])
+        posiciones, claves = [], []
+        for m in self.regex.finditer(texto):
+            posiciones.append(m.start())
+            claves.append(self.indice[m.group(1)])
+        if posiciones:
+            filas = np.searchsorted(inicios, posiciones, side="right") - 1
+            presentes[filas, claves] = 1
+        return (presentes @ self.contenida) > 0
+
+    def _puntuar(self, textos):
+        presentes = self._presencias(textos)
+        # Mismo orden de operaciones que la regla original: primero los
+        # factores, luego los sumandos, clave a clave
+        pesos = np.ones(len(textos))
+        for k, v in self.multiplicativos.items():
+            col = presentes[:, self.indice[k]]
+            pesos = np.where(col, pesos * v, pesos)
+        for k, v in self.aditivos.items():
+            col = presentes[:, self.indice[k]]
+            pesos = np.where(col, pesos + v, pesos)
+        return np.maximum(self.minimo, pesos)
+
+    def _calcular(self, comentarios):
+        pesos = np.full(len(comentarios), self.sin_comentario)
+        es_texto = np.fromiter(
+            (isinstance(c, str) for c in comentarios),
+            dtype=bool,
+            count=len(comentarios),
+        )
+        if es_texto.any():
+            textos = pd.Series(comentarios[es_texto], dtype=object).str.lower()
+            # Únicos con un dict y no con pd.factorize, que confunde textos que
+            # sólo difieren tras un carácter nulo
+            unicos = {}
+            codigos = np.fromiter(
+                (unicos.setdefault(t, len(unicos)) for t in textos),
+                dtype=np.int64,
+                count=len(textos),
+            )
+            pesos[es_texto] = self._puntuar(list(unicos))[codigos]
+        return pesos
+
+    def peso(self, comentario):
+        return float(self._calcular(np.array([comentario], dtype=object))[0])
+
+    def pesos(self, comentarios, ids=None):
+        comentarios = pd.Series(comentarios).to_numpy(dtype=object)
+        if ids is None:
+            return self._calcular(comentarios)
+        ids = np.asarray(ids).tolist()
+        with self.lock:
+            previos = [self.por_id.get(i) for i in ids]
+        pesos = np.empty(len(ids))
+        nuevos = []
+        for n, (previo, comentario) in enumerate(zip(previos, comentarios)):
+            if previo is not None and previo[0] == comentario:
+                pesos[n] = previo[1]
+            else:
+                nuevos.append(n)
+        if nuevos:
+            pesos[nuevos] = self._calcular(comentarios[nuevos])
+        with self.lock:
+            # La caché queda con las filas de esta lectura: las borradas salen
+            self.por_id = dict(zip(ids, zip(comentarios, pesos.tolist())))
+        return pesos
@@ -0,0 +1,153 @@
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+from metricas import METRICAS
+
+# Cadena de validación por etapas. Los filtros se reordenan durante la
+# ejecución según su coste medio y su tasa de rechazo observados, de modo que
+# el filtro más barato y selectivo se ejecute primero. Las etapas de
+# puntuación (p. ej. presas) sólo corren cuando todos los filtros aceptan.
+
+MIN_SAMPLES = 10
+REORDER_EVERY = 20
+# Resultados de una etapa o de una validación completa
+ACEPTADO = "aceptado"
+RECHAZADO = "rechazado"
+RESULTADO_ERROR = "error"
+CANCELADO = "cancelado"
+# Duraciones recientes que se guardan por etapa para calcular percentiles
+MAX_DURATION_SAMPLES = 10000
+
+METRICAS.describir("nestguesser_etapa_segundos", "Duración de cada etapa de validación")
+METRICAS.describir(
+    "nestguesser_etapa_total", "Candidatos evaluados por etapa y resultado"
+)
+
+
+class ErrorEtapa(Exception):
+    pass
+
+
+class Etapa:
+    def __init__(self, nombre, funcion, filtro=True):
+        # funcion(lat, lon) -> (aceptado, razon, puntos); lanza ErrorEtapa
+        # si el servicio falla
+        self.nombre = nombre
+        self.funcion = funcion
+        self.filtro = filtro
+        self.llamadas = 0
+        self.rechazos = 0
+        self.errores = 0
+        self.tiempo = 0.0
+        self.duraciones = deque(maxlen=MAX_DURATION_SAMPLES)
+
+    def coste_medio(self):
+        return self.tiempo / self.llamadas if self.llamadas else 0.0
+
+    def percentil(self, q):
+        return float(np.percentile(self.duraciones, q)) if self.duraciones else 0.0
+
+    def tasa_rechazo(self):
+        validas = self.llamadas - self.errores
+        return self.rechazos / validas if validas > 0 else 0.0
+
+    def prioridad(self):
+        # Orden óptimo para filtros independientes: coste / probabilidad de rechazo
+        return self.coste_medio() / max(self.tasa_rechazo(), 1e-3)
+
+
+class PipelineValidacion:
+    def __init__(self, etapas, adaptativo=True):
+        self.etapas = list(etapas)
+        self.adaptativo = adaptativo
+        self.lock = threading.Lock()
+        self.filtros = [e for e in self.etapas if e.filtro]
+        self.puntuadores = [e for e in self.etapas if not e.filtro]
+        self._informe = {e.nombre: i for i, e in enumerate(self.etapas)}
+        self._completadas = 0
+
+    def orden_actual(self):
+        with self.lock:
+            return [e.nombre for e in self.filtros]
+
+    def _reordenar(self):
+        if all(e.llamadas >= MIN_SAMPLES for e in self.filtros):
+            self.filtros.sort(key=Etapa.prioridad)
+
+    def _ejecutar(self, etapa, lat, lon):
+        t0 = time.perf_counter()
+        error = False
+        try:
+            ok, razon, puntos = etapa.funcion(lat, lon)
+        except ErrorEtapa as e:
+            ok, razon, puntos, error = False, str(e), 0, True
+        dt = time.perf_counter() - t0
+        resultado = RESULTADO_ERROR if error else (ACEPTADO if ok else RECHAZADO)
+        METRICAS.observar("nestguesser_etapa_segundos", dt, etapa=etapa.nombre)
+        METRICAS.contar(
+            "nestguesser_etapa_total", etapa=etapa.nombre, resultado=resultado
+        )
+        with self.lock:
+            etapa.llamadas += 1
+            etapa.tiempo += dt
+            etapa.duraciones.append(dt)
+            if error:
+                etapa.errores += 1
+            elif not ok:
+                etapa.rechazos += 1
+        return resultado, razon, puntos
+
+    def validar_detalle(self, lat, lon, cancel_event=None):
+        # (resultado, razon, puntos, etapa): resultado es ACEPTADO, RECHAZADO,
+        # RESULTADO_ERROR o CANCELADO; etapa, la que rechazó o falló
+        with self.lock:
+            filtros = list(self.filtros)
+        aceptadas = []
+        resultado = None
+        for etapa in filtros + self.puntuadores:
+            if cancel_event is not None and cancel_event.is_set():
+                resultado = (CANCELADO, "Cancelado", 0, None)
+                break
+            estado, razon, puntos = self._ejecutar(etapa, lat, lon)
+            if estado != ACEPTADO:
+                resultado = (estado, razon, 0, etapa.nombre)
+                break
+            aceptadas.append((self._informe[etapa.nombre], razon, puntos))
+        with self.lock:
+            self._completadas += 1
+            if self.adaptativo and self._completadas % REORDER_EVERY == 0:
+                self._reordenar()
+        if resultado is not None:
+            return resultado
+        aceptadas.sort()
+        razones = [razon for _, razon, _ in aceptadas if razon]
+        return ACEPTADO, ", ".join(razones), sum(p for _, _, p in aceptadas), None
+
+    def validar(self, lat, lon, cancel_event=None):
+        resultado, razon, puntos, _ = self.validar_detalle(lat, lon, cancel_event)
+        return resultado == ACEPTADO, razon, puntos
+
+    def estadisticas(self):
+        with self.lock:
+            return {
+                e.nombre: {
+                    "llamadas": e.llamadas,
+                    "rechazos": e.rechazos,
+                    "errores": e.errores,
+                    "tasa_rechazo": e.tasa_rechazo(),
+                    "coste_medio_s": e.coste_medio(),
+                    "p50_s": e.percentil(50),
+                    "p99_s": e.percentil(99),
+                }
+                for e in self.etapas
+            }
+
+    def resumen(self):
+        partes = [
+            f"{nombre}: {s['rechazos']}/{s['llamadas']} rech., {s['coste_medio_s'] * 1000:.0f} ms"
+            for nombre, s in self.estadisticas().items()
+        ]
+        return "Etapas (" + " > ".join(self.orden_actual()) + ") " + "; ".join(partes)
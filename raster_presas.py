@@ -0,0 +1,54 @@
+import math
+
+import numpy as np
+
+# Rejilla de densidad de presas para la región de muestreo. Se construye una
+# vez por ejecución a partir de las ocurrencias de GBIF y responde el conteo
+# de cualquier ventana con una tabla de sumas acumuladas.
+
+
+class RasterPresas:
+    def __init__(self, bbox, res_deg, lats, lons):
+        min_lat, min_lon, max_lat, max_lon = bbox
+        self.res = res_deg
+        self.min_lat, self.min_lon = min_lat, min_lon
+        self.n_lat = max(1, math.ceil((max_lat - min_lat) / res_deg))
+        self.n_lon = max(1, math.ceil((max_lon - min_lon) / res_deg))
+        self.max_lat = min_lat + self.n_lat * res_deg
+        self.max_lon = min_lon + self.n_lon * res_deg
+        counts, _, _ = np.histogram2d(
+            np.asarray(lats, dtype=float),
+            np.asarray(lons, dtype=float),
+            bins=[self.n_lat, self.n_lon],
+            range=[[self.min_lat, self.max_lat], [self.min_lon, self.max_lon]],
+        )
+        self.total = int(counts.sum())
+        self.integral = np.zeros((self.n_lat + 1, self.n_lon + 1))
+        self.integral[1:, 1:] = counts.cumsum(0).cumsum(1)
+
+    @staticmethod
+    def _radios(lat, radius_km):
+        return radius_km / 111.0, radius_km / (111.0 * np.cos(np.deg2rad(lat)))
+
+    def cubre(self, lat, lon, radius_km):
+        d_lat, d_lon = self._radios(lat, radius_km)
+        return (
+            self.min_lat <= lat - d_lat
+            and lat + d_lat <= self.max_lat
+            and self.min_lon <= lon - d_lon
+            and lon + d_lon <= self.max_lon
+        )
+
+    def contar(self, lat, lon, radius_km):
+        d_lat, d_lon = self._radios(lat, radius_km)
+        # Bordes de la ventana redondeados a la celda más cercana
+        i0, i1 = (
+            int(np.clip(round((v - self.min_lat) / self.res), 0, self.n_lat))
+            for v in (lat - d_lat, lat + d_lat)
+        )
+        j0, j1 = (
+            int(np.clip(round((v - self.min_lon) / self.res), 0, self.n_lon))
+            for v in (lon - d_lon, lon + d_lon)
+        )
+        t = self.integral
+        return int(round(t[i1, j1] - t[i0, j1] - t[i1, j0] + t[i0, j0]))
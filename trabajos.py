@@ -0,0 +1,318 @@
+import io
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+# Cola persistente de trabajos de generación (SQLite). Cada trabajo guarda sus
+# parámetros, cada punto aceptado en el momento en que se valida y, cada pocos
+# candidatos, un punto de control con el estado del muestreo (modelo, celdas
+# ya probadas, cola y generador aleatorio). Un trabajo interrumpido (ventana
+# cerrada, proceso caído) vuelve a la cola y se reanuda desde su último punto
+# de control sin repetir celdas ni perder los puntos aceptados.
+
+PENDIENTE = "pendiente"
+EN_CURSO = "en_curso"
+COMPLETADO = "completado"
+FALLIDO = "fallido"
+CANCELADO = "cancelado"
+
+
+def _propietario():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def _proceso_vivo(propietario):
+    # Sólo se comprueba en esta misma máquina; en Windows no hay una prueba
+    # portable y se espera a que el latido caduque
+    host, _, pid = (propietario or "").rpartition(":")
+    if host != socket.gethostname() or os.name == "nt":
+        return True
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except (PermissionError, ValueError):
+        return True
+    return True
+
+
+def _a_blob(arrays, meta):
+    buf = io.BytesIO()
+    np.savez(buf, _meta=np.array(json.dumps(meta)), **arrays)
+    return buf.getvalue()
+
+
+def _de_blob(blob):
+    with np.load(io.BytesIO(blob)) as datos:
+        arrays = {k: datos[k] for k in datos.files if k != "_meta"}
+        return arrays, json.loads(str(datos["_meta"]))
+
+
+class Trabajo:
+    def __init__(self, cola, fila):
+        self.cola = cola
+        self.id = fila["id"]
+        self.num = fila["num"]
+        self.parametros = json.loads(fila["parametros"] or "{}")
+        self.nombre = self.parametros.get("nombre") or f"trabajo_{self.id}"
+        self.intentos = fila["intentos"]
+
+    def puntos(self):
+        filas = self.cola._consultar(
+            "SELECT lat, lon, score, reason FROM puntos WHERE trabajo = ? "
+            "ORDER BY orden",
+            (self.id,),
+        )
+        return [dict(f) for f in filas]
+
+    def sin_guardar(self):
+        filas = self.cola._consultar(
+            "SELECT lat, lon, score, reason FROM puntos "
+            "WHERE trabajo = ? AND guardado IS NULL ORDER BY orden",
+            (self.id,),
+        )
+        return [dict(f) for f in filas]
+
+    def aceptado(self, punto):
+        # Se confirma en disco antes de avisar a nadie del punto
+        self.cola._ejecutar(
+            [
+                (
+                    "INSERT INTO puntos (trabajo, lat, lon, score, reason, creado) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (
+                        self.id,
+                        punto["lat"],
+                        punto["lon"],
+                        punto["score"],
+                        punto["reason"],
+                        time.time(),
+                    ),
+                ),
+                (
+                    "UPDATE trabajos SET aceptados = aceptados + 1, latido = ? "
+                    "WHERE id = ?",
+                    (time.time(), self.id),
+                ),
+            ]
+        )
+
+    def marcar_guardado(self, punto, uid):
+        self.cola._ejecutar(
+            [
+                (
+                    "UPDATE puntos SET guardado = ? "
+                    "WHERE trabajo = ? AND lat = ? AND lon = ?",
+                    (uid, self.id, punto["lat"], punto["lon"]),
+                )
+            ]
+        )
+
+    def estado(self):
+        filas = self.cola._consultar(
+            "SELECT estado_muestreo FROM trabajos WHERE id = ?", (self.id,)
+        )
+        blob = filas[0]["estado_muestreo"] if filas else None
+        return _de_blob(blob) if blob else None
+
+    def guardar_estado(self, arrays, meta, intentos):
+        self.intentos = intentos
+        self.cola._ejecutar(
+            [
+                (
+                    "UPDATE trabajos SET estado_muestreo = ?, intentos = ?, "
+                    "latido = ? WHERE id = ?",
+                    (_a_blob(arrays, meta), intentos, time.time(), self.id),
+                )
+            ]
+        )
+
+    def latido(self):
+        self.cola._ejecutar(
+            [("UPDATE trabajos SET latido = ? WHERE id = ?", (time.time(), self.id))]
+        )
+
+    def cancelado(self):
+        filas = self.cola._consultar(
+            "SELECT estado FROM trabajos WHERE id = ?", (self.id,)
+        )
+        return not filas or filas[0]["estado"] == CANCELADO
+
+    def terminar(self, estado=COMPLETADO, error=None):
+        # Un trabajo cancelado mientras corría se queda cancelado
+        self.cola._ejecutar(
+            [
+                (
+                    "UPDATE trabajos SET estado = ?, error = ?, actualizado = ? "
+                    "WHERE id = ? AND estado = ?",
+                    (estado, error, time.time(), self.id, EN_CURSO),
+                )
+            ]
+        )
+
+
+class ColaTrabajos:
+    def __init__(self, path, caducidad=600.0):
+        self.path = path
+        self.caducidad = caducidad
+        self.propietario = _propietario()
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self.conn.row_factory = sqlite3.Row
+        with self.lock:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=FULL")
+            self.conn.execute(
+                """CREATE TABLE IF NOT EXISTS trabajos (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    estado TEXT NOT NULL,
+                    num INTEGER NOT NULL,
+                    parametros TEXT,
+                    aceptados INTEGER NOT NULL DEFAULT 0,
+                    intentos INTEGER NOT NULL DEFAULT 0,
+                    estado_muestreo BLOB,
+                    propietario TEXT,
+                    latido REAL,
+                    error TEXT,
+                    creado REAL NOT NULL,
+                    actualizado REAL NOT NULL
+                )"""
+            )
+            self.conn.execute(
+                """CREATE TABLE IF NOT EXISTS puntos (
+                    orden INTEGER PRIMARY KEY AUTOINCREMENT,
+                    trabajo INTEGER NOT NULL,
+                    lat REAL NOT NULL,
+                    lon REAL NOT NULL,
+                    score REAL,
+                    reason TEXT,
+                    guardado INTEGER,
+                    creado REAL NOT NULL
+                )"""
+            )
+            self.conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_puntos_trabajo ON puntos (trabajo)"
+            )
+            self.conn.commit()
+
+    def _consultar(self, sql, params=()):
+        with self.lock:
+            return self.conn.execute(sql, params).fetchall()
+
+    def _ejecutar(self, sentencias):
+        with self.lock:
+            try:
+                for sql, params in sentencias:
+                    self.conn.execute(sql, params)
+                self.conn.commit()
+            except Exception:
+                self.conn.rollback()
+                raise
+
+    def crear(self, num, parametros=None):
+        ahora = time.time()
+        with self.lock:
+            cur = self.conn.execute(
+                "INSERT INTO trabajos (estado, num, parametros, creado, actualizado) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (PENDIENTE, int(num), json.dumps(parametros or {}), ahora, ahora),
+            )
+            self.conn.commit()
+            return cur.lastrowid
+
+    def tomar(self):
+        # Reserva el trabajo pendiente más antiguo, o uno en curso cuyo dueño
+        # ya no da señales de vida
+        ahora = time.time()
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                fila = self.conn.execute(
+                    "SELECT * FROM trabajos WHERE estado = ? "
+                    "OR (estado = ? AND latido < ?) ORDER BY id LIMIT 1",
+                    (PENDIENTE, EN_CURSO, ahora - self.caducidad),
+                ).fetchone()
+                if fila is not None:
+                    self.conn.execute(
+                        "UPDATE trabajos SET estado = ?, propietario = ?, latido = ?, "
+                        "actualizado = ? WHERE id = ?",
+                        (EN_CURSO, self.propietario, ahora, ahora, fila["id"]),
+                    )
+                self.conn.commit()
+            except Exception:
+                self.conn.rollback()
+                raise
+        return Trabajo(self, fila) if fila is not None else None
+
+    def recuperar(self):
+        # Devuelve a la cola los trabajos en curso de procesos que ya no existen
+        filas = self._consultar(
+            "SELECT id, propietario FROM trabajos WHERE estado = ?", (EN_CURSO,)
+        )
+        huerfanos = [f["id"] for f in filas if not _proceso_vivo(f["propietario"])]
+        self._liberar(huerfanos)
+        return len(huerfanos)
+
+    def liberar(self):
+        # Al cerrar: los trabajos de este proceso se reanudarán la próxima vez
+        filas = self._consultar(
+            "SELECT id FROM trabajos WHERE estado = ? AND propietario = ?",
+            (EN_CURSO, self.propietario),
+        )
+        self._liberar([f["id"] for f in filas])
+
+    def _liberar(self, ids):
+        self._ejecutar(
+            [
+                (
+                    "UPDATE trabajos SET estado = ?, actualizado = ? "
+                    "WHERE id = ? AND estado = ?",
+                    (PENDIENTE, time.time(), i, EN_CURSO),
+                )
+                for i in ids
+            ]
+        )
+
+    def cancelar(self, trabajo_id):
+        with self.lock:
+            cur = self.conn.execute(
+                "UPDATE trabajos SET estado = ?, actualizado = ? "
+                "WHERE id = ? AND estado IN (?, ?)",
+                (CANCELADO, time.time(), trabajo_id, PENDIENTE, EN_CURSO),
+            )
+            self.conn.commit()
+            return cur.rowcount > 0
+
+    def reanudar(self, trabajo_id):
+        # Un trabajo fallido o cancelado vuelve a la cola con lo que ya tenía
+        with self.lock:
+            cur = self.conn.execute(
+                "UPDATE trabajos SET estado = ?, error = NULL, actualizado = ? "
+                "WHERE id = ? AND estado IN (?, ?)",
+                (PENDIENTE, time.time(), trabajo_id, FALLIDO, CANCELADO),
+            )
+            self.conn.commit()
+            return cur.rowcount > 0
+
+    def listar(self, estados=None):
+        sql = (
+            "SELECT id, estado, num, aceptados, intentos, parametros, error, "
+            "creado, actualizado FROM trabajos"
+        )
+        params = ()
+        if estados:
+            sql += f" WHERE estado IN ({', '.join('?' * len(estados))})"
+            params = tuple(estados)
+        return [dict(f) for f in self._consultar(sql + " ORDER BY id", params)]
+
+    def pendientes(self):
+        return len(self.listar([PENDIENTE]))
+
+    def close(self):
+        with self.lock:
+            self.conn.close()